@@ -1,14 +1,37 @@
 import streamlit as st
+import copy # For handing background jobs their own copy of the character status
+import time # For story timestamps
 import uuid # For generating unique IDs
-import re # Needed for re.sub in process_input
 
 # Import modules from our organized structure
-from config import API_KEY, MODEL_NAME, OPTIONS_SEPARATOR, GENRE_OPTIONS
-from core.ai_interactions import get_cerebras_client, run_narrative_step, available_functions_def, available_functions_map
+from config import (API_KEY, MODEL_NAME, OPTIONS_SEPARATOR, GENRE_OPTIONS, TURN_STORE_COMPRESS_AFTER, DEBUG_PANELS,
+                    BACKGROUND_JOBS, JOB_TIMEOUT_SECONDS, JOB_POLL_INTERVAL_SECONDS, STRUCTURED_OUTPUT,
+                    HISTORY_MAX_TURNS, MEMORY_TOP_K, MEMORY_PASSAGE_CHARS, SCENE_FULL_CAST_MAX,
+                    SCENE_WINDOW_TURNS, SCENE_MAX_ACTIVE)
+from core.ai_interactions import get_llm_client, generate_turn
+from core.jobs import get_job_manager, turn_request_key, JOB_RUNNING, JOB_DONE, JOB_CANCELLED
+from core.generation_policy import TURN_OPENING, TURN_OPTION, TURN_FREE_TEXT, POLICY_STATS
+from core.scheduler import get_scheduler
+from core.structured_output import STRUCTURED_STATS
+from core.routing import ROUTE_STATS
+from core.overload import get_overload_controller
 from core.helpers import parse_options, export_story
+from core.prompts import build_system_prompt, build_initial_scene_prompt, build_option_prompt, build_free_text_prompt
+from core.scene_pool import get_opening_scene_pool
+from core.enrichment import get_character_enricher
+from core.turn_store import TurnStore, session_memory_report, narrative_from_response, user_display_text
+from core.profiler import get_rerun_profiler
+from core.turn_log import log_turn
+from core.scene import scene_characters, format_scene_block
+from core.prompt_profiler import add_prompt_parts, PARTS
+from core.archive import get_story_archive
+from core.idle_sessions import get_idle_session_manager
+from core.session_store import get_session_store, sync_from_store, sync_to_store
 from ui.styling import apply_custom_css, apply_theme_colors
 from ui.components import display_character_status
 from ui.setup_view import show_character_selection
+from ui.profile_view import show_rerun_profile
+from ui.gallery_view import show_gallery
 
 # --- Page Configuration & Styling ---
 st.set_page_config(
@@ -18,76 +41,227 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Opt-in rerun profiler (STORYLAB_PROFILE=1 or ?profile=1); a no-op otherwise
+profiler = get_rerun_profiler()
+profiler.start_rerun()
+
 # Apply main custom CSS
+profiler.checkpoint("css")
 apply_custom_css()
 
-# --- Initialize Cerebras Client ---
-client = get_cerebras_client(API_KEY)
+# --- Initialize Model Client ---
+profiler.checkpoint("shared_resources")
+client = get_llm_client(API_KEY)
 
 if client is None:
     st.stop() # Stop the app if the client couldn't be initialized
 
-# --- Function to process user input or option selection ---
-def process_input(input_text: str, is_option_choice: bool = False):
-    """Processes user input (text or option choice) and runs a narrative step."""
+# Background pool of pre-generated opening scenes for the preset casts (shared by all sessions)
+scene_pool = get_opening_scene_pool(client)
+
+# Generates details for custom characters when a story starts (None when enrichment is off)
+character_enricher = get_character_enricher(client)
+
+# Archive of finished stories for the gallery (None when archiving is off)
+archive = get_story_archive()
+
+# Shared executor for model calls, so script threads never block on the model
+job_manager = get_job_manager()
+
+# Spills the stories of long-idle tabs to disk (None when eviction is off)
+idle_sessions = get_idle_session_manager()
+
+# Shared story storage across app replicas (None keeps stories in this process only)
+session_store = get_session_store()
+
+# Stable per-session id, used by the shared scheduler to share model capacity fairly between sessions.
+# With a session store it also lives in the URL, so any replica (or a reload) can pick the story up.
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = (st.query_params.get("sid") if session_store else None) or uuid.uuid4().hex
+if session_store:
+    st.query_params["sid"] = st.session_state.session_id
+    sync_from_store(session_store, st.session_state.session_id)
+
+# --- Idle session eviction ---
+def touch_session():
+    """Marks this session active, loading its story back first if it was spilled while idle."""
+    if idle_sessions is not None and "turn_store" in st.session_state:
+        idle_sessions.touch(st.session_state.session_id, st.session_state.turn_store)
+
+
+# --- Scene tracking for large casts ---
+def current_scene():
+    """Characters in the current scene, or None when the cast is small enough to show in full."""
+    character_status = st.session_state.character_status
+    if len(character_status) <= SCENE_FULL_CAST_MAX:
+        return None
+    # Recomputed only when the story moves (a new turn, or a rewind to another one)
+    head = st.session_state.turn_store.head
+    head_id = head.node_id if head else None
+    cached = st.session_state.get("scene_cache")
+    if cached is None or cached[0] != head_id:
+        cached = st.session_state.scene_cache = (head_id, scene_characters(
+            st.session_state.turn_store, character_status, SCENE_WINDOW_TURNS, SCENE_MAX_ACTIVE))
+    return cached[1]
+
+
+# --- Turn execution (background job or inline) ---
+def start_turn(input_to_model: str, turn_kind: str, user_text: str = None, is_option: bool = False,
+               request_key: str = None):
+    """Starts a narrative step for the current branch, as a background job when enabled."""
+    # Recent turns plus whatever older turns best match the user's input (and, for large casts,
+    # who is in the scene instead of the whole cast)
+    scene = current_scene()
+    history = st.session_state.turn_store.api_messages(
+        max_turns=get_overload_controller().history_turns(HISTORY_MAX_TURNS), memory_query=user_text, memory_k=MEMORY_TOP_K,
+        memory_chars=MEMORY_PASSAGE_CHARS,
+        scene_note=format_scene_block(scene, st.session_state.character_status) if scene else None)
+    # The step works on its own copies, so nothing in session state is touched off-thread
+    turn_args = (client, input_to_model, history,
+                 copy.deepcopy(st.session_state.character_status))
+    pending = {"user_text": user_text, "is_option": is_option, "key": request_key}
     st.session_state.processing = True
 
-    # Add user message to chat history with unique ID
-    message_id = str(uuid.uuid4())
+    if BACKGROUND_JOBS:
+        pending["job_id"] = job_manager.submit(
+            generate_turn, *turn_args, session_id=st.session_state.session_id, turn_kind=turn_kind,
+            timeout=JOB_TIMEOUT_SECONDS, key=request_key)
+        st.session_state.pending_turn = pending
+    else:
+        apply_turn_result(pending, generate_turn(*turn_args, session_id=st.session_state.session_id,
+                                                 turn_kind=turn_kind))
+
+
+def apply_turn_result(pending: dict, result: dict):
+    """Records a finished narrative step in the turn store; a failed one is only logged and reported."""
+    if result.get("error"):
+        # The error isn't part of the story: nothing is recorded, so the player can simply try again
+        head = st.session_state.turn_store.head
+        log_turn(st.session_state.session_id, st.session_state.get("theme"), head.number + 1 if head else 0,
+                 result["metrics"])
+        st.session_state.processing = False
+        st.session_state.turn_notice = result["error"]
+        return
+    # Record the turn once; the display and API views are derived from it
+    turn = st.session_state.turn_store.add_turn(
+        result["new_messages"], result["response_text"], result["options"],
+        user_text=pending["user_text"], is_option=pending["is_option"],
+        character_status=result["character_status"]
+    )
+    if result.get("metrics"):
+        # Pooled opening scenes carry no metrics; everything generated for this session does
+        log_turn(st.session_state.session_id, st.session_state.get("theme"), turn.number, result["metrics"])
+        if "prompt_parts" in result["metrics"]:
+            # Prompt token breakdown (STORYLAB_PROMPT_ATTRIBUTION) for the debug panel
+            st.session_state.last_prompt_parts = result["metrics"]["prompt_parts"]
+            add_prompt_parts(st.session_state.setdefault("session_prompt_parts", {}), result["metrics"]["prompt_parts"])
+    if DEBUG_PANELS and result.get("reasoning"):
+        # Reasoning is never part of the story; keep it aside for the debug view only
+        st.session_state.setdefault("reasoning_traces", {})[turn.node_id] = result["reasoning"]
+    st.session_state.character_status = result["character_status"]
+    st.session_state.processing = False
+
+
+def collect_pending_turn() -> bool:
+    """Applies a finished background turn, if any. Returns True when the page needs a full rerun."""
+    pending = st.session_state.get("pending_turn")
+    if not pending:
+        return False
+    state, value = job_manager.poll(pending["job_id"])
+    if state == JOB_RUNNING:
+        return False
+
+    del st.session_state.pending_turn
+    job_manager.discard(pending["job_id"])
+    if state == JOB_DONE:
+        apply_turn_result(pending, value)
+    else:
+        st.session_state.processing = False
+        if state != JOB_CANCELLED:
+            # Failed, timed out, or lost (e.g. server restart) - let the user try again
+            st.session_state.turn_notice = "The story got stuck on that turn. Please try again."
+    return True
+
+
+def start_opening_scene():
+    """Generates the opening scene (with emoji instructions and simple language)."""
+    start_turn(build_initial_scene_prompt(list(st.session_state.character_status.keys())), TURN_OPENING)
+
+
+# --- Archiving finished stories ---
+def archive_current_story():
+    """Saves the current story to the gallery archive (once per state of the story)."""
+    turn_store = st.session_state.get("turn_store")
+    if archive is None or turn_store is None or turn_store.head is None:
+        return None
+    fingerprint = (len(turn_store.nodes), turn_store.head.node_id)
+    if st.session_state.get("archived_fingerprint") == fingerprint:
+        return None # Already archived as it is now
+    messages = [{"role": m["role"], "content": m["content"]} for m in turn_store.display_messages()]
+    opening = next((m["content"] for m in messages if m["role"] == "assistant"), "")
+    story_id = archive.append(
+        {"messages": messages, "character_status": st.session_state.character_status},
+        genre=st.session_state.theme, characters=list(st.session_state.character_status),
+        turns=turn_store.turn_count, started_at=st.session_state.get("story_started_at"),
+        title=opening[:80] + "..." if len(opening) > 80 else opening)
+    st.session_state.archived_fingerprint = fingerprint
+    return story_id
+
+
+# --- Function to process user input or option selection ---
+def process_input(input_text: str, is_option_choice: bool = False, message_id: str = None,
+                  option_index: int = None) -> bool:
+    """Processes user input (text or option choice) and runs a narrative step.
+
+    `message_id` is the story message being answered. Returns False when the request was a duplicate.
+    """
+    touch_session() # Callbacks run before the script body, so the story may still be on disk
+    # Fast double clicks and repeated Enter arrive as separate reruns. Each request is keyed by
+    # the message it answers, so a repeat while the first is in flight (or after it has already
+    # been answered) is served by the first request instead of starting another model call.
+    request_key = turn_request_key(st.session_state.session_id, message_id, option_index,
+                                   None if is_option_choice else input_text)
+    head = st.session_state.turn_store.head
+    if head is None:
+        return False # No story message to answer yet (e.g. the opening failed)
+    if 'pending_turn' in st.session_state or message_id != f"a{head.node_id}":
+        if request_key == st.session_state.get("last_request_key"):
+            job_manager.record_duplicate() # Only repeats of the same request count as suppressed
+        return False
+    st.session_state.last_request_key = request_key
+
     if is_option_choice:
-        # Remove any leading emoji and whitespace for cleaner history display
-        display_text = re.sub(r'^\s*[^\w\s]+\s*', '', input_text).strip()
-        st.session_state.chat_messages.append({
-            "id": message_id,
-            "role": "user",
-            "content": f"I choose: {display_text}",
-            "turn": st.session_state.turn
-        })
         # Craft the prompt for the model, asking for functions and options
-        input_to_model = f"The user chooses this option: '{input_text}'. Describe the events that unfold as a result in the narrative. Actively use `move_character` and `speak_to_character` tools where appropriate to drive the action. Ensure at least one paragraph of detail, and then provide 3 new options following the '{OPTIONS_SEPARATOR}' separator. Each option should start with a relevant emoji that represents that choice. Remember to use simple, everyday language that both kids and adults can understand easily."
+        input_to_model = build_option_prompt(input_text)
     else:
-        st.session_state.chat_messages.append({
-            "id": message_id,
-            "role": "user",
-            "content": input_text,
-            "turn": st.session_state.turn
-        })
         # Add instruction for functions, emojis in the options and language simplicity
-        input_to_model = f"{input_text}\n\nDescribe the events that unfold. Actively use `move_character` and `speak_to_character` tools where appropriate to drive the action. Remember to provide 3 options after your response, each option should start with a relevant emoji that represents that choice. Use simple, everyday language that both kids and adults can understand easily."
+        input_to_model = build_free_text_prompt(input_text)
 
+    turn_kind = TURN_OPTION if is_option_choice else TURN_FREE_TEXT
+    start_turn(input_to_model, turn_kind, user_text=input_text, is_option=is_option_choice, request_key=request_key)
+    return True
 
-    # Increment turn counter
-    st.session_state.turn += 1
 
-    # Run the narrative step using the core logic function
-    full_response_text, updated_history = run_narrative_step(
-        client=client, # Pass the client instance
-        user_input_to_model=input_to_model,
-        narrative_history=st.session_state.narrative_history,
-        available_functions=available_functions_def,
-        available_functions_map=available_functions_map
-    )
+def submit_chat_input(message_id: str):
+    """Chat form callback: runs the typed action before the next render."""
+    user_input = st.session_state.get("chat_input")
+    if user_input:
+        process_input(user_input, is_option_choice=False, message_id=message_id)
 
-    # Update the main narrative history in session state
-    st.session_state.narrative_history = updated_history
-
-    # Parse the full response for narrative and options using the helper function
-    # Use the global OPTIONS_SEPARATOR
-    narrative_part, _, current_options_list = parse_options(full_response_text, OPTIONS_SEPARATOR)
-
-    # Add AI response to chat history for display with unique ID
-    ai_message_id = str(uuid.uuid4())
-    st.session_state.chat_messages.append({
-        "id": ai_message_id,
-        "role": "assistant",
-        "content": narrative_part,
-        "options": current_options_list,
-        "turn": st.session_state.turn
-    })
-
-    # Update options list
-    st.session_state.current_options = current_options_list
-    st.session_state.processing = False
+
+# --- Loading indicator that polls the background job ---
+@st.fragment(run_every=JOB_POLL_INTERVAL_SECONDS)
+def show_pending_turn():
+    """Shows progress for the running turn and reruns the page once its result is in."""
+    touch_session()
+    if collect_pending_turn():
+        st.rerun() # Full app rerun to render the new turn
+    st.markdown("<div class='loading-dots'>Thinking...</div>", unsafe_allow_html=True)
+    pending = st.session_state.get("pending_turn")
+    if pending and st.button("Cancel", key="cancel_turn"):
+        job_manager.cancel(pending["job_id"])
+        collect_pending_turn()
+        st.rerun()
 
 
 # --- Main Application Flow ---
@@ -98,86 +272,69 @@ st.markdown("<div class='chat-title'>🧪 StoryLab</div>", unsafe_allow_html=Tru
 if 'story_started' not in st.session_state:
     st.session_state.story_started = False
 
+# The gallery of finished stories replaces the page while it's open
+profiler.checkpoint("story_setup")
+if archive is not None and st.session_state.get("show_gallery"):
+    show_gallery(archive)
+    st.stop()
+
 # If we're in character selection mode, show the interface and exit
 if not st.session_state.story_started:
-    show_character_selection()
+    if archive is not None and len(archive) and st.button("📚 Browse the Story Gallery", key="open_gallery_setup"):
+        st.session_state.show_gallery = True
+        st.rerun()
+    show_character_selection(character_enricher)
     st.stop() # Stop execution here - don't show the chat interface yet
 
 # If we get here, we're in story mode - initialize if needed
-if 'narrative_history' not in st.session_state:
-    st.session_state.narrative_history = []
-
-    # Get character names for the system prompt
-    character_names = list(st.session_state.character_status.keys())
-    character_descriptions = [
-        f"'{name}' (a {st.session_state.character_status[name]['role']})" for name in character_names]
-    character_list = ", ".join(character_descriptions)
-
+if 'turn_store' not in st.session_state:
     # Initialize with system message - UPDATED FOR MORE FUNCTION CALLING
-    system_message_content = f"""You are the narrator and controller of the characters in this {st.session_state.theme.lower()} world. The main characters are {character_list}. Your primary role is to tell an engaging story based on user choices and actively manage the characters.
-
-In this world, characters are dynamic! They frequently move between locations and talk to each other. **It is essential that you represent these actions using the provided tools.**
-
-- **Whenever a character changes location**, use the `move_character` tool (e.g., if Elara goes to the market, call `move_character` with character_name='Elara', location='the Market').
-- **Whenever one character speaks directly to another character**, use the `speak_to_character` tool (e.g., if Kael asks Elara a question, call `speak_to_character` with speaking_character='Kael', target_character='Elara', message='Are you ready?').
-
-After describing the scene or events resulting from a tool call or user input, *always* provide at least one paragraph of narrative. Then, *always* provide exactly 3 distinct potential options for the user to choose from to continue the story, formatted after the '{OPTIONS_SEPARATOR}' separator. Each option should start with a relevant emoji that represents that choice.
-
-Remember to use simple, everyday language suitable for readers ages 8 and up. Keep sentences short and words common.
-"""
-    st.session_state.narrative_history.append({"role": "system", "content": system_message_content})
-
-    # Initialize chat messages for display (separate from narrative history used for the AI)
-    st.session_state.chat_messages = []
-
-    # Initialize turn counter and processing flag
-    st.session_state.turn = 0
-    st.session_state.processing = True
-    st.session_state.current_options = []
-
-    # Create a comma-separated list of character names
-    character_names_list = ", ".join(character_names)
-
-    # Generate initial scene - with emoji instructions and simple language
-    # Also slightly rephrased to encourage immediate action/interaction
-    initial_scene_prompt_to_model = f"Describe the starting scene with {character_names_list}. Have them begin interacting or moving right away. Ensure at least one paragraph of detail, and then provide the first 3 options following the '{OPTIONS_SEPARATOR}' separator. Each option should start with a relevant emoji that represents that choice. Use simple, everyday language that both kids and adults can understand easily."
-
+    system_message_content = build_system_prompt(st.session_state.theme, st.session_state.character_status)
+
+    # One compact record per turn; chat messages for display and the model history are views of it
+    st.session_state.turn_store = TurnStore(system_message_content, st.session_state.character_status,
+                                            compress_after=TURN_STORE_COMPRESS_AFTER)
+    st.session_state.story_started_at = time.time()
+
+    # Common casts have pre-generated opening scenes; take one if ready
+    pooled_scene = scene_pool.take(st.session_state.theme, st.session_state.character_status) if scene_pool else None
+
+    if pooled_scene:
+        # Parse initial response using the helper function
+        # Use the global OPTIONS_SEPARATOR
+        _, _, initial_options_list = parse_options(pooled_scene.response_text, OPTIONS_SEPARATOR)
+        # Everything after the system message belongs to the opening turn
+        apply_turn_result({"user_text": None, "is_option": False}, {
+            "response_text": pooled_scene.response_text,
+            "new_messages": pooled_scene.narrative_history[1:],
+            "options": initial_options_list,
+            "character_status": pooled_scene.character_status,
+        })
+    else:
+        start_opening_scene()
 
-    # Generate initial scene using the core logic function
-    full_initial_response_content, updated_history_after_initial = run_narrative_step(
-        client=client, # Pass the client instance
-        user_input_to_model=initial_scene_prompt_to_model,
-        narrative_history=st.session_state.narrative_history,
-        available_functions=available_functions_def,
-        available_functions_map=available_functions_map
-    )
-    st.session_state.narrative_history = updated_history_after_initial
-
-    # Parse initial response using the helper function
-    # Use the global OPTIONS_SEPARATOR
-    narrative_part, _, initial_options_list = parse_options(full_initial_response_content, OPTIONS_SEPARATOR)
-
-    # Add to chat messages for display with unique ID
-    initial_message_id = str(uuid.uuid4())
-    st.session_state.chat_messages.append({
-        "id": initial_message_id,
-        "role": "assistant",
-        "content": narrative_part,
-        "options": initial_options_list,
-        "turn": 0
-    })
-    st.session_state.current_options = initial_options_list
-    st.session_state.processing = False
+profiler.checkpoint("collect_turn")
+touch_session()
+# Pick up a background turn that finished since the last rerun. The processing flag is
+# derived from the pending job on every rerun, so it can't get stuck.
+collect_pending_turn()
+st.session_state.processing = 'pending_turn' in st.session_state
 
 # Apply theme colors based on the selected theme in session state
+profiler.checkpoint("theme_css")
 if 'theme' in st.session_state:
     apply_theme_colors(st.session_state.theme)
 else:
     # Fallback to default theme if somehow not set (shouldn't happen if setup runs)
     apply_theme_colors(GENRE_OPTIONS[0])
 
+# Chat transcript for this rerun, derived from the turn store
+profiler.checkpoint("display_messages")
+chat_messages = st.session_state.turn_store.display_messages()
+
 
 # --- Sidebar with Theme Selection and Timeline ---
+profiler.checkpoint("sidebar_timeline")
 with st.sidebar:
     st.title("Story Settings")
 
@@ -194,9 +351,10 @@ with st.sidebar:
 
     # Story timeline
     st.markdown("### 📜 Story Timeline")
-    if st.session_state.chat_messages:
+    if chat_messages:
+        latest_node = chat_messages[-1]["node"]
         # Display messages in reverse order to show latest at the top of the timeline
-        for msg in reversed(st.session_state.chat_messages):
+        for msg in reversed(chat_messages):
             if msg["role"] == "assistant":
                 turn = msg.get("turn", 0)
                 # Truncate the content for display
@@ -207,11 +365,29 @@ with st.sidebar:
                     <div class="timeline-content">{short_content}</div>
                 </div>
                 """, unsafe_allow_html=True)
+                # Rewinding moves the story back to this turn so another option can be chosen;
+                # the turns after it stay available as a branch
+                if msg["node"] != latest_node:
+                    if st.button("↩️ Rewind here", key=f"rewind_{msg['node']}", disabled=st.session_state.processing):
+                        st.session_state.character_status = st.session_state.turn_store.rewind(msg["node"])
+                        st.rerun()
+
+    # Other branches created by rewinding
+    branch_tips = st.session_state.turn_store.branch_tips()
+    if branch_tips:
+        with st.expander(f"🌿 Other Branches ({len(branch_tips)})"):
+            for tip in branch_tips:
+                tip_text = narrative_from_response(tip.payload()[2])
+                st.caption(f"Turn {tip.number}: {tip_text[:50]}")
+                if st.button("Switch to this branch", key=f"branch_{tip.node_id}", disabled=st.session_state.processing):
+                    st.session_state.character_status = st.session_state.turn_store.rewind(tip.node_id)
+                    st.rerun()
 
 
     # Export story button (uses core/helpers)
+    profiler.checkpoint("sidebar_export")
     st.markdown("### 📝 Export Your Story")
-    story_text = export_story(st.session_state.chat_messages) # Pass chat messages to the helper
+    story_text = export_story(chat_messages) # Pass chat messages to the helper
     st.download_button(
         label="Download Story Text",
         data=story_text,
@@ -220,38 +396,92 @@ with st.sidebar:
         key="download_story"
     )
 
+    # Developer metrics (debug only): memory per session for server sizing, model call limits and queues
+    profiler.checkpoint("sidebar_debug")
+    if profiler.enabled:
+        show_rerun_profile(profiler, st.session_state.session_id)
+    if DEBUG_PANELS:
+        with st.expander("🛠️ Debug Metrics"):
+            st.markdown("**Session memory**")
+            st.json({"this_session": st.session_state.turn_store.memory_report(),
+                     "process": session_memory_report(),
+                     "idle_sessions": idle_sessions.snapshot() if idle_sessions else None})
+            st.markdown("**Output length per turn type**")
+            st.json(POLICY_STATS.snapshot())
+            if STRUCTURED_OUTPUT:
+                st.markdown("**Structured output (parsed vs. text fallback)**")
+                st.json(STRUCTURED_STATS)
+            if "session_prompt_parts" in st.session_state:
+                st.markdown("**Prompt tokens by part (estimated)**")
+                st.table({"part": list(PARTS),
+                          "last turn": [st.session_state.last_prompt_parts.get(part, 0) for part in PARTS],
+                          "session": [st.session_state.session_prompt_parts.get(part, 0) for part in PARTS]})
+            st.markdown("**Model routes (calls, fallbacks, latency)**")
+            st.json(ROUTE_STATS.snapshot())
+            backend_client = getattr(client, "client", client) # Unwrap a recording cassette
+            if hasattr(backend_client, "snapshot"):
+                st.markdown("**Model backends (latency, errors, benched)**")
+                st.json(backend_client.snapshot())
+            st.markdown("**Scheduler and jobs**")
+            st.json({"overload": get_overload_controller().snapshot(),
+                     "scheduler": get_scheduler().snapshot(), "jobs": job_manager.snapshot(),
+                     "scene_pool": scene_pool.snapshot() if scene_pool else None,
+                     "character_enrichment": character_enricher.snapshot() if character_enricher else None})
+
+    # Story gallery: finished stories are archived and can be read back later
+    if archive is not None:
+        st.markdown("### 📚 Story Gallery")
+        if st.button("Save to Gallery", key="archive_story", disabled=st.session_state.processing):
+            st.toast("Story saved to the gallery." if archive_current_story() else "This story is already saved.")
+        if st.button("Open Gallery", key="open_gallery"):
+            st.session_state.show_gallery = True
+            st.rerun()
+
     # Restart button (resets session state)
     st.markdown("### 🔄 Reset Adventure")
     if st.button("New Story with New Characters", key="restart_btn"):
+        # Keep the finished story in the gallery
+        archive_current_story()
+        # Forget the stored story too, and start over under a new session id
+        if session_store:
+            session_store.delete(st.session_state.session_id)
+            del st.query_params["sid"]
         # Clear all keys from session state to reset the app
         for key in list(st.session_state.keys()):
             del st.session_state[key]
         st.rerun() # Rerun to start from the character selection screen
 
 # --- Display Character Status Cards ---
-display_character_status() # Uses ui/components
+profiler.checkpoint("character_cards")
+display_character_status(active=current_scene()) # Uses ui/components
 
 # --- Main Chat Interface ---
 
 # Chat Display
+profiler.checkpoint("chat_loop")
 chat_container = st.container()
 with chat_container:
     # Display messages in order
-    for idx, message in enumerate(st.session_state.chat_messages):
+    for idx, message in enumerate(chat_messages):
         if message["role"] == "user":
             st.markdown(f"<div class='user-message'>{message['content']}</div>", unsafe_allow_html=True)
         else:
             # Display AI message with typing effect for the latest message
-            if idx == len(st.session_state.chat_messages) - 1 and message["role"] == "assistant" and not st.session_state.processing:
+            if idx == len(chat_messages) - 1 and message["role"] == "assistant" and not st.session_state.processing:
                  # Only apply typing effect if it's the last message and not currently processing
                  st.markdown(f"<div class='ai-message'><span class='typing-effect'>{message['content']}</span></div>", unsafe_allow_html=True)
             else:
                  # Regular display for older messages or while processing
                  st.markdown(f"<div class='ai-message'>{message['content']}</div>", unsafe_allow_html=True)
 
+            # Model reasoning for this turn (debug only, never stored in the story)
+            reasoning = st.session_state.get("reasoning_traces", {}).get(message.get("node"))
+            if DEBUG_PANELS and reasoning:
+                with st.expander("🧠 Model reasoning"):
+                    st.text(reasoning)
 
             # Display options if present (only for the last message and if not processing)
-            if "options" in message and message["options"] and idx == len(st.session_state.chat_messages) - 1 and not st.session_state.processing:
+            if "options" in message and message["options"] and idx == len(chat_messages) - 1 and not st.session_state.processing:
                 st.markdown("<div class='options-container'>", unsafe_allow_html=True)
                 st.markdown("<div class='turn-indicator'>Choose your next action:</div>", unsafe_allow_html=True)
 
@@ -265,37 +495,53 @@ with chat_container:
                     with cols[i % len(cols)]: # Cycle through the columns
                         # Use a unique key combining message ID and option index
                         unique_key = f"option_{message['id']}_{i}"
-                        # Disable buttons if processing is ongoing
-                        if st.button(button_label, key=unique_key, disabled=st.session_state.processing, use_container_width=True):
-                            process_input(option, is_option_choice=True)
-                            st.rerun() # Trigger a rerun to update the UI
-
+                        # Disable buttons if processing is ongoing. The click is handled in a callback,
+                        # before the next run renders anything, so each turn renders once.
+                        st.button(button_label, key=unique_key, disabled=st.session_state.processing,
+                                  use_container_width=True, on_click=process_input,
+                                  args=(option, True, message["id"], i))
 
                 st.markdown("</div>", unsafe_allow_html=True)
 
 # --- Loading indicator (only shown when processing) ---
+profiler.checkpoint("pending_turn")
 if st.session_state.processing:
-    # Use a placeholder to keep the input area visible while loading
-    with st.container(): # Or use a specific area if needed
-         st.markdown("<div class='loading-dots'>Thinking...</div>", unsafe_allow_html=True)
+    # Show the user's message right away while the model works on it
+    pending = st.session_state.pending_turn
+    if pending["user_text"] is not None:
+        pending_text = user_display_text(pending["user_text"], pending["is_option"])
+        st.markdown(f"<div class='user-message'>{pending_text}</div>", unsafe_allow_html=True)
+    show_pending_turn()
     # Disable input while processing
     disable_input = True
 else:
     disable_input = False
 
+# Tell the user if the last turn could not be completed
+if 'turn_notice' in st.session_state:
+    st.warning(st.session_state.pop('turn_notice'))
+# A failed opening scene leaves nothing to answer yet; offer to generate it again
+if st.session_state.turn_store.head is None and not st.session_state.processing:
+    st.button("Try the opening scene again", key="retry_opening", on_click=start_opening_scene)
+
 
 # --- Chat Input ---
 # Place input form at the bottom
+profiler.checkpoint("chat_input")
 with st.form(key="chat_input_form", clear_on_submit=True):
-    user_input = st.text_input("Type your own action:",
-                               placeholder="Enter your own action or response...",
-                               key="chat_input",
-                               disabled=disable_input) # Disable input while processing
+    st.text_input("Type your own action:",
+                  placeholder="Enter your own action or response...",
+                  key="chat_input",
+                  disabled=disable_input) # Disable input while processing
 
     # Hidden submit button (users can press Enter)
     # Make the submit button also disabled while processing
-    submitted = st.form_submit_button("Send", type="primary", disabled=disable_input)
+    st.form_submit_button("Send", type="primary", disabled=disable_input, on_click=submit_chat_input,
+                          args=(chat_messages[-1]["id"] if chat_messages else None,))
+
+# Save the story for other replicas if this rerun changed it
+if session_store:
+    profiler.checkpoint("session_store")
+    sync_to_store(session_store, st.session_state.session_id)
 
-    if submitted and user_input and not st.session_state.processing:
-        process_input(user_input, is_option_choice=False)
-        st.rerun() # Trigger a rerun to update the UI
+profiler.finish_rerun()
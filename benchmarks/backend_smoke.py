@@ -0,0 +1,70 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# --- OpenAI-compatible Backend Smoke Check ---
+# Usage: python -m benchmarks.backend_smoke
+#
+# Serves minimal OpenAI-style responses from a local HTTP server (no
+# tool_calls, finish_reason or usage fields, the way many servers answer a
+# plain-text turn) and runs them through generate_turn, streamed and not, over
+# OpenAICompatibleBackend. A missing field crashes the turn here instead of
+# on the first real request.
+
+TURN_TEXT = "The lanterns flicker as Elara steps inside.\n\n--- Options ---\n1. 🌲 Go left\n2. 🗣️ Call out\n3. 🔍 Look around"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.send_response(200)
+        if not request.get("stream"):
+            body = json.dumps({"choices": [{"message": {"content": TURN_TEXT}}]}).encode("utf-8")
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for line in TURN_TEXT.splitlines(keepends=True):
+            self.wfile.write(f"data: {json.dumps({'choices': [{'delta': {'content': line}}]})}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def log_message(self, *args):
+        pass
+
+
+def run_turn(base_url: str, stream: bool) -> dict:
+    """One option turn through generate_turn over the OpenAI-compatible backend."""
+    from core.ai_interactions import generate_turn
+    from core.backends import BackendSelector, OpenAICompatibleBackend
+    from core.generation_policy import get_policy, TURN_OPTION
+    from core.prompts import build_option_prompt
+    policy = get_policy(TURN_OPTION)
+    configured, policy.stream = policy.stream, stream
+    character_status = {"Elara": {"role": "Brave Adventurer", "location": "Starting Location"}}
+    history = [{"role": "system", "content": "You are the narrator."}]
+    try:
+        client = BackendSelector([OpenAICompatibleBackend(base_url)])
+        return generate_turn(client, build_option_prompt("Open the door"), history, character_status)
+    finally:
+        policy.stream = configured
+
+
+def main():
+    server = HTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}/v1"
+    try:
+        for stream in (False, True):
+            result = run_turn(base_url, stream)
+            label = "streamed" if stream else "plain"
+            if result.get("error") or not result["metrics"]["ok"] or len(result["options"]) != 3:
+                raise SystemExit(f"{label}: turn failed: {result.get('error') or result['response_text']}")
+            print(f"{label}: ok, {len(result['options'])} options, {result['metrics']['model_calls']} model call(s)")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import importlib
+import itertools
+import time
+from types import SimpleNamespace
+
+from config import OPTIONS_SEPARATOR
+
+# --- Fake Completion Client ---
+# Stands in for the Cerebras client in the UI benchmarks: same
+# `client.chat.completions.create(...)` surface, canned story turns, no
+# network. Streamed requests get the text back in small chunks, the way the
+# real API delivers it. An optional delay simulates model latency.
+
+
+def fake_turn_text(number: int) -> str:
+    """A story turn in the format the app expects: narrative, separator, three options."""
+    narrative = (f"Turn {number}: the lantern light flickers as the companions press on through the old archive. "
+                 "Dust drifts between the shelves, and somewhere ahead a door creaks open. ") * 3
+    options = "\n".join(f"{i}. ✨ Option {i} for turn {number}" for i in range(1, 4))
+    return f"{narrative.strip()}\n\n{OPTIONS_SEPARATOR}\n{options}"
+
+
+class _Completions:
+    def __init__(self, client):
+        self._client = client
+
+    def create(self, model: str = None, stream: bool = False, **kwargs):
+        client = self._client
+        client.calls += 1
+        if client.delay:
+            time.sleep(client.delay)
+        text = fake_turn_text(next(client._turns))
+        usage = SimpleNamespace(prompt_tokens=sum(len(str(m.get("content") or "")) // 4
+                                                  for m in kwargs.get("messages", [])),
+                                completion_tokens=len(text) // 4, total_tokens=None)
+        usage.total_tokens = usage.prompt_tokens + usage.completion_tokens
+        if stream:
+            return self._chunks(text, usage)
+        message = SimpleNamespace(role="assistant", content=text, tool_calls=None)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")], usage=usage)
+
+    @staticmethod
+    def _chunks(text: str, usage):
+        lines = text.splitlines(keepends=True)
+        for i, line in enumerate(lines):
+            delta = SimpleNamespace(role="assistant" if i == 0 else None, content=line, tool_calls=None)
+            last = i == len(lines) - 1
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta, finish_reason="stop" if last else None)],
+                                  usage=usage if last else None)
+
+
+class FakeCerebras:
+    """Drop-in replacement for `cerebras.cloud.sdk.Cerebras` (accepts and ignores the api key)."""
+
+    delay = 0.0 # Seconds per model call
+
+    def __init__(self, api_key: str = None, **kwargs):
+        self.calls = 0
+        self._turns = itertools.count()
+        self.chat = SimpleNamespace(completions=_Completions(self))
+
+
+def install_fake_client():
+    """Replaces the Cerebras SDK class wherever the app imports it (older checkouts included)."""
+    for module_name in ("core.backends", "core.ai_interactions"):
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError:
+            continue
+        if hasattr(module, "Cerebras"):
+            module.Cerebras = FakeCerebras
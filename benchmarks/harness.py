@@ -0,0 +1,93 @@
+import os
+import sys
+import time
+
+# --- Headless App Harness ---
+# Shared by the UI benchmarks: runs app.py under Streamlit's AppTest with the
+# fake model client (benchmarks/fake_client.py), inline turns (unless a
+# benchmark asks for background jobs) and the rerun profiler on, so each
+# measurement is deterministic and needs no network.
+
+BENCHMARK_ENV = {
+    "STORYLAB_BACKGROUND_JOBS": "0", # Turns finish inside the run that starts them
+    "STORYLAB_SCENE_POOL_DEPTH": "0",
+    "STORYLAB_ENRICH_CHARACTERS": "0", # Setup timings measure the UI, not the model
+    "STORYLAB_PROFILE": "1",
+    "STORYLAB_SESSION_STORE": "",
+    "STORYLAB_ARCHIVE_DIR": "",
+    "STORYLAB_TURN_LOG": "",
+    "STORYLAB_IDLE_EVICT_MINUTES": "0",
+}
+
+DEFAULT_APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+
+def load_app(app_path: str, timeout: float, background_jobs: bool = False):
+    """An AppTest for `app_path`, with the benchmark settings and the fake client installed.
+
+    With `background_jobs`, turns run as background jobs the way they do by default, and
+    `wait_for_pending_turn` stands in for the page's polling fragment.
+    """
+    # Settings are read when config.py is first imported, so set them before anything imports it
+    os.environ.setdefault("CEREBRAS_API_KEY", "benchmark")
+    os.environ.update(BENCHMARK_ENV)
+    if background_jobs:
+        os.environ["STORYLAB_BACKGROUND_JOBS"] = "1"
+    app_dir = os.path.dirname(os.path.abspath(app_path))
+    sys.path.insert(0, app_dir)
+    os.chdir(app_dir)
+    from streamlit.testing.v1 import AppTest
+    from benchmarks.fake_client import install_fake_client
+    install_fake_client()
+    return AppTest.from_file(os.path.abspath(app_path), default_timeout=timeout)
+
+
+def check(at, step: str):
+    """Raises if the last run ended in an exception."""
+    if at.exception:
+        raise RuntimeError(f"{step}: {at.exception[0].message}")
+
+
+def wait_for_pending_turn(at, poll_seconds: float, timeout: float) -> int:
+    """Polls the session's background turn until it finishes, like the page's fragment does every
+    `poll_seconds`; returns the number of polls (0 when no turn is pending)."""
+    if "pending_turn" not in at.session_state:
+        return 0
+    from core.jobs import get_job_manager, JOB_RUNNING
+    job_id = at.session_state["pending_turn"]["job_id"]
+    manager = get_job_manager() # Same process-wide instance the app uses
+    deadline = time.monotonic() + timeout
+    polls = 0
+    while time.monotonic() < deadline:
+        time.sleep(poll_seconds)
+        polls += 1
+        if manager.poll(job_id)[0] != JOB_RUNNING:
+            return polls
+    raise RuntimeError(f"Background turn still running after {timeout}s")
+
+
+def script_executions(at) -> int:
+    """Script runs so far in this session (from the rerun profiler)."""
+    return at.session_state["rerun_profiler"].reruns
+
+
+def option_button_keys(at) -> list:
+    return [button.key for button in at.button if (button.key or "").startswith("option_")]
+
+
+def page_stats(at) -> dict:
+    """Element count and serialized size (protobuf bytes) of the page from the last run."""
+    elements = 0
+    payload = 0
+    stack = [at._tree]
+    while stack:
+        node = stack.pop()
+        children = getattr(node, "children", None)
+        if children:
+            stack.extend(children.values())
+            continue
+        proto = getattr(node, "proto", None)
+        if proto is not None and hasattr(proto, "ByteSize"):
+            elements += 1
+            payload += proto.ByteSize()
+    return {"elements": elements, "payload_bytes": payload}
@@ -0,0 +1,126 @@
+import argparse
+import json
+import os
+import time
+
+from benchmarks.harness import DEFAULT_APP, load_app, check, script_executions, option_button_keys, page_stats
+
+# --- Rerun cost over story length ---
+# Usage: python -m benchmarks.rerun_curve [--turns 40] [--out curve.json] [--baseline old.json]
+#
+# Drives app.py end to end with AppTest and the fake model client:
+#   1. the setup screen (show_character_selection): pick a genre, add a custom character, start
+#   2. N option clicks
+# After each turn it also reruns the unchanged page, which is what every
+# widget interaction costs at that story length. Each point on the curve
+# records wall time for the turn and for the idle rerun, script executions,
+# page element count and serialized payload size. The slope (cost per extra
+# turn) is what catches rendering regressions. With --baseline, the run fails
+# when the slope or the final payload grows by more than --tolerance.
+
+_METRICS = ("turn_ms", "rerun_ms", "elements", "payload_bytes")
+
+
+def _timed_run(at, step: str) -> float:
+    started = time.perf_counter()
+    at.run()
+    elapsed = (time.perf_counter() - started) * 1000
+    check(at, step)
+    return round(elapsed, 2)
+
+
+def setup_story(at, genre: str) -> list:
+    """Goes through the setup screen; returns its reruns as curve points (turn 0)."""
+    points = []
+    points.append({"step": "setup", "ms": _timed_run(at, "setup"), **page_stats(at)})
+    at.selectbox(key="setup_genre_select").select(genre)
+    points.append({"step": "genre", "ms": _timed_run(at, "genre"), **page_stats(at)})
+    at.text_input(key="custom_name_input_form").input("Benchmark Bea")
+    at.text_input(key="custom_role_input_form").input("Tester")
+    next(button for button in at.button if button.label == "Add Custom Character").click()
+    points.append({"step": "custom_character", "ms": _timed_run(at, "custom character"), **page_stats(at)})
+    at.button(key="start_adventure_button").click()
+    points.append({"step": "start", "ms": _timed_run(at, "start"), **page_stats(at)})
+    return points
+
+
+def measure(app_path: str, turns: int, genre: str, timeout: float) -> dict:
+    at = load_app(app_path, timeout)
+    setup = setup_story(at, genre)
+
+    curve = []
+    for number in range(1, turns + 1):
+        option_keys = option_button_keys(at)
+        if not option_keys:
+            raise RuntimeError(f"No option buttons after turn {number - 1}")
+        before = script_executions(at)
+        at.button(key=option_keys[number % len(option_keys)]).click()
+        turn_ms = _timed_run(at, f"turn {number}")
+        executions = script_executions(at) - before
+        stats = page_stats(at)
+        rerun_ms = _timed_run(at, f"rerun after turn {number}")
+        curve.append({"turn": number, "turn_ms": turn_ms, "rerun_ms": rerun_ms, "executions": executions, **stats})
+    return {"app": os.path.abspath(app_path), "genre": genre, "setup": setup, "curve": curve,
+            "slopes": {metric: round(_slope(curve, metric), 4) for metric in _METRICS}}
+
+
+def _slope(curve: list, metric: str) -> float:
+    """Least-squares growth of `metric` per additional turn."""
+    n = len(curve)
+    if n < 2:
+        return 0.0
+    mean_x = sum(point["turn"] for point in curve) / n
+    mean_y = sum(point[metric] for point in curve) / n
+    covariance = sum((point["turn"] - mean_x) * (point[metric] - mean_y) for point in curve)
+    variance = sum((point["turn"] - mean_x) ** 2 for point in curve)
+    return covariance / variance
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    """Regressions against a baseline run (empty when within tolerance)."""
+    problems = []
+    for metric in ("rerun_ms", "payload_bytes", "elements"):
+        old, new = baseline["slopes"][metric], result["slopes"][metric]
+        # Small absolute slopes are noise (timing especially), so allow a floor
+        floor = 0.5 if metric == "rerun_ms" else 1.0
+        if new > max(old, floor) * tolerance:
+            problems.append(f"{metric} grows {new:.3f}/turn (baseline {old:.3f}/turn)")
+    last_old, last_new = baseline["curve"][-1], result["curve"][-1]
+    if last_old["turn"] == last_new["turn"] and last_new["payload_bytes"] > last_old["payload_bytes"] * tolerance:
+        problems.append(f"payload at turn {last_new['turn']} is {last_new['payload_bytes']:,} bytes "
+                        f"(baseline {last_old['payload_bytes']:,})")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure per-rerun UI cost as a story grows.")
+    parser.add_argument("--turns", type=int, default=40, help="Story turns to play (default: 40)")
+    parser.add_argument("--genre", default="Fantasy", help="Genre picked on the setup screen")
+    parser.add_argument("--app", default=DEFAULT_APP, help="app.py to drive (default: this checkout)")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds allowed per script run")
+    parser.add_argument("--out", help="Write the curve as JSON (use it as a later --baseline)")
+    parser.add_argument("--baseline", help="Earlier --out file to compare against")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="Allowed growth factor vs. the baseline")
+    args = parser.parse_args(argv)
+
+    result = measure(args.app, args.turns, args.genre, args.timeout)
+    print(f"{'turn':>5} {'turn ms':>9} {'rerun ms':>9} {'runs':>5} {'elements':>9} {'payload':>10}")
+    for point in result["curve"]:
+        print(f"{point['turn']:>5} {point['turn_ms']:>9.1f} {point['rerun_ms']:>9.1f} {point['executions']:>5} "
+              f"{point['elements']:>9} {point['payload_bytes']:>10,}")
+    print("growth per turn: " + ", ".join(f"{metric} {value:+.3f}" for metric, value in result["slopes"].items()))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            problems = compare(result, json.load(f), args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION: {problem}")
+        if problems:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks.harness import DEFAULT_APP, load_app, check, script_executions, option_button_keys, wait_for_pending_turn
+
+# --- Script executions per turn ---
+# Usage: python -m benchmarks.turn_reruns [--turns 10] [--mode both] [--model-delay 1.0] [--app path/to/app.py]
+#
+# Drives app.py headlessly with Streamlit's AppTest and a fake model client:
+# starts a story, then clicks an option for each turn. For every turn it
+# records how many times the script executed (from the rerun profiler) and
+# the wall time until the page was rendered. Point --app at an older checkout
+# (e.g. a `git worktree`) to compare before and after a change.
+#
+# Both turn modes are measured. Inline (STORYLAB_BACKGROUND_JOBS=0) finishes
+# the turn inside the click's run. Background, the default, returns from the
+# click with the turn pending; the page's fragment polls the job every
+# STORYLAB_JOB_POLL_INTERVAL seconds and reruns the page once it is done. AppTest
+# does not run timed fragments, so the benchmark polls the job at the same
+# interval and then does that rerun itself. The fake model answers after
+# --model-delay seconds; with no delay a background turn is often finished
+# before the click's run ends, which hides the polling. Settings are read at
+# import, so each mode runs in its own process.
+
+MODES = ("inline", "background")
+
+
+def run(app_path: str, turns: int, timeout: float, mode: str = "inline", model_delay: float = 0.0) -> dict:
+    at = load_app(app_path, timeout, background_jobs=mode == "background")
+    from benchmarks.fake_client import FakeCerebras
+    from config import JOB_POLL_INTERVAL_SECONDS
+    FakeCerebras.delay = model_delay
+    at.run()
+    at.button(key="start_adventure_button").click().run()
+    wait_for_pending_turn(at, JOB_POLL_INTERVAL_SECONDS, timeout) and at.run()
+    check(at, "start")
+
+    per_turn = []
+    for number in range(1, turns + 1):
+        option_keys = option_button_keys(at)
+        if not option_keys:
+            raise RuntimeError(f"No option buttons after turn {number - 1}")
+        before = script_executions(at)
+        started = time.perf_counter()
+        at.button(key=option_keys[0]).click().run()
+        polls = wait_for_pending_turn(at, JOB_POLL_INTERVAL_SECONDS, timeout)
+        if polls:
+            at.run() # The full rerun the fragment triggers once the job is done
+        per_turn.append({"turn": number, "executions": script_executions(at) - before, "fragment_polls": polls,
+                         "wall_ms": round((time.perf_counter() - started) * 1000, 2)})
+        check(at, f"turn {number}")
+
+    executions = [entry["executions"] for entry in per_turn]
+    polls = [entry["fragment_polls"] for entry in per_turn]
+    wall = sorted(entry["wall_ms"] for entry in per_turn)
+    return {
+        "app": os.path.abspath(app_path),
+        "mode": mode,
+        "turns": turns,
+        "executions_per_turn": round(sum(executions) / len(executions), 2),
+        "fragment_polls_per_turn": round(sum(polls) / len(polls), 2),
+        "wall_ms_per_turn": {"avg": round(sum(wall) / len(wall), 2), "p50": wall[len(wall) // 2], "max": wall[-1]},
+        "per_turn": per_turn,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure script executions and wall time per story turn.")
+    parser.add_argument("--turns", type=int, default=10, help="Option clicks to make (default: 10)")
+    parser.add_argument("--app", default=DEFAULT_APP, help="app.py to drive (default: this checkout)")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds allowed per script run")
+    parser.add_argument("--mode", choices=MODES + ("both",), default="both",
+                        help="Turn mode to measure: inline, background (the app default) or both (default: both)")
+    parser.add_argument("--model-delay", type=float, default=1.0,
+                        help="Seconds the fake model takes per call (default: 1.0; 0 times rendering alone)")
+    parser.add_argument("--json", action="store_true", help="Print the full result as JSON")
+    args = parser.parse_args(argv)
+
+    if args.mode == "both":
+        results = [run_in_subprocess(args, mode) for mode in MODES]
+    else:
+        results = [run(args.app, args.turns, args.timeout, args.mode, args.model_delay)]
+    if args.json:
+        print(json.dumps(results[0] if len(results) == 1 else results, indent=2))
+        return
+    print(f"{results[0]['app']}: {args.turns} turns")
+    for result in results:
+        print(f"  {result['mode']}: script executions per turn: {result['executions_per_turn']}, "
+              f"fragment polls per turn: {result['fragment_polls_per_turn']}, "
+              f"wall ms per turn: {result['wall_ms_per_turn']}")
+
+
+def run_in_subprocess(args, mode: str) -> dict:
+    """One mode's result, measured in a fresh process so its settings take effect."""
+    command = [sys.executable, "-m", "benchmarks.turn_reruns", "--mode", mode, "--json", "--turns", str(args.turns),
+               "--app", args.app, "--timeout", str(args.timeout), "--model-delay", str(args.model_delay)]
+    output = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True).stdout
+    return json.loads(output)
+
+
+if __name__ == "__main__":
+    main()
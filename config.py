@@ -2,8 +2,149 @@ import os
 
 # --- Configuration ---
 API_KEY = os.environ.get("CEREBRAS_API_KEY")
-MODEL_NAME = "qwen-3-32b"
+MODEL_NAME = os.environ.get("STORYLAB_MODEL", "qwen-3-32b")
+# Smaller, faster model for cheap auxiliary calls
+FAST_MODEL_NAME = os.environ.get("STORYLAB_FAST_MODEL", "llama3.1-8b")
 OPTIONS_SEPARATOR = "--- Options ---"
 
+# Model backends, tried fastest-healthy-first with failover (core/backends.py): any of "cerebras"
+# (needs CEREBRAS_API_KEY), "openai" (any OpenAI-compatible server at STORYLAB_OPENAI_BASE_URL)
+# and "stub" (deterministic offline turns, for tests and demos; use it on its own).
+LLM_BACKENDS = [name.strip().lower() for name in os.environ.get("STORYLAB_BACKENDS", "cerebras").split(",")
+                if name.strip()]
+OPENAI_BASE_URL = os.environ.get("STORYLAB_OPENAI_BASE_URL", "")
+OPENAI_API_KEY = os.environ.get("STORYLAB_OPENAI_API_KEY", "")
+# Model to request from the OpenAI-compatible server (empty uses the route's model name)
+OPENAI_MODEL = os.environ.get("STORYLAB_OPENAI_MODEL", "")
+# A backend with at least this share of failed calls in the window is benched for the cooldown
+BACKEND_WINDOW_SECONDS = float(os.environ.get("STORYLAB_BACKEND_WINDOW", "300"))
+BACKEND_ERROR_THRESHOLD = float(os.environ.get("STORYLAB_BACKEND_ERROR_THRESHOLD", "0.5"))
+BACKEND_COOLDOWN_SECONDS = float(os.environ.get("STORYLAB_BACKEND_COOLDOWN", "30"))
+
+# Record/replay cassettes: "record" saves every model request/response to CASSETTE_PATH,
+# "replay" serves them back without touching the network (no API key needed).
+CASSETTE_MODE = os.environ.get("STORYLAB_CASSETTE_MODE", "").lower() or None
+CASSETTE_PATH = os.environ.get("STORYLAB_CASSETTE_PATH", "cassettes/session.jsonl.gz")
+
+# Shared rate-limit scheduler (process-wide, across all sessions).
+# Keep these at or slightly below the provider's limits for the API key in use.
+RATE_LIMIT_REQUESTS_PER_MIN = int(os.environ.get("STORYLAB_RATE_LIMIT_RPM", "30"))
+RATE_LIMIT_TOKENS_PER_MIN = int(os.environ.get("STORYLAB_RATE_LIMIT_TPM", "60000"))
+SCHEDULER_MAX_QUEUE = int(os.environ.get("STORYLAB_SCHEDULER_MAX_QUEUE", "64"))
+SCHEDULER_MAX_WAIT_SECONDS = float(os.environ.get("STORYLAB_SCHEDULER_MAX_WAIT", "30"))
+
+# Pre-generated opening scenes for each genre's default cast (depth 0 disables the pool)
+SCENE_POOL_DEPTH = int(os.environ.get("STORYLAB_SCENE_POOL_DEPTH", "2"))
+SCENE_POOL_WORKERS = int(os.environ.get("STORYLAB_SCENE_POOL_WORKERS", "2"))
+SCENE_POOL_MAX_AGE_SECONDS = float(os.environ.get("STORYLAB_SCENE_POOL_MAX_AGE", str(6 * 60 * 60)))
+
+# Generation policy: output budget per turn type, sampling temperature and stop conditions
+MAX_TOKENS_OPENING = int(os.environ.get("STORYLAB_MAX_TOKENS_OPENING", "1500"))
+MAX_TOKENS_OPTION = int(os.environ.get("STORYLAB_MAX_TOKENS_OPTION", "1200"))
+MAX_TOKENS_FREE_TEXT = int(os.environ.get("STORYLAB_MAX_TOKENS_FREE_TEXT", "1200"))
+GENERATION_TEMPERATURE = float(os.environ.get("STORYLAB_TEMPERATURE", "0.7"))
+# A fourth numbered option means the model is overrunning the 3-option block
+STOP_SEQUENCES = ["\n4."]
+# Stream responses so generation can be stopped client-side once the 3 options are complete
+STREAM_RESPONSES = os.environ.get("STORYLAB_STREAM", "") == "1"
+# Turn types ("opening", "option", "free_text") the model may think on before answering.
+# Others get Qwen3's no-think switch; reasoning traces are never stored or shown either way.
+THINKING_TURN_KINDS = {kind.strip() for kind in os.environ.get("STORYLAB_THINKING_TURNS", "").split(",") if kind.strip()}
+# Structured output: the model returns a schema-constrained JSON turn (narrative, options, world events)
+# instead of free text; responses that aren't valid JSON still go through the text parser
+STRUCTURED_OUTPUT = os.environ.get("STORYLAB_STRUCTURED_OUTPUT", "") == "1"
+
+# Model routing: each call type uses the first model of its route and falls back to the next
+# ones if that call fails. Override a route with e.g. STORYLAB_ROUTE_NARRATIVE_TURN="model-a,model-b".
+# Story routes have no fallback by default, so an error never swaps the narrator mid-story;
+# add one explicitly (e.g. STORYLAB_ROUTE_NARRATIVE_TURN="qwen-3-32b,llama3.1-8b") to prefer that.
+def _route(name: str, *default_models) -> list:
+    models = os.environ.get(f"STORYLAB_ROUTE_{name.upper()}", "")
+    return [model.strip() for model in models.split(",") if model.strip()] or list(default_models)
+
+MODEL_ROUTES = {
+    "opening_scene": _route("opening_scene", MODEL_NAME),
+    "narrative_turn": _route("narrative_turn", MODEL_NAME),
+    "post_tool_narration": _route("post_tool_narration", MODEL_NAME),
+    "option_regeneration": _route("option_regeneration", FAST_MODEL_NAME, MODEL_NAME),
+    "character_enrichment": _route("character_enrichment", FAST_MODEL_NAME, MODEL_NAME),
+}
+# Output budget for regenerating a missing option block
+MAX_TOKENS_OPTION_REGENERATION = int(os.environ.get("STORYLAB_MAX_TOKENS_OPTION_REGEN", "200"))
+
+# Custom characters get a generated description and starting location when the story starts.
+# All of a cast's calls run at once on a shared pool; results are cached by (genre, name, role).
+# Characters whose call hasn't finished after the timeout start without them.
+CHARACTER_ENRICHMENT = os.environ.get("STORYLAB_ENRICH_CHARACTERS", "1") == "1"
+ENRICHMENT_WORKERS = int(os.environ.get("STORYLAB_ENRICHMENT_WORKERS", "8"))
+ENRICHMENT_TIMEOUT_SECONDS = float(os.environ.get("STORYLAB_ENRICHMENT_TIMEOUT", "20"))
+ENRICHMENT_CACHE_SIZE = int(os.environ.get("STORYLAB_ENRICHMENT_CACHE_SIZE", "1024"))
+MAX_TOKENS_CHARACTER_ENRICHMENT = int(os.environ.get("STORYLAB_MAX_TOKENS_ENRICHMENT", "150"))
+
+# Overload control: under high model latency or load, degrade step by step (no speculative work,
+# shorter responses, shorter history, no tool round trip) and recover once things calm down.
+# Pressure 1.0 = average model latency at the target, or this many requests queued + in flight.
+OVERLOAD_CONTROL = os.environ.get("STORYLAB_OVERLOAD_CONTROL", "1") == "1"
+OVERLOAD_TARGET_LATENCY_SECONDS = float(os.environ.get("STORYLAB_OVERLOAD_TARGET_LATENCY", "10"))
+OVERLOAD_MAX_LOAD = int(os.environ.get("STORYLAB_OVERLOAD_MAX_LOAD", "24"))
+OVERLOAD_WINDOW_SECONDS = float(os.environ.get("STORYLAB_OVERLOAD_WINDOW", "60"))
+OVERLOAD_COOLDOWN_SECONDS = float(os.environ.get("STORYLAB_OVERLOAD_COOLDOWN", "30"))
+OVERLOAD_MAX_TOKENS_FACTOR = float(os.environ.get("STORYLAB_OVERLOAD_MAX_TOKENS_FACTOR", "0.6"))
+OVERLOAD_HISTORY_TURNS = int(os.environ.get("STORYLAB_OVERLOAD_HISTORY_TURNS", "4"))
+
+# Background generation jobs: model calls run on a shared executor while the page polls for results
+BACKGROUND_JOBS = os.environ.get("STORYLAB_BACKGROUND_JOBS", "1") == "1"
+JOB_WORKERS = int(os.environ.get("STORYLAB_JOB_WORKERS", "16"))
+JOB_TIMEOUT_SECONDS = float(os.environ.get("STORYLAB_JOB_TIMEOUT", "120"))
+JOB_POLL_INTERVAL_SECONDS = float(os.environ.get("STORYLAB_JOB_POLL_INTERVAL", "0.5"))
+
+# Turn store: turns older than this many are kept zlib-compressed in memory (0 disables)
+TURN_STORE_COMPRESS_AFTER = int(os.environ.get("STORYLAB_COMPRESS_TURNS_AFTER", "20"))
+
+# Prompt window: only the latest turns are sent to the model (0 sends the whole story). Older turns
+# are recalled from a local BM25 index: the best MEMORY_TOP_K matches for the user's input are
+# added as a memory block, each cut to MEMORY_PASSAGE_CHARS characters.
+HISTORY_MAX_TURNS = int(os.environ.get("STORYLAB_HISTORY_TURNS", "12"))
+MEMORY_TOP_K = int(os.environ.get("STORYLAB_MEMORY_TOP_K", "3"))
+MEMORY_PASSAGE_CHARS = int(os.environ.get("STORYLAB_MEMORY_PASSAGE_CHARS", "400"))
+
+# Large casts: above SCENE_FULL_CAST_MAX characters, each turn's prompt describes only the current
+# scene (characters involved in the last SCENE_WINDOW_TURNS turns and anyone sharing their location,
+# at most SCENE_MAX_ACTIVE) and the status panel pages through the rest, CAST_PAGE_SIZE at a time.
+SCENE_FULL_CAST_MAX = int(os.environ.get("STORYLAB_SCENE_FULL_CAST_MAX", "6"))
+SCENE_WINDOW_TURNS = int(os.environ.get("STORYLAB_SCENE_WINDOW_TURNS", "3"))
+SCENE_MAX_ACTIVE = int(os.environ.get("STORYLAB_SCENE_MAX_ACTIVE", "8"))
+CAST_PAGE_SIZE = int(os.environ.get("STORYLAB_CAST_PAGE_SIZE", "9"))
+
+# Turn log for offline analytics (`python -m core.analytics`): one JSON line per turn,
+# gzip-compressed if the path ends in .gz (empty disables logging)
+TURN_LOG_PATH = os.environ.get("STORYLAB_TURN_LOG", "")
+
+# Break every model request down into prompt parts (system prompt, tool schemas, history, ...)
+# with a local token estimate; the breakdown goes into the turn log and the debug panel.
+# Recorded cassettes can be analyzed offline with `python -m core.prompt_profiler`.
+PROMPT_ATTRIBUTION = os.environ.get("STORYLAB_PROMPT_ATTRIBUTION", "") == "1"
+
+# Shared session store so any app replica can serve any story, e.g. "sqlite://sessions/stories.db"
+# (empty keeps sessions in this process only). The session id is kept in the URL as ?sid=.
+SESSION_STORE_URL = os.environ.get("STORYLAB_SESSION_STORE", "")
+
+# Idle sessions: stories of tabs inactive this long are spilled to SPILL_DIR and loaded back on the
+# next interaction (0 disables). The sweep checks every IDLE_SWEEP_SECONDS.
+IDLE_EVICT_MINUTES = float(os.environ.get("STORYLAB_IDLE_EVICT_MINUTES", "30"))
+IDLE_SWEEP_SECONDS = float(os.environ.get("STORYLAB_IDLE_SWEEP_SECONDS", "60"))
+SPILL_DIR = os.environ.get("STORYLAB_SPILL_DIR", "spill")
+
+# Archive of finished stories, browsable in the gallery (empty disables it)
+ARCHIVE_DIR = os.environ.get("STORYLAB_ARCHIVE_DIR", "archive")
+
+# Rerun profiler (also enabled per browser tab with ?profile=1, or ?profile=cprofile for cProfile output)
+PROFILE_RERUNS = os.environ.get("STORYLAB_PROFILE", "") == "1"
+PROFILE_CPROFILE = os.environ.get("STORYLAB_PROFILE_CPROFILE", "") == "1"
+PROFILE_DIR = os.environ.get("STORYLAB_PROFILE_DIR", "profiles")
+
+# Show developer panels (memory, metrics, ...) in the sidebar
+DEBUG_PANELS = os.environ.get("STORYLAB_DEBUG", "") == "1"
+
 # Define genre options
 GENRE_OPTIONS = ["Fantasy", "Sci-Fi", "Medieval", "Mystery", "Horror", "Western"]
@@ -1,112 +1,205 @@
+import logging
+import time
+from types import SimpleNamespace
+
 import streamlit as st
-from cerebras.cloud.sdk import Cerebras
-import json
-import re
+from config import CASSETTE_MODE, CASSETTE_PATH, OPTIONS_SEPARATOR, PROMPT_ATTRIBUTION
+from .cassette import CassetteClient, CassetteMissError, CASSETTE_MODES
+from .backends import build_selector
+from .scheduler import get_scheduler, estimate_tokens, SchedulerBusyError, PRIORITY_INTERACTIVE
 from .helpers import update_character_status, extract_locations_from_text, parse_options
+from .tools import ToolRegistry, TOOL_REGISTRY
+from .generation_policy import (GenerationPolicy, get_policy, collect_stream, trim_after_options,
+                                POLICY_STATS, TURN_OPENING, TURN_OPTION, TURN_OPTION_REGENERATION)
+from .routing import (call_with_fallback, ROUTE_OPENING_SCENE, ROUTE_NARRATIVE_TURN, ROUTE_POST_TOOL_NARRATION,
+                      ROUTE_OPTION_REGENERATION)
+from .prompts import build_option_regeneration_prompt
+from .overload import get_overload_controller
+from .structured_output import normalize_response, render_turn_text
+from .reasoning import strip_reasoning, with_thinking_switch
+from .prompt_profiler import attribute_request, add_prompt_parts
+
+logger = logging.getLogger(__name__)
 
-# --- Initialize Cerebras Client ---
+# --- Initialize Model Client ---
 @st.cache_resource
-def get_cerebras_client(api_key):
-    """Initializes and caches the Cerebras client."""
-    if not api_key:
-        st.error(
-            "Cerebras API key not found. Please set the CEREBRAS_API_KEY environment variable or use Streamlit Secrets.")
+def get_llm_client(api_key):
+    """Initializes and caches the model client over the configured backends (wrapped in a cassette when recording/replaying)."""
+    if CASSETTE_MODE and CASSETTE_MODE not in CASSETTE_MODES:
+        st.error(f"Unknown cassette mode '{CASSETTE_MODE}'. Use one of: {', '.join(CASSETTE_MODES)}.")
         return None
+
+    # Replay needs no network access, so no API key either
+    if CASSETTE_MODE == "replay":
+        try:
+            return CassetteClient(CASSETTE_PATH, mode="replay")
+        except Exception as e:
+            st.error(f"Failed to load cassette {CASSETTE_PATH}: {e}")
+            return None
+
     try:
-        client = Cerebras(api_key=api_key)
-        return client
+        client = build_selector(api_key)
     except Exception as e:
-        st.error(f"Failed to initialize Cerebras client: {e}")
+        st.error(f"Failed to initialize the model backends: {e}")
+        return None
+    if client is None:
+        st.error(
+            "No model backend is available. Please set the CEREBRAS_API_KEY environment variable (or use Streamlit Secrets), "
+            "or configure another backend with STORYLAB_BACKENDS.")
         return None
+    if CASSETTE_MODE == "record":
+        client = CassetteClient(CASSETTE_PATH, mode="record", client=client)
+    return client
 
 # --- Define Functions (Tools) ---
-# These definitions are part of the core AI interaction logic
-available_functions_def = [
-    {
-        "type": "function",
-        "function": {
-            "name": "move_character",
-            "description": "Move a character to a specified location in the narrative world.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "character_name": {
-                        "type": "string",
-                        "description": "The name of the character to move.",
-                    },
-                    "location": {
-                        "type": "string",
-                        "description": "The destination location.",
-                    },
-                },
-                "required": ["character_name", "location"],
-            },
-        }
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "speak_to_character",
-            "description": "Have one character speak a message to another character.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "speaking_character": {
-                        "type": "string",
-                        "description": "The name of the character who is speaking.",
-                    },
-                    "target_character": {
-                        "type": "string",
-                        "description": "The name of the character being spoken to.",
-                    },
-                    "message": {
-                        "type": "string",
-                        "description": "The message to be delivered.",
-                    },
-                },
-                "required": ["speaking_character", "target_character", "message"],
-            },
-        }
-    },
-]
-
-# Mapping of function names to the actual Python functions
-# These are simulation actions, not real-world actions
-available_functions_map = {
-    "move_character": lambda character_name, location: f"SIMULATION ACTION: {character_name} is moving to {location}.",
-    "speak_to_character": lambda speaking_character, target_character, message: f"SIMULATION ACTION: {speaking_character} says to {target_character}: '{message}'",
-}
+# World tools live in core/tools.py and are registered with TOOL_REGISTRY.
+
+
+# --- Rate-limited Model Call ---
+def create_chat_completion(client, messages: list, tool_registry: ToolRegistry, policy: GenerationPolicy,
+                           session_id: str = None, priority: int = PRIORITY_INTERACTIVE,
+                           route: str = ROUTE_NARRATIVE_TURN, step_info: dict = None):
+    """
+    Runs one chat completion under the turn's generation policy, after scheduler admission.
+    The model comes from the call's route, falling back to the route's next model on errors.
+    Without a tool registry the request offers no tools. With prompt attribution on, the
+    request's per-part token estimate is added to `step_info`.
+    """
+    # Reserve the prompt plus the most this turn type may generate
+    tools_json = tool_registry.schema_json() if tool_registry is not None else None
+    estimated = estimate_tokens(messages, tools_json) + policy.max_tokens
+    with get_scheduler().admit(session_id, estimated, priority) as admission:
+        request = dict(messages=messages, **policy.request_params())
+        if tool_registry is not None:
+            request["tools"] = tool_registry.definitions() # Cached payload, built once at registration
+            request["tool_choice"] = "auto"
+        if PROMPT_ATTRIBUTION and step_info is not None:
+            add_prompt_parts(step_info.setdefault("prompt_parts", {}), attribute_request(request))
+
+        def call(model):
+            if policy.stream:
+                # Streamed responses are cut off client-side once the 3 options are complete
+                return collect_stream(client.chat.completions.create(model=model, stream=True, **request))
+            return client.chat.completions.create(model=model, **request)
+
+        # A cassette miss would miss for every model, so it isn't retried
+        started = time.perf_counter()
+        completion = call_with_fallback(route, call, no_fallback=(CassetteMissError,))
+        # Model latency (not queueing) drives the overload controller
+        get_overload_controller().observe_latency(time.perf_counter() - started)
+        # Correct the token bucket with what the provider actually counted
+        usage = getattr(completion, "usage", None)
+        admission.settle(getattr(usage, "total_tokens", None))
+
+    POLICY_STATS.record_call(
+        policy.turn_kind, getattr(usage, "completion_tokens", None),
+        getattr(completion.choices[0], "finish_reason", None), getattr(completion, "stopped_early", False))
+    return completion
+
+
+def drop_reasoning(text: str, policy: GenerationPolicy, step_info: dict = None) -> str:
+    """Strips the model's reasoning trace from a response, keeping it in `step_info` for the debug view."""
+    text, reasoning = strip_reasoning(text)
+    POLICY_STATS.record_reasoning(policy.turn_kind, len(reasoning))
+    if reasoning and step_info is not None:
+        step_info.setdefault("reasoning", []).append(reasoning)
+    return text
+
+
+def finalize_response_text(text: str, policy: GenerationPolicy, character_status: dict = None,
+                           step_info: dict = None) -> str:
+    """Strips reasoning, trims anything the model wrote after its option block and records both."""
+    text = drop_reasoning(text, policy, step_info)
+    if policy.response_format:
+        # A JSON turn becomes canonical option-block text; its world events update the cast
+        text, world_events = normalize_response(text)
+        for event in world_events:
+            location = (event.get("location") or "").strip()
+            if location:
+                update_character_status("move_character",
+                                        {"character_name": event["character_name"], "location": location},
+                                        character_status)
+    text, overrun_chars = trim_after_options(text)
+    POLICY_STATS.record_overrun(policy.turn_kind, overrun_chars)
+    return text
+
+
+def record_usage(step_info: dict, completion):
+    """Adds a completion's token usage to `step_info` (for the turn log)."""
+    if step_info is None:
+        return
+    usage = getattr(completion, "usage", None)
+    step_info["model_calls"] = step_info.get("model_calls", 0) + 1
+    step_info["prompt_tokens"] = step_info.get("prompt_tokens", 0) + (getattr(usage, "prompt_tokens", None) or 0)
+    step_info["completion_tokens"] = (step_info.get("completion_tokens", 0)
+                                      + (getattr(usage, "completion_tokens", None) or 0))
+
+
+def _step_failed(step_info: dict, notice: str, response_text: str, narrative_history: list):
+    """Ends a failed step: the notice for the player goes into `step_info["error"]`, since worker
+    threads can't render anything; the script thread shows it."""
+    if step_info is not None:
+        step_info["error"] = notice
+    return response_text, narrative_history
 
 
 # --- Core Narrative Step Function ---
 def run_narrative_step(client, user_input_to_model: str, narrative_history: list,
-                       available_functions: list, available_functions_map: dict):
+                       tool_registry: ToolRegistry = TOOL_REGISTRY,
+                       session_id: str = None, priority: int = PRIORITY_INTERACTIVE,
+                       character_status: dict = None, turn_kind: str = TURN_OPTION,
+                       step_info: dict = None):
     """
     Sends the conversation history and user input to the AI model,
     handles function calls, and returns the AI's response and updated history.
+    Character updates go to `character_status` when given (e.g. from a background
+    thread without session state), otherwise to st.session_state. `turn_kind`
+    selects the generation policy (output budget, stop conditions, thinking).
+    When a `step_info` dict is given, it collects stripped reasoning traces, token usage
+    and the tool calls made (name, ok) for the debug view and the turn log, and a failed
+    step leaves the message to show the player in `step_info["error"]`.
     """
+    # Under overload the policy is shortened, and tools are dropped so there is no second call
+    overload = get_overload_controller()
+    policy = overload.adjust_policy(get_policy(turn_kind))
+    if not overload.tools_allowed():
+        tool_registry = None
     # Append the user message as a dictionary
-    messages_for_api = narrative_history + [{"role": "user", "content": user_input_to_model}]
+    messages_for_api = narrative_history + [
+        {"role": "user", "content": with_thinking_switch(user_input_to_model, policy.thinking)}]
+    history_length = len(narrative_history)
 
     try:
-        chat_completion = client.chat.completions.create(
-            messages=messages_for_api,
-            model="qwen-3-32b", # Use the model name directly or pass from config if preferred
-            tools=available_functions,
-            tool_choice="auto",
-        )
+        chat_completion = create_chat_completion(
+            client, messages_for_api, tool_registry, policy, session_id=session_id, priority=priority,
+            route=ROUTE_OPENING_SCENE if turn_kind == TURN_OPENING else ROUTE_NARRATIVE_TURN, step_info=step_info)
+    except SchedulerBusyError as e:
+        return _step_failed(step_info, f"StoryLab is very busy right now. Please try again in a moment. ({e})",
+                            "The story is taking a short break because many people are playing. Please try again.",
+                            narrative_history)
     except Exception as e:
-        st.error(f"An error occurred during API call: {e}")
-        return "An error occurred while processing your request.", narrative_history
+        logger.warning("Model call failed: %s", e)
+        return _step_failed(step_info, f"An error occurred during API call: {e}",
+                            "An error occurred while processing your request.", narrative_history)
 
+    record_usage(step_info, chat_completion)
     response_message = chat_completion.choices[0].message
 
+    if response_message.tool_calls and tool_registry is None:
+        # Tools are off (overload), but the model called some anyway: there is nothing to run them
+        # with and no second call, so its text is the narration, and without text the step failed
+        if not (response_message.content or "").strip():
+            return _step_failed(step_info, "The story got stuck on that turn. Please try again.",
+                                "An error occurred while processing your request.", narrative_history)
+        response_message = SimpleNamespace(role=response_message.role, content=response_message.content,
+                                           tool_calls=None)
+
     # Handle function calls first
     if response_message.tool_calls:
         # Append the assistant message with tool_calls as a dictionary to history
         narrative_history.append({
             "role": response_message.role,
-            "content": response_message.content, # Content might be empty if only a tool call
+            "content": drop_reasoning(response_message.content, policy, step_info) or None, # Content might be empty if only a tool call
             "tool_calls": [
                 {
                     "id": tc.id,
@@ -119,78 +212,144 @@ def run_narrative_step(client, user_input_to_model: str, narrative_history: list
             ]
         })
 
-        # Assuming only one tool call for simplicity as in the original code
-        tool_call = response_message.tool_calls[0]
-        function_name = tool_call.function.name
-        try:
-            function_args = json.loads(tool_call.function.arguments)
+        # Answer every tool call. Invalid calls (unknown tool, bad JSON, wrong arguments)
+        # come back to the model as tool error messages instead of aborting the turn.
+        for tool_call in response_message.tool_calls:
+            result = tool_registry.call(tool_call.function.name, tool_call.function.arguments)
+            if step_info is not None:
+                step_info.setdefault("tool_calls", []).append((result.name, result.ok))
+            if result.ok:
+                # Update character status based on function call using helper
+                update_character_status(result.name, result.arguments, character_status)
 
-            # Update character status based on function call using helper
-            update_character_status(function_name, function_args)
+            # Add the tool response message to history
+            narrative_history.append(
+                {
+                    "tool_call_id": tool_call.id,
+                    "role": "tool",
+                    "name": result.name,
+                    "content": result.content,
+                }
+            )
 
-        except json.JSONDecodeError:
-            error_message = "Error processing function call arguments."
-            st.error(error_message)
-            return error_message, narrative_history
+        try:
+            # Call the model again with the tool responses. The user's message is included
+            # so the narration still answers their choice (it isn't persisted in the history).
+            second_response = create_chat_completion(
+                client, messages_for_api + narrative_history[history_length:], tool_registry, policy,
+                session_id=session_id, priority=priority, route=ROUTE_POST_TOOL_NARRATION, step_info=step_info)
+        except SchedulerBusyError as e:
+            return _step_failed(step_info, f"StoryLab is very busy right now. Please try again in a moment. ({e})",
+                                "The story is taking a short break because many people are playing. Please try again.",
+                                narrative_history)
         except Exception as e:
-            error_message = f"Error parsing function arguments for {function_name}: {e}"
-            st.error(error_message)
-            return error_message, narrative_history
-
-
-        if function_name in available_functions_map:
-            try:
-                # Execute the function using the map
-                function_to_call = available_functions_map[function_name]
-                function_response_content = function_to_call(**function_args)
-
-                # Add the tool response message to history
-                narrative_history.append(
-                    {
-                        "tool_call_id": tool_call.id,
-                        "role": "tool",
-                        "name": function_name,
-                        "content": function_response_content,
-                    }
-                )
-
-                # Call the model again with the updated history including tool response
-                second_response = client.chat.completions.create(
-                    messages=narrative_history,
-                    model="qwen-3-32b", # Use the model name
-                    tools=available_functions, # Provide tools again just in case
-                    tool_choice="auto", # Allow further tool calls if needed
-                )
-                full_response_content = second_response.choices[0].message.content
-                # Add the second assistant response to history
-                narrative_history.append({
-                    "role": second_response.choices[0].message.role,
-                    "content": full_response_content
-                })
-
-                # Try to extract location information from the *final* narrative text using helper
-                extract_locations_from_text(full_response_content)
-
-                return full_response_content, narrative_history
-
-            except Exception as e:
-                error_message = f"An error occurred while performing the action: {function_name}. Details: {e}"
-                st.error(error_message)
-                return error_message, narrative_history
-        else:
-            error_message = f"The AI tried to use an unknown action: {function_name}."
-            st.error(error_message)
-            return error_message, narrative_history
+            logger.warning("Model call after tool results failed: %s", e)
+            error_message = f"An error occurred while continuing the story after the characters acted. Details: {e}"
+            return _step_failed(step_info, error_message, error_message, narrative_history)
+
+        record_usage(step_info, second_response)
+        full_response_content = finalize_response_text(
+            second_response.choices[0].message.content, policy, character_status, step_info)
+        # Add the second assistant response to history
+        narrative_history.append({
+            "role": second_response.choices[0].message.role,
+            "content": full_response_content
+        })
+
+        # Try to extract location information from the *final* narrative text using helper
+        extract_locations_from_text(full_response_content, character_status)
+
+        return full_response_content, narrative_history
     else:
         # If no function call, just process the text response
-        full_response_content = response_message.content
+        full_response_content = finalize_response_text(response_message.content, policy, character_status, step_info)
         narrative_history.append({
             "role": response_message.role,
             "content": full_response_content
         })
 
         # Try to extract location information from the narrative text using helper
-        extract_locations_from_text(full_response_content)
+        extract_locations_from_text(full_response_content, character_status)
 
         return full_response_content, narrative_history
 
+
+# --- Option Regeneration ---
+def regenerate_options(client, response_text: str, session_id: str = None,
+                       priority: int = PRIORITY_INTERACTIVE) -> list:
+    """
+    Asks the (fast) option-regeneration route for 3 options when a turn came back without any,
+    so the user gets buttons instead of having to retype. Returns [] if that fails too.
+    """
+    policy = get_policy(TURN_OPTION_REGENERATION)
+    messages = [{"role": "user", "content": with_thinking_switch(
+        build_option_regeneration_prompt(response_text.split(OPTIONS_SEPARATOR, 1)[0].strip()), policy.thinking)}]
+    try:
+        completion = create_chat_completion(client, messages, None, policy, session_id=session_id,
+                                            priority=priority, route=ROUTE_OPTION_REGENERATION)
+    except Exception:
+        return []
+    text = drop_reasoning(completion.choices[0].message.content or "", policy)
+    if OPTIONS_SEPARATOR not in text:
+        text = f"{OPTIONS_SEPARATOR}\n{text}"
+    _, _, options = parse_options(text, OPTIONS_SEPARATOR)
+    return options[:3]
+
+
+# --- Self-contained Turn (safe to run off the script thread) ---
+def generate_turn(client, user_input_to_model: str, narrative_history: list, character_status: dict,
+                  session_id: str = None, priority: int = PRIORITY_INTERACTIVE,
+                  turn_kind: str = TURN_OPTION) -> dict:
+    """
+    Runs one narrative step on the caller's own copies of the history and character
+    status (no session state access) and returns everything needed to record the turn.
+    """
+    history_length = len(narrative_history)
+    step_info = {}
+    started = time.perf_counter()
+    full_response_text, updated_history = run_narrative_step(
+        client=client,
+        user_input_to_model=user_input_to_model,
+        narrative_history=narrative_history,
+        session_id=session_id,
+        priority=priority,
+        character_status=character_status,
+        turn_kind=turn_kind,
+        step_info=step_info,
+    )
+    _, _, options = parse_options(full_response_text, OPTIONS_SEPARATOR)
+    # Failures are reported explicitly; a failed tool round trip still leaves tool messages in the history
+    failed = "error" in step_info
+    parsed_options = len(options)
+    separator_found = OPTIONS_SEPARATOR in full_response_text
+    if not options and not failed:
+        # The model skipped the option block: regenerate just the options on the cheap route
+        options = regenerate_options(client, full_response_text, session_id=session_id, priority=priority)
+        if options:
+            narrative = full_response_text.split(OPTIONS_SEPARATOR, 1)[0].strip()
+            full_response_text = render_turn_text(narrative, options)
+            updated_history[-1]["content"] = full_response_text
+    return {
+        "response_text": full_response_text,
+        "new_messages": updated_history[history_length:],
+        "options": options,
+        "character_status": character_status,
+        "reasoning": "\n\n".join(step_info.get("reasoning", [])),
+        "error": step_info.get("error"), # Shown to the player by the script thread
+        # One row of the turn log (see core/turn_log.py)
+        "metrics": {
+            "turn_kind": turn_kind,
+            "ok": not failed,
+            "latency_s": round(time.perf_counter() - started, 3),
+            "model_calls": step_info.get("model_calls", 0),
+            "prompt_tokens": step_info.get("prompt_tokens", 0),
+            "completion_tokens": step_info.get("completion_tokens", 0),
+            "tool_calls": [name for name, _ in step_info.get("tool_calls", [])],
+            "tool_errors": sum(1 for _, ok in step_info.get("tool_calls", []) if not ok),
+            "separator_found": separator_found,
+            "options_parsed": parsed_options,
+            "options_regenerated": bool(options) and not parsed_options,
+            "response_chars": len(full_response_text),
+            **({"prompt_parts": step_info["prompt_parts"]} if "prompt_parts" in step_info else {}),
+        },
+    }
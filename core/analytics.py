@@ -0,0 +1,232 @@
+import argparse
+import gzip
+import json
+import os
+import sys
+
+import numpy as np
+
+# --- Turn Log Analytics ---
+# Usage: python -m core.analytics logs/turns.jsonl.gz [more logs...] --out analytics/
+#
+# Reads turn logs (core/turn_log.py; plain or gzipped JSONL) as a stream of
+# fixed-size batches. Each batch is converted to NumPy columns and folded
+# into running aggregates with vectorized operations (bincount, histogram,
+# ufunc.at), so memory stays bounded by the batch size, the number of
+# distinct genres and tools, and one integer per session. The results are
+# written as columnar tables: Parquet if pyarrow is installed, otherwise
+# NumPy .npz files.
+
+TOKEN_BINS = np.array([0, 250, 500, 750, 1000, 1500, 2000, 3000, 4000, 6000, 8000, 12000, 16000, np.inf])
+LATENCY_BINS = np.array([0, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60, 120, np.inf])
+
+
+def iter_records(paths: list, stats: dict):
+    """Yields turn records from JSONL logs; unreadable lines are counted and skipped."""
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            try:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        stats["bad_lines"] += 1
+            except EOFError:
+                stats["truncated_files"] += 1 # Log still being written (or cut off by a crash)
+
+
+def iter_batches(records, batch_size: int):
+    """Groups an iterable of records into lists of at most `batch_size`."""
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _grow(array: np.ndarray, length: int) -> np.ndarray:
+    """Pads an aggregate array along its first axis when new categories appear."""
+    if array.shape[0] >= length:
+        return array
+    padding = np.zeros((length - array.shape[0],) + array.shape[1:], dtype=array.dtype)
+    return np.concatenate([array, padding])
+
+
+def _histogram_quantile(counts: np.ndarray, edges: np.ndarray, q: float) -> float:
+    """Upper bin edge at quantile q of a histogram (np.nan when empty)."""
+    total = counts.sum()
+    if not total:
+        return float("nan")
+    index = int(np.searchsorted(np.cumsum(counts), q * total))
+    return float(edges[min(index + 1, len(edges) - 1)])
+
+
+class TurnLogAggregator:
+    """Running aggregates over turn-log batches."""
+
+    def __init__(self):
+        self.genres = {} # name -> code
+        self.tools = {}
+        self.turns = 0
+        self.failed_turns = 0
+        self.missing_separator = 0
+        self.parse_failures = 0 # Successful turns where parse_options found no options
+        self.regenerated = 0
+        self.tool_errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.tool_counts = np.zeros(0, dtype=np.int64)
+        self.token_hist = np.zeros(len(TOKEN_BINS) - 1, dtype=np.int64)
+        self.genre_turns = np.zeros(0, dtype=np.int64)
+        self.genre_latency_sum = np.zeros(0, dtype=np.float64)
+        self.genre_latency_hist = np.zeros((0, len(LATENCY_BINS) - 1), dtype=np.int64)
+        self.session_turns = {} # session id -> highest turn number seen
+
+    @staticmethod
+    def _code(table: dict, name: str) -> int:
+        code = table.get(name)
+        if code is None:
+            code = table[name] = len(table)
+        return code
+
+    def add_batch(self, records: list):
+        """Folds one batch of turn records into the aggregates."""
+        n = len(records)
+        column = lambda key, dtype, default=0: np.fromiter(
+            (record.get(key) or default for record in records), dtype=dtype, count=n)
+        genre = np.fromiter((self._code(self.genres, record.get("genre") or "unknown") for record in records),
+                            dtype=np.int64, count=n)
+        ok = np.fromiter((bool(record.get("ok", True)) for record in records), dtype=bool, count=n)
+        latency = column("latency_s", np.float64)
+        prompt = column("prompt_tokens", np.int64)
+        completion = column("completion_tokens", np.int64)
+        options_parsed = column("options_parsed", np.int64)
+        separator = np.fromiter((bool(record.get("separator_found")) for record in records), dtype=bool, count=n)
+        regenerated = np.fromiter((bool(record.get("options_regenerated")) for record in records), dtype=bool, count=n)
+        tool_codes = np.fromiter((self._code(self.tools, name) for record in records
+                                  for name in record.get("tool_calls") or []), dtype=np.int64)
+
+        self.turns += n
+        self.failed_turns += int((~ok).sum())
+        self.missing_separator += int((ok & ~separator).sum())
+        self.parse_failures += int((ok & (options_parsed == 0)).sum())
+        self.regenerated += int(regenerated.sum())
+        self.tool_errors += int(column("tool_errors", np.int64).sum())
+        self.prompt_tokens += int(prompt.sum())
+        self.completion_tokens += int(completion.sum())
+
+        self.tool_counts = _grow(self.tool_counts, len(self.tools))
+        self.tool_counts += np.bincount(tool_codes, minlength=len(self.tools))
+        self.token_hist += np.histogram(prompt + completion, bins=TOKEN_BINS)[0]
+
+        genre_count = len(self.genres)
+        self.genre_turns = _grow(self.genre_turns, genre_count)
+        self.genre_latency_sum = _grow(self.genre_latency_sum, genre_count)
+        self.genre_latency_hist = _grow(self.genre_latency_hist, genre_count)
+        self.genre_turns += np.bincount(genre, minlength=genre_count)
+        self.genre_latency_sum += np.bincount(genre, weights=latency, minlength=genre_count)
+        latency_bin = np.clip(np.digitize(latency, LATENCY_BINS) - 1, 0, len(LATENCY_BINS) - 2)
+        np.add.at(self.genre_latency_hist, (genre, latency_bin), 1)
+
+        # Session length: highest turn number per session, reduced per batch before touching the dict
+        session_ids = np.array([record.get("session_id") or "" for record in records])
+        turn_numbers = column("turn", np.int64)
+        unique_ids, inverse = np.unique(session_ids, return_inverse=True)
+        batch_max = np.full(len(unique_ids), -1, dtype=np.int64)
+        np.maximum.at(batch_max, inverse, turn_numbers)
+        for session_id, highest in zip(unique_ids.tolist(), batch_max.tolist()):
+            if highest > self.session_turns.get(session_id, -1):
+                self.session_turns[session_id] = highest
+
+    def tables(self) -> dict:
+        """Summary tables as {name: {column: 1-D array}}."""
+        tool_names = np.array(sorted(self.tools, key=self.tools.get), dtype=str)
+        genre_names = np.array(sorted(self.genres, key=self.genres.get), dtype=str)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            genre_mean = self.genre_latency_sum / self.genre_turns
+        # Sessions have turns 0 (opening) .. n, so n + 1 turns
+        lengths = np.fromiter(self.session_turns.values(), dtype=np.int64, count=len(self.session_turns)) + 1
+        length_counts = np.bincount(lengths) if len(lengths) else np.zeros(0, dtype=np.int64)
+        present = np.nonzero(length_counts)[0]
+        turns = max(self.turns, 1)
+        return {
+            "overview": {
+                "metric": np.array(["turns", "failed_turns", "missing_separator_rate", "options_parse_failure_rate",
+                                    "options_regenerated", "tool_calls_per_turn", "tool_errors",
+                                    "avg_prompt_tokens", "avg_completion_tokens", "sessions"]),
+                "value": np.array([self.turns, self.failed_turns, self.missing_separator / turns,
+                                   self.parse_failures / turns, self.regenerated, self.tool_counts.sum() / turns,
+                                   self.tool_errors, self.prompt_tokens / turns, self.completion_tokens / turns,
+                                   len(self.session_turns)], dtype=np.float64),
+            },
+            "tool_calls": {"tool": tool_names, "calls": self.tool_counts,
+                           "per_turn": self.tool_counts / turns},
+            "tokens_per_turn": {"bin_start": TOKEN_BINS[:-1], "bin_end": TOKEN_BINS[1:], "turns": self.token_hist},
+            "latency_by_genre": {
+                "genre": genre_names, "turns": self.genre_turns, "mean_s": genre_mean,
+                "p50_s": np.array([_histogram_quantile(row, LATENCY_BINS, 0.5) for row in self.genre_latency_hist]),
+                "p95_s": np.array([_histogram_quantile(row, LATENCY_BINS, 0.95) for row in self.genre_latency_hist]),
+            },
+            "session_length": {"turns": present, "sessions": length_counts[present]},
+        }
+
+
+def write_tables(tables: dict, out_dir: str, fmt: str = "auto") -> list:
+    """Writes each table as Parquet (needs pyarrow) or .npz; returns the written paths."""
+    os.makedirs(out_dir, exist_ok=True)
+    if fmt in ("auto", "parquet"):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            if fmt == "parquet":
+                raise
+            fmt = "npz"
+        else:
+            fmt = "parquet"
+
+    paths = []
+    for name, columns in tables.items():
+        if fmt == "parquet":
+            path = os.path.join(out_dir, f"{name}.parquet")
+            pq.write_table(pa.table({key: pa.array(values) for key, values in columns.items()}), path)
+        else:
+            path = os.path.join(out_dir, f"{name}.npz")
+            np.savez(path, **columns)
+        paths.append(path)
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Aggregate StoryLab turn logs into columnar summaries.")
+    parser.add_argument("logs", nargs="+", help="Turn log files (.jsonl or .jsonl.gz)")
+    parser.add_argument("--out", default="analytics", help="Output directory (default: analytics)")
+    parser.add_argument("--format", choices=("auto", "parquet", "npz"), default="auto",
+                        help="Output format; auto uses Parquet when pyarrow is installed")
+    parser.add_argument("--batch-size", type=int, default=50_000, help="Records per batch (default: 50000)")
+    args = parser.parse_args(argv)
+
+    stats = {"bad_lines": 0, "truncated_files": 0}
+    aggregator = TurnLogAggregator()
+    for batch in iter_batches(iter_records(args.logs, stats), args.batch_size):
+        aggregator.add_batch(batch)
+
+    tables = aggregator.tables()
+    for path in write_tables(tables, args.out, args.format):
+        print(f"wrote {path}")
+    overview = tables["overview"]
+    for metric, value in zip(overview["metric"], overview["value"]):
+        print(f"{metric:>28}: {value:,.3f}")
+    if stats["bad_lines"] or stats["truncated_files"]:
+        print(f"skipped {stats['bad_lines']} unreadable lines, {stats['truncated_files']} truncated files",
+              file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
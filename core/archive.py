@@ -0,0 +1,147 @@
+import json
+import mmap
+import os
+import threading
+import time
+import uuid
+import zlib
+
+try:
+    import fcntl # Cross-process append lock (not available on Windows)
+except ImportError:
+    fcntl = None
+
+import streamlit as st
+
+from config import ARCHIVE_DIR
+
+# --- Finished-Story Archive ---
+# Finished stories are appended to one data file (zlib-compressed JSON
+# records, back to back) and described in a separate index file (one JSON
+# line per story: offset, length, genre, characters, turn count, timestamps).
+# Only the index is held in memory, as small tuples. Reading a story maps
+# the data file and decompresses just that record's bytes, so opening a
+# story costs O(story), not O(archive). Both files are append-only. The data
+# is written before its index line, so a crash can leave unused bytes but
+# never a broken index entry. Other processes' appends are picked up by
+# reading the index from where we stopped last time.
+
+DATA_FILE = "stories.dat"
+INDEX_FILE = "stories.idx.jsonl"
+
+# Index entry fields, in tuple order
+ENTRY_FIELDS = ("story_id", "offset", "length", "genre", "characters", "turns", "started_at", "archived_at", "title")
+
+
+class StoryArchive:
+    """Append-only story archive with an in-memory browse index and mmap reads."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.data_path = os.path.join(directory, DATA_FILE)
+        self.index_path = os.path.join(directory, INDEX_FILE)
+        for path in (self.data_path, self.index_path):
+            open(path, "ab").close()
+        self._lock = threading.Lock()
+        self._entries = [] # Tuples in ENTRY_FIELDS order, oldest first
+        self._by_id = {} # story_id -> position in _entries
+        self._index_read_to = 0 # Bytes of the index file already loaded
+        self._map = None
+        self._map_size = 0
+        self.refresh()
+
+    # --- Index ---
+    def refresh(self):
+        """Loads index lines appended since the last call (by this or another process)."""
+        with self._lock:
+            with open(self.index_path, "rb") as f:
+                f.seek(self._index_read_to)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break # Partially written line; read it next time
+                    self._index_read_to += len(line)
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    entry = tuple(record.get(field) for field in ENTRY_FIELDS)
+                    self._by_id[entry[0]] = len(self._entries)
+                    self._entries.append(entry)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def genres(self) -> list:
+        return sorted({entry[3] for entry in self._entries if entry[3]})
+
+    def browse(self, genre: str = None, character: str = None, offset: int = 0, limit: int = 20):
+        """Newest-first index entries (as dicts) matching the filters, plus the total match count."""
+        self.refresh()
+        needle = character.lower().strip() if character else None
+        matches = [
+            entry for entry in reversed(self._entries)
+            if (not genre or entry[3] == genre)
+            and (not needle or any(needle in name.lower() for name in entry[4] or ()))
+        ]
+        page = [dict(zip(ENTRY_FIELDS, entry)) for entry in matches[offset:offset + limit]]
+        return page, len(matches)
+
+    # --- Writing ---
+    def append(self, story: dict, genre: str, characters: list, turns: int, started_at: float = None,
+               title: str = "") -> str:
+        """Archives one finished story and returns its id."""
+        payload = zlib.compress(json.dumps(story, separators=(",", ":")).encode("utf-8"))
+        story_id = uuid.uuid4().hex
+        with self._lock, open(self.data_path, "ab") as data, open(self.index_path, "a+b") as index:
+            if fcntl:
+                fcntl.flock(data.fileno(), fcntl.LOCK_EX) # Released when the file closes
+            data.seek(0, os.SEEK_END)
+            offset = data.tell()
+            data.write(payload)
+            data.flush()
+            os.fsync(data.fileno())
+            record = dict(zip(ENTRY_FIELDS, (story_id, offset, len(payload), genre, list(characters), turns,
+                                             started_at, time.time(), title)))
+            index.seek(0, os.SEEK_END)
+            if index.tell():
+                index.seek(-1, os.SEEK_END)
+                if index.read(1) != b"\n":
+                    index.write(b"\n") # Close a line left half-written by a crash
+            index.write((json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8"))
+        self.refresh()
+        return story_id
+
+    # --- Reading ---
+    def _mapped(self, needed_size: int):
+        """A read-only map of the data file covering at least `needed_size` bytes."""
+        if self._map is None or self._map_size < needed_size:
+            if self._map is not None:
+                self._map.close()
+            with open(self.data_path, "rb") as f:
+                self._map_size = os.fstat(f.fileno()).st_size
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self._map_size else None
+        return self._map
+
+    def read(self, story_id: str):
+        """The archived story (metadata plus content), or None for an unknown id."""
+        self.refresh()
+        position = self._by_id.get(story_id)
+        if position is None:
+            return None
+        entry = self._entries[position]
+        offset, length = entry[1], entry[2]
+        with self._lock:
+            mapped = self._mapped(offset + length)
+            payload = mapped[offset:offset + length]
+        story = json.loads(zlib.decompress(payload))
+        story["meta"] = dict(zip(ENTRY_FIELDS, entry))
+        return story
+
+
+@st.cache_resource
+def get_story_archive():
+    """The process-wide story archive, or None when archiving is off."""
+    if not ARCHIVE_DIR:
+        return None
+    return StoryArchive(ARCHIVE_DIR)
@@ -0,0 +1,326 @@
+import hashlib
+import json
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from abc import ABC, abstractmethod
+from collections import deque
+from types import SimpleNamespace
+
+from cerebras.cloud.sdk import Cerebras
+
+from config import (OPTIONS_SEPARATOR, LLM_BACKENDS, OPENAI_BASE_URL, OPENAI_API_KEY, OPENAI_MODEL,
+                    BACKEND_WINDOW_SECONDS, BACKEND_ERROR_THRESHOLD, BACKEND_COOLDOWN_SECONDS)
+from .cassette import to_namespace
+
+# --- LLM Backends ---
+# Every backend answers `create(model=..., stream=..., **params)` with
+# SDK-shaped objects: a completion with `choices[0].message` (content and
+# tool_calls), or, when streaming, an iterator of chunks with
+# `choices[0].delta`. The rest of the app only sees the
+# `client.chat.completions.create(...)` surface, so a BackendSelector
+# (or a single backend) drops in wherever the Cerebras client was used, cassettes included.
+#
+# The selector keeps each backend's recent latency and errors over a time
+# window. Each request goes to the healthy backend with the lowest expected
+# time (latency, inflated by its recent error rate) and fails over to
+# the next one on an error. A backend whose recent error rate crosses the
+# threshold is benched for a cooldown period. Samples age out of the window,
+# so a backend that was slow gets tried again later.
+
+_MIN_SAMPLES_FOR_HEALTH = 3  # Don't bench a backend on one or two unlucky calls
+
+
+class BackendError(RuntimeError):
+    """A backend could not produce a completion (HTTP error, bad response, ...)."""
+
+
+class LLMBackend(ABC):
+    """Interface for chat completion providers (streaming and tool calls included)."""
+    name = "backend"
+
+    @abstractmethod
+    def create(self, model: str, stream: bool = False, **params):
+        """A completion (or, with `stream`, an iterator of chunks) shaped like the Cerebras SDK's."""
+
+
+class CerebrasBackend(LLMBackend):
+    """The Cerebras Cloud SDK."""
+    name = "cerebras"
+
+    def __init__(self, api_key: str):
+        self._client = Cerebras(api_key=api_key)
+
+    def create(self, model: str, stream: bool = False, **params):
+        return self._client.chat.completions.create(model=model, stream=stream, **params)
+
+
+class OpenAICompatibleBackend(LLMBackend):
+    """Any server speaking the OpenAI chat completions HTTP API (vLLM, llama.cpp, hosted providers, ...)."""
+    name = "openai"
+
+    def __init__(self, base_url: str, api_key: str = None, model: str = None, timeout: float = 120.0):
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self.api_key = api_key
+        self.model = model # Replaces the route's model name, which may not exist on this server
+        self.timeout = timeout
+
+    def _post(self, payload: dict):
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        request = urllib.request.Request(self.url, data=json.dumps(payload).encode("utf-8"), headers=headers)
+        try:
+            return urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            detail = e.read().decode("utf-8", "replace")[:200]
+            raise BackendError(f"{self.name}: HTTP {e.code}: {detail}") from e
+        except urllib.error.URLError as e:
+            raise BackendError(f"{self.name}: {e.reason}") from e
+
+    def create(self, model: str, stream: bool = False, **params):
+        payload = dict(params, model=self.model or model, stream=stream)
+        response = self._post(payload)
+        if stream:
+            return self._events(response)
+        with response:
+            return to_namespace(self._with_defaults(json.loads(response.read()), "message"))
+
+    @staticmethod
+    def _with_defaults(data: dict, part: str) -> dict:
+        """Fills in fields servers leave out (plain-text replies have no tool_calls, chunks rarely
+        have a usage), so the response has every attribute the SDK's would."""
+        data.setdefault("usage", None)
+        for choice in data.setdefault("choices", []):
+            choice.setdefault("finish_reason", None)
+            message = choice.setdefault(part, {}) or {}
+            choice[part] = message
+            message.setdefault("role", "assistant" if part == "message" else None)
+            message.setdefault("content", None)
+            message.setdefault("tool_calls", None)
+            for call in message["tool_calls"] or []:
+                call.setdefault("id", None)
+                call.setdefault("type", "function")
+                function = call.setdefault("function", {}) or {}
+                call["function"] = function
+                function.setdefault("name", None)
+                function.setdefault("arguments", None)
+        return data
+
+    @classmethod
+    def _events(cls, response):
+        """Server-sent events as SDK-shaped chunks; closing the generator closes the connection."""
+        try:
+            for raw in response:
+                line = raw.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                yield to_namespace(cls._with_defaults(json.loads(data), "delta"))
+        finally:
+            response.close()
+
+
+_STUB_MOODS = ("curious", "brave", "worried", "cheerful")
+# Cast names as the system prompt ('Name' (a role...)) or a scene note (- Name: role) lists them
+_STUB_CHARACTER = re.compile(r"'([^']+)' \(a |^- ([^:\n]+): ", re.MULTILINE)
+
+
+class LocalStubBackend(LLMBackend):
+    """Deterministic offline backend for tests and demos: the same request always gets the same turn.
+
+    When tools are offered for the user's input, the stub first calls `change_mood` for a cast
+    member, so the tool round trip (and the post-tool route) runs offline too.
+    """
+    name = "stub"
+
+    def create(self, model: str, stream: bool = False, **params):
+        messages = params.get("messages") or []
+        digest = hashlib.sha256(json.dumps(messages, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        tool_call = self._tool_call(params.get("tools"), messages, digest)
+        if tool_call is not None:
+            return self._tool_call_response(tool_call, messages, stream)
+        text = (f"The path bends ahead, and the companions share a look before moving on (scene {digest[:6]}).\n\n"
+                f"{OPTIONS_SEPARATOR}\n1. 🌲 Follow the path into the woods\n"
+                f"2. 🗣️ Ask a companion what they think\n3. 🔍 Look around for clues")
+        usage = SimpleNamespace(prompt_tokens=sum(len(str(m.get("content") or "")) for m in messages) // 4,
+                                completion_tokens=len(text) // 4)
+        usage.total_tokens = usage.prompt_tokens + usage.completion_tokens
+        if not stream:
+            message = SimpleNamespace(role="assistant", content=text, tool_calls=None)
+            return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")], usage=usage)
+        return self._chunks(text, usage)
+
+    @staticmethod
+    def _tool_call(tools, messages: list, digest: str):
+        """A change_mood call for the first cast member, when tools are offered for the user's input."""
+        if not tools or not messages or messages[-1].get("role") != "user":
+            return None
+        if not any((tool.get("function") or {}).get("name") == "change_mood" for tool in tools):
+            return None
+        cast = "\n".join(str(m.get("content") or "") for m in messages if m.get("role") == "system")
+        match = _STUB_CHARACTER.search(cast)
+        if match is None:
+            return None
+        arguments = {"character_name": match.group(1) or match.group(2),
+                     "mood": _STUB_MOODS[int(digest[:2], 16) % len(_STUB_MOODS)]}
+        return SimpleNamespace(id=f"call_{digest[:12]}", type="function",
+                               function=SimpleNamespace(name="change_mood", arguments=json.dumps(arguments)))
+
+    @staticmethod
+    def _tool_call_response(tool_call, messages: list, stream: bool):
+        usage = SimpleNamespace(prompt_tokens=sum(len(str(m.get("content") or "")) for m in messages) // 4,
+                                completion_tokens=len(tool_call.function.arguments) // 4)
+        usage.total_tokens = usage.prompt_tokens + usage.completion_tokens
+        if not stream:
+            message = SimpleNamespace(role="assistant", content=None, tool_calls=[tool_call])
+            return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="tool_calls")], usage=usage)
+        delta_call = SimpleNamespace(index=0, id=tool_call.id, type=tool_call.type, function=tool_call.function)
+        delta = SimpleNamespace(role="assistant", content=None, tool_calls=[delta_call])
+        return iter([SimpleNamespace(choices=[SimpleNamespace(delta=delta, finish_reason="tool_calls")], usage=usage)])
+
+    @staticmethod
+    def _chunks(text: str, usage):
+        lines = text.splitlines(keepends=True)
+        for i, line in enumerate(lines):
+            last = i == len(lines) - 1
+            delta = SimpleNamespace(role="assistant" if i == 0 else None, content=line, tool_calls=None)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta, finish_reason="stop" if last else None)],
+                                  usage=usage if last else None)
+
+
+# --- Selection and failover ---
+class _BackendHealth:
+    __slots__ = ("samples", "benched_until", "calls", "errors")
+
+    def __init__(self):
+        self.samples = deque() # (monotonic time, ok, seconds) within the window
+        self.benched_until = 0.0
+        self.calls = 0
+        self.errors = 0
+
+
+class BackendSelector:
+    """Routes each request to the fastest healthy backend, failing over to the others on errors."""
+
+    def __init__(self, backends: list, window_seconds: float = 300.0, error_threshold: float = 0.5,
+                 cooldown_seconds: float = 30.0):
+        if not backends:
+            raise ValueError("BackendSelector needs at least one backend.")
+        self.backends = list(backends)
+        self.window_seconds = window_seconds
+        self.error_threshold = error_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self._lock = threading.Lock()
+        self._health = {backend.name: _BackendHealth() for backend in self.backends}
+        # Same surface as the SDK client: client.chat.completions.create(...)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def _prune(self, health: _BackendHealth, now: float):
+        while health.samples and now - health.samples[0][0] > self.window_seconds:
+            health.samples.popleft()
+
+    @staticmethod
+    def _latency(health: _BackendHealth):
+        """Average recent latency of successful calls (None without any)."""
+        latencies = [seconds for _, ok, seconds in health.samples if ok]
+        return sum(latencies) / len(latencies) if latencies else None
+
+    def _cost(self, health: _BackendHealth) -> float:
+        """Expected seconds per successful call: latency inflated by the recent error rate."""
+        if not health.samples:
+            return 0.0 # Unknown, so a new (or recovered) backend gets tried
+        latency = self._latency(health)
+        if latency is None:
+            return float("inf") # Only failures recently
+        failures = sum(1 for _, ok, _ in health.samples if not ok)
+        return latency * len(health.samples) / (len(health.samples) - failures)
+
+    def ranked(self) -> list:
+        """Backends in the order to try: healthy ones fastest first, then benched ones as a last resort."""
+        now = time.monotonic()
+        with self._lock:
+            keys = {}
+            for order, backend in enumerate(self.backends):
+                health = self._health[backend.name]
+                self._prune(health, now)
+                benched = health.benched_until > now
+                keys[backend.name] = (benched, health.benched_until if benched else self._cost(health), order)
+        return sorted(self.backends, key=lambda backend: keys[backend.name])
+
+    def _record(self, backend: LLMBackend, seconds: float, ok: bool):
+        now = time.monotonic()
+        with self._lock:
+            health = self._health[backend.name]
+            health.calls += 1
+            health.errors += 0 if ok else 1
+            health.samples.append((now, ok, seconds))
+            self._prune(health, now)
+            failures = sum(1 for _, sample_ok, _ in health.samples if not sample_ok)
+            if (not ok and len(health.samples) >= _MIN_SAMPLES_FOR_HEALTH
+                    and failures / len(health.samples) >= self.error_threshold):
+                health.benched_until = now + self.cooldown_seconds
+
+    def create(self, model: str, stream: bool = False, **params):
+        """Same signature as `client.chat.completions.create`."""
+        error = None
+        for backend in self.ranked():
+            started = time.perf_counter()
+            try:
+                # For streams this is the time until the response started
+                result = backend.create(model=model, stream=stream, **params)
+            except Exception as e:
+                self._record(backend, time.perf_counter() - started, ok=False)
+                error = e
+                continue
+            self._record(backend, time.perf_counter() - started, ok=True)
+            return result
+        raise error
+
+    def snapshot(self) -> dict:
+        """Per backend: calls, errors, recent error rate and latency, and whether it's benched."""
+        now = time.monotonic()
+        with self._lock:
+            snapshot = {}
+            for backend in self.backends:
+                health = self._health[backend.name]
+                self._prune(health, now)
+                recent = len(health.samples)
+                latency = self._latency(health)
+                snapshot[backend.name] = {
+                    "calls": health.calls, "errors": health.errors,
+                    "recent_error_rate": round(sum(1 for _, ok, _ in health.samples if not ok) / recent, 2)
+                    if recent else None,
+                    "recent_avg_s": round(latency, 3) if latency is not None else None,
+                    "benched_for_s": round(max(0.0, health.benched_until - now), 1),
+                }
+            return snapshot
+
+
+def build_backends(api_key: str) -> list:
+    """The configured backends (STORYLAB_BACKENDS), skipping ones that lack their settings."""
+    backends = []
+    for name in LLM_BACKENDS:
+        if name == CerebrasBackend.name:
+            if api_key:
+                backends.append(CerebrasBackend(api_key))
+        elif name == OpenAICompatibleBackend.name:
+            if OPENAI_BASE_URL:
+                backends.append(OpenAICompatibleBackend(OPENAI_BASE_URL, OPENAI_API_KEY, OPENAI_MODEL))
+        elif name == LocalStubBackend.name:
+            backends.append(LocalStubBackend())
+        else:
+            raise ValueError(f"Unknown backend '{name}'. Use cerebras, openai or stub.")
+    return backends
+
+
+def build_selector(api_key: str):
+    """A BackendSelector over the configured backends, or None when none of them can be used."""
+    backends = build_backends(api_key)
+    if not backends:
+        return None
+    return BackendSelector(backends, BACKEND_WINDOW_SECONDS, BACKEND_ERROR_THRESHOLD, BACKEND_COOLDOWN_SECONDS)
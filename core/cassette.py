@@ -0,0 +1,165 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+from types import SimpleNamespace
+
+# --- Record/Replay Cassettes ---
+# A cassette wraps a completion client and exposes the same
+# `client.chat.completions.create(...)` surface used by run_narrative_step.
+# In "record" mode every request is forwarded to the real client and the
+# request/response pair is appended to a gzip'd JSON-lines file.
+# In "replay" mode no network is used: requests are matched by a digest of
+# their canonical JSON form and the recorded responses are returned in order.
+
+CASSETTE_MODES = ("record", "replay")
+
+
+class CassetteMissError(KeyError):
+    """Raised in replay mode when a request was never recorded."""
+
+
+def request_key(request: dict) -> str:
+    """Returns a stable digest for a completion request (used for matching)."""
+    canonical = json.dumps(request, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+
+
+def to_plain(obj):
+    """Converts an SDK response object (pydantic model, namespace, etc.) into plain JSON data."""
+    if obj is None or isinstance(obj, (str, int, float, bool)):
+        return obj
+    if isinstance(obj, dict):
+        return {k: to_plain(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [to_plain(v) for v in obj]
+    if hasattr(obj, "model_dump"):
+        return to_plain(obj.model_dump())
+    if hasattr(obj, "to_dict"):
+        return to_plain(obj.to_dict())
+    if hasattr(obj, "__dict__"):
+        return {k: to_plain(v) for k, v in vars(obj).items() if not k.startswith("_")}
+    return str(obj)
+
+
+def to_namespace(data):
+    """Converts plain JSON data back into attribute-access objects mimicking the SDK response."""
+    if isinstance(data, dict):
+        return SimpleNamespace(**{k: to_namespace(v) for k, v in data.items()})
+    if isinstance(data, list):
+        return [to_namespace(v) for v in data]
+    return data
+
+
+class _Completions:
+    def __init__(self, cassette):
+        self._cassette = cassette
+
+    def create(self, **kwargs):
+        return self._cassette.create(**kwargs)
+
+
+class _Chat:
+    def __init__(self, cassette):
+        self.completions = _Completions(cassette)
+
+
+class CassetteClient:
+    """Completion client that records to, or replays from, a cassette file."""
+
+    def __init__(self, path: str, mode: str = "replay", client=None):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        if mode == "record" and client is None:
+            raise ValueError("Recording a cassette requires a real client.")
+        self.path = path
+        self.mode = mode
+        self.client = client
+        self.chat = _Chat(self)
+        self._lock = threading.Lock()
+        # key -> list of recorded responses (plain data), consumed in order on replay
+        self._recorded = {}
+        self._cursor = {}
+        self._file = None
+        if mode == "replay":
+            self._load()
+
+    def _load(self):
+        """Loads every recorded interaction from the cassette file."""
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"Cassette not found: {self.path}")
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            try:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    self._recorded.setdefault(entry["key"], []).append(entry)
+            except (EOFError, json.JSONDecodeError):
+                # A recording process that died mid-write leaves a truncated tail; keep what was flushed
+                pass
+
+    def _append(self, key: str, request: dict, response=None, chunks=None):
+        """Appends one interaction to the cassette file (thread-safe)."""
+        entry = {"key": key, "request": request}
+        if chunks is not None:
+            entry["chunks"] = chunks
+        else:
+            entry["response"] = response
+        line = json.dumps(entry, separators=(",", ":"), default=str) + "\n"
+        with self._lock:
+            if self._file is None:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                # One gzip member per recording run keeps the compression window shared across
+                # turns (histories repeat heavily); appending to an old cassette adds a new member.
+                self._file = gzip.open(self.path, "at", encoding="utf-8")
+            self._file.write(line)
+            # Sync-flush so every interaction is readable even if the process dies
+            self._file.flush()
+
+    def close(self):
+        """Finishes the cassette file (record mode)."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def create(self, **kwargs):
+        """Same signature as `client.chat.completions.create`."""
+        request = to_plain(kwargs)
+        key = request_key(request)
+        if self.mode == "record":
+            response = self.client.chat.completions.create(**kwargs)
+            if kwargs.get("stream"):
+                return self._record_stream(key, request, response)
+            self._append(key, request, response=to_plain(response))
+            return response
+        return self._replay(key)
+
+    def _record_stream(self, key: str, request: dict, stream):
+        """Yields streamed chunks through to the caller while recording them."""
+        chunks = []
+        try:
+            for chunk in stream:
+                chunks.append(to_plain(chunk))
+                yield chunk
+        finally:
+            # Record whatever was consumed, even if the caller stopped early
+            self._append(key, request, chunks=chunks)
+
+    def _replay(self, key: str):
+        """Returns the next recorded response for a request key."""
+        with self._lock:
+            entries = self._recorded.get(key)
+            if not entries:
+                raise CassetteMissError(f"No recorded response matches request {key}.")
+            position = self._cursor.get(key, 0)
+            # Repeated identical requests get successive recordings, then the last one again
+            entry = entries[min(position, len(entries) - 1)]
+            self._cursor[key] = position + 1
+        if "chunks" in entry:
+            return (to_namespace(chunk) for chunk in entry["chunks"])
+        return to_namespace(entry["response"])
@@ -0,0 +1,134 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import streamlit as st
+
+from config import CHARACTER_ENRICHMENT, ENRICHMENT_WORKERS, ENRICHMENT_TIMEOUT_SECONDS, ENRICHMENT_CACHE_SIZE
+from .ai_interactions import create_chat_completion, drop_reasoning
+from .generation_policy import get_policy, TURN_CHARACTER_ENRICHMENT
+from .routing import ROUTE_CHARACTER_ENRICHMENT
+from .prompts import build_character_enrichment_prompt
+from .reasoning import with_thinking_switch
+from .scheduler import PRIORITY_INTERACTIVE
+from .overload import get_overload_controller
+
+# --- Custom Character Enrichment ---
+# Preset characters come with a description, while custom ones only have the
+# name and role typed in on the setup screen. When a story starts, each
+# custom character gets a one-sentence description and a starting location
+# from the fast model. All of a cast's calls are submitted together to a
+# shared pool, so starting the story waits about as long as one call, not
+# one call per character. Results are cached by (genre, name, role), and
+# identical requests already in flight (another tab, a double click) share
+# one call. Enrichment is optional: under overload, after a failed call or
+# past the timeout, the character starts with just its name and role.
+
+_DESCRIPTION_CHARS = 300
+_LOCATION_CHARS = 60
+_LINE = re.compile(r"^\W*(description|location)\W*:[\s*_]*(.+?)[\s*_]*$", re.IGNORECASE | re.MULTILINE)
+
+
+def enrichment_key(genre: str, name: str, role: str) -> tuple:
+    """Cache key for one character's details."""
+    return (genre, name.strip(), role.strip())
+
+
+def parse_enrichment(text: str):
+    """{"description", "location"} from the model's two-line answer, or None if the description is missing."""
+    details = {}
+    for label, value in _LINE.findall(text or ""):
+        details.setdefault(label.lower(), value.strip().strip('"'))
+    if not details.get("description"):
+        return None
+    return {"description": details["description"][:_DESCRIPTION_CHARS],
+            "location": (details.get("location") or "")[:_LOCATION_CHARS] or None}
+
+
+class CharacterEnricher:
+    """Generates custom characters' details concurrently and caches them by (genre, name, role)."""
+
+    def __init__(self, client, workers: int, timeout_seconds: float, cache_size: int):
+        self.client = client
+        self.timeout_seconds = timeout_seconds
+        self.cache_size = cache_size
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="enrichment")
+        self._lock = threading.Lock()
+        self._cache = OrderedDict() # key -> details, least recently used first
+        self._pending = {}          # key -> Future of a call in flight
+        self.stats = {"characters": 0, "cache_hits": 0, "shared_in_flight": 0, "generated": 0, "failed": 0,
+                      "timed_out": 0, "skipped_overload": 0, "last_batch": 0, "last_wait_s": None}
+
+    def enrich(self, genre: str, characters: list, session_id: str = None) -> dict:
+        """Details by name for the given characters (dicts with name and role); missing ones have none."""
+        started = time.perf_counter()
+        allowed = get_overload_controller().speculative_allowed()
+        results, futures = {}, {}
+        with self._lock:
+            self.stats["characters"] += len(characters)
+            for char in characters:
+                key = enrichment_key(genre, char["name"], char["role"])
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    results[char["name"]] = dict(self._cache[key])
+                    self.stats["cache_hits"] += 1
+                elif key in self._pending:
+                    futures[char["name"]] = self._pending[key]
+                    self.stats["shared_in_flight"] += 1
+                elif allowed:
+                    future = self._executor.submit(self._generate, key, session_id)
+                    self._pending[key] = future
+                    futures[char["name"]] = future
+                else:
+                    self.stats["skipped_overload"] += 1
+
+        # One wait for the whole cast; calls still running keep going and fill the cache for next time
+        done, not_done = wait(set(futures.values()), timeout=self.timeout_seconds) if futures else (set(), set())
+        for name, future in futures.items():
+            if future in done and future.result() is not None:
+                results[name] = dict(future.result())
+        with self._lock:
+            self.stats["timed_out"] += len(not_done)
+            self.stats["last_batch"] = len(futures)
+            self.stats["last_wait_s"] = round(time.perf_counter() - started, 3)
+        return results
+
+    def _generate(self, key: tuple, session_id: str):
+        """Worker: one model call for one character; returns its details or None."""
+        genre, name, role = key
+        policy = get_policy(TURN_CHARACTER_ENRICHMENT)
+        messages = [{"role": "user", "content": with_thinking_switch(
+            build_character_enrichment_prompt(genre, name, role), policy.thinking)}]
+        details = None
+        try:
+            completion = create_chat_completion(self.client, messages, None, policy, session_id=session_id,
+                                                priority=PRIORITY_INTERACTIVE, route=ROUTE_CHARACTER_ENRICHMENT)
+            details = parse_enrichment(drop_reasoning(completion.choices[0].message.content or "", policy))
+        except Exception:
+            details = None
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+                if details is None:
+                    self.stats["failed"] += 1 # Not cached, so the next story start tries again
+                else:
+                    self.stats["generated"] += 1
+                    self._cache[key] = details
+                    while len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+        return details
+
+    def snapshot(self) -> dict:
+        """Cache size, calls in flight and counters."""
+        with self._lock:
+            return {"cached": len(self._cache), "in_flight": len(self._pending), **self.stats}
+
+
+@st.cache_resource
+def get_character_enricher(_client):
+    """The process-wide character enricher, or None when enrichment is off."""
+    if not CHARACTER_ENRICHMENT:
+        return None
+    return CharacterEnricher(_client, ENRICHMENT_WORKERS, ENRICHMENT_TIMEOUT_SECONDS, ENRICHMENT_CACHE_SIZE)
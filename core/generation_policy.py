@@ -0,0 +1,217 @@
+import threading
+from types import SimpleNamespace
+
+from config import (OPTIONS_SEPARATOR, MAX_TOKENS_OPENING, MAX_TOKENS_OPTION, MAX_TOKENS_FREE_TEXT,
+                    GENERATION_TEMPERATURE, STOP_SEQUENCES, STREAM_RESPONSES, STRUCTURED_OUTPUT,
+                    THINKING_TURN_KINDS, MAX_TOKENS_OPTION_REGENERATION, MAX_TOKENS_CHARACTER_ENRICHMENT)
+from .structured_output import RESPONSE_FORMAT
+from .reasoning import is_thinking, THINK_CLOSE
+
+# --- Generation Policy ---
+# Every turn type gets its own output budget. A response is "complete" once
+# the three option lines after OPTIONS_SEPARATOR are written; anything after
+# that is overrun we pay for in latency. Server-side stop sequences cut off a
+# fourth numbered option, streaming responses are stopped client-side as soon
+# as the third option line ends, and non-streamed text is trimmed to the same
+# point. Token use and overrun are recorded per turn type to tune the limits.
+
+TURN_OPENING = "opening"        # The first scene of a story
+TURN_OPTION = "option"          # The user picked one of the offered options
+TURN_FREE_TEXT = "free_text"    # The user typed their own action
+TURN_OPTION_REGENERATION = "option_regeneration"  # Options only, for a turn that came back without them
+TURN_CHARACTER_ENRICHMENT = "character_enrichment"  # Description and starting location for a custom character
+
+OPTION_COUNT = 3
+
+
+class GenerationPolicy:
+    """Request parameters for one turn type."""
+    __slots__ = ("turn_kind", "max_tokens", "temperature", "stop", "stream", "response_format", "thinking")
+
+    def __init__(self, turn_kind: str, max_tokens: int, temperature: float, stop: list, stream: bool,
+                 response_format: dict = None, thinking: bool = False):
+        self.turn_kind = turn_kind
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.stop = stop
+        self.stream = stream
+        self.response_format = response_format # JSON schema constraint in structured mode
+        self.thinking = thinking # False sends the model's no-think switch
+
+    def request_params(self) -> dict:
+        """Keyword arguments for `chat.completions.create`."""
+        params = {"max_tokens": self.max_tokens, "temperature": self.temperature}
+        if self.stop:
+            params["stop"] = self.stop
+        if self.response_format:
+            params["response_format"] = self.response_format
+        return params
+
+
+_RESPONSE_FORMAT = RESPONSE_FORMAT if STRUCTURED_OUTPUT else None
+
+_POLICIES = {
+    TURN_OPENING: GenerationPolicy(TURN_OPENING, MAX_TOKENS_OPENING, GENERATION_TEMPERATURE, STOP_SEQUENCES,
+                                   STREAM_RESPONSES, _RESPONSE_FORMAT,
+                                   TURN_OPENING in THINKING_TURN_KINDS),
+    TURN_OPTION: GenerationPolicy(TURN_OPTION, MAX_TOKENS_OPTION, GENERATION_TEMPERATURE, STOP_SEQUENCES,
+                                  STREAM_RESPONSES, _RESPONSE_FORMAT,
+                                  TURN_OPTION in THINKING_TURN_KINDS),
+    TURN_FREE_TEXT: GenerationPolicy(TURN_FREE_TEXT, MAX_TOKENS_FREE_TEXT, GENERATION_TEMPERATURE, STOP_SEQUENCES,
+                                     STREAM_RESPONSES, _RESPONSE_FORMAT,
+                                     TURN_FREE_TEXT in THINKING_TURN_KINDS),
+    # Plain text, no streaming and no thinking: it's a short auxiliary call
+    TURN_OPTION_REGENERATION: GenerationPolicy(TURN_OPTION_REGENERATION, MAX_TOKENS_OPTION_REGENERATION,
+                                               GENERATION_TEMPERATURE, STOP_SEQUENCES, False),
+    TURN_CHARACTER_ENRICHMENT: GenerationPolicy(TURN_CHARACTER_ENRICHMENT, MAX_TOKENS_CHARACTER_ENRICHMENT,
+                                                GENERATION_TEMPERATURE, None, False),
+}
+
+
+def get_policy(turn_kind: str) -> GenerationPolicy:
+    """The generation policy for a turn type (option follow-up by default)."""
+    return _POLICIES.get(turn_kind, _POLICIES[TURN_OPTION])
+
+
+# --- Completion detection ---
+def options_end_index(text: str, separator: str = OPTIONS_SEPARATOR, count: int = OPTION_COUNT):
+    """Index just past the newline ending the `count`-th option line, or None if not there yet."""
+    start = text.find(separator)
+    if start == -1:
+        return None
+    position = start + len(separator)
+    completed = 0
+    while True:
+        newline = text.find("\n", position)
+        if newline == -1:
+            return None
+        if text[position:newline].strip():
+            completed += 1
+            if completed >= count:
+                return newline + 1
+        position = newline + 1
+
+
+def trim_after_options(text: str, separator: str = OPTIONS_SEPARATOR, count: int = OPTION_COUNT):
+    """Drops anything written after the last option line. Returns (text, overrun characters)."""
+    if not text:
+        return text, 0
+    end = options_end_index(text, separator, count)
+    if end is None or not text[end:].strip():
+        return text, 0
+    return text[:end].rstrip(), len(text) - end
+
+
+# --- Streaming with client-side stop ---
+def collect_stream(stream, separator: str = OPTIONS_SEPARATOR, count: int = OPTION_COUNT):
+    """
+    Reads a streamed completion into a response object shaped like a non-streamed one,
+    closing the stream as soon as the option block is complete (unless tools are being called).
+    """
+    content_parts = []
+    tool_calls = {} # index -> {"id", "type", "name", "arguments"}
+    role = "assistant"
+    finish_reason = None
+    usage = None
+    stopped_early = False
+
+    for chunk in stream:
+        usage = getattr(chunk, "usage", None) or usage
+        if not chunk.choices:
+            continue
+        choice = chunk.choices[0]
+        delta = choice.delta
+        role = getattr(delta, "role", None) or role
+        finish_reason = getattr(choice, "finish_reason", None) or finish_reason
+        for tc in getattr(delta, "tool_calls", None) or []:
+            call = tool_calls.setdefault(tc.index, {"id": None, "type": "function", "name": "", "arguments": ""})
+            call["id"] = tc.id or call["id"]
+            call["type"] = getattr(tc, "type", None) or call["type"]
+            if tc.function is not None:
+                call["name"] += tc.function.name or ""
+                call["arguments"] += tc.function.arguments or ""
+        if getattr(delta, "content", None):
+            content_parts.append(delta.content)
+            # Only look for the end of the options when a new line arrived (and not in reasoning)
+            if not tool_calls and "\n" in delta.content:
+                text = "".join(content_parts)
+                answer = text.rpartition(THINK_CLOSE)[2]
+                if not is_thinking(text) and options_end_index(answer, separator, count) is not None:
+                    stopped_early = True
+                    finish_reason = "client_stop"
+                    break
+
+    if stopped_early and hasattr(stream, "close"):
+        stream.close() # Stop paying for tokens nobody will read
+
+    message = SimpleNamespace(
+        role=role,
+        content="".join(content_parts) or None,
+        tool_calls=[
+            SimpleNamespace(id=call["id"], type=call["type"],
+                            function=SimpleNamespace(name=call["name"], arguments=call["arguments"]))
+            for _, call in sorted(tool_calls.items())
+        ] or None,
+    )
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=message, finish_reason=finish_reason)],
+        usage=usage,
+        stopped_early=stopped_early,
+    )
+
+
+# --- Overrun statistics ---
+class PolicyStats:
+    """Process-wide output-length statistics per turn type."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _entry(self, turn_kind: str) -> dict:
+        return self._stats.setdefault(turn_kind, {
+            "calls": 0, "completion_tokens": 0, "max_completion_tokens": 0, "hit_max_tokens": 0,
+            "early_stops": 0, "overrun_responses": 0, "overrun_chars": 0,
+            "reasoning_responses": 0, "reasoning_chars": 0,
+        })
+
+    def record_call(self, turn_kind: str, completion_tokens, finish_reason, stopped_early: bool = False):
+        with self._lock:
+            entry = self._entry(turn_kind)
+            entry["calls"] += 1
+            entry["completion_tokens"] += completion_tokens or 0
+            entry["max_completion_tokens"] = max(entry["max_completion_tokens"], completion_tokens or 0)
+            if finish_reason == "length":
+                entry["hit_max_tokens"] += 1
+            if stopped_early:
+                entry["early_stops"] += 1
+
+    def record_overrun(self, turn_kind: str, overrun_chars: int):
+        if overrun_chars <= 0:
+            return
+        with self._lock:
+            entry = self._entry(turn_kind)
+            entry["overrun_responses"] += 1
+            entry["overrun_chars"] += overrun_chars
+
+    def record_reasoning(self, turn_kind: str, reasoning_chars: int):
+        if reasoning_chars <= 0:
+            return
+        with self._lock:
+            entry = self._entry(turn_kind)
+            entry["reasoning_responses"] += 1
+            entry["reasoning_chars"] += reasoning_chars
+
+    def snapshot(self) -> dict:
+        """Per turn type totals plus average completion tokens per call."""
+        with self._lock:
+            snapshot = {}
+            for turn_kind, entry in self._stats.items():
+                entry = dict(entry)
+                entry["avg_completion_tokens"] = entry["completion_tokens"] / entry["calls"] if entry["calls"] else 0
+                entry["max_tokens_limit"] = get_policy(turn_kind).max_tokens
+                snapshot[turn_kind] = entry
+            return snapshot
+
+
+POLICY_STATS = PolicyStats()
@@ -1,45 +1,62 @@
 import streamlit as st
+import logging
 import re # Needed for parsing text
 import json # Needed for function args
 
+logger = logging.getLogger(__name__)
+
 # --- Helper Functions ---
 
 # Function to update character status based on function calls
-def update_character_status(tool_call_name=None, function_args=None):
-    """Updates character status in session state based on tool call arguments."""
-    if 'character_status' not in st.session_state:
-        st.session_state.character_status = {}
+def update_character_status(tool_call_name=None, function_args=None, character_status=None):
+    """Updates character status (session state by default) based on tool call arguments."""
+    # An explicit character_status may be updated off the script thread (story jobs, the scene pool),
+    # where st.* calls can't render anything, so problems are only logged there
+    on_script_thread = character_status is None
+    if character_status is None:
+        if 'character_status' not in st.session_state:
+            st.session_state.character_status = {}
+        character_status = st.session_state.character_status
 
     # Update based on tool calls
     if tool_call_name and function_args:
-        if tool_call_name == "move_character":
-            character = function_args.get("character_name")
-            location = function_args.get("location")
-            if character and location:
-                 # Find the character case-insensitively if necessary, or rely on model to match name exactly
-                 found_char_name = None
-                 for char_name in st.session_state.character_status.keys():
-                     if char_name.lower() == character.lower():
-                         found_char_name = char_name
-                         break
-
-                 if found_char_name:
-                    st.session_state.character_status[found_char_name]["location"] = location
-                    # Optional: Add a log message
-                    # st.sidebar.write(f"🚗 Updated {found_char_name}'s location to {location}")
-                 else:
-                     # Optional: Log if character not found
-                     st.sidebar.warning(f"AI tried to move unknown character: {character}")
+        character = function_args.get("character_name")
+        if tool_call_name not in ("move_character", "pick_up_item", "change_mood") or not character:
+            return
+
+        # Find the character case-insensitively if necessary, or rely on model to match name exactly
+        found_char_name = None
+        for char_name in character_status.keys():
+            if char_name.lower() == character.lower():
+                found_char_name = char_name
+                break
+
+        if not found_char_name:
+            logger.info("AI tried to update unknown character: %s", character)
+            if on_script_thread:
+                st.sidebar.warning(f"AI tried to update unknown character: {character}")
+            return
+
+        if tool_call_name == "move_character" and function_args.get("location"):
+            character_status[found_char_name]["location"] = function_args["location"]
+            # Optional: Add a log message
+            # st.sidebar.write(f"🚗 Updated {found_char_name}'s location to {location}")
+        elif tool_call_name == "pick_up_item" and function_args.get("item"):
+            character_status[found_char_name].setdefault("items", []).append(function_args["item"])
+        elif tool_call_name == "change_mood" and function_args.get("mood"):
+            character_status[found_char_name]["mood"] = function_args["mood"]
 
 
 # Function to extract locations from narrative text using simple heuristics
-def extract_locations_from_text(text):
+def extract_locations_from_text(text, character_status=None):
     """Attempts to extract location changes from narrative text and update character status."""
-    if 'character_status' not in st.session_state:
-        return # Don't display if no characters are set up
+    if character_status is None:
+        if 'character_status' not in st.session_state:
+            return # Don't display if no characters are set up
+        character_status = st.session_state.character_status
 
     # Get list of characters to track
-    characters = list(st.session_state.character_status.keys())
+    characters = list(character_status.keys())
 
     # Simple pattern matching for location changes
     # This regex is basic and might need refinement for complex narratives
@@ -70,7 +87,7 @@ def extract_locations_from_text(text):
 
             if found_char_name and location and len(location) > 2: # Avoid very short or empty locations
                 # Update the location for the found character
-                st.session_state.character_status[found_char_name]["location"] = location
+                character_status[found_char_name]["location"] = location
                 # Optional: Add a log message
                 # st.sidebar.write(f"🗺️ Extracted {found_char_name}'s location as {location}")
                 # If we find one update, we can potentially stop for this text chunk,
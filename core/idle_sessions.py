@@ -0,0 +1,105 @@
+import logging
+import os
+import threading
+import time
+import weakref
+
+import streamlit as st
+
+from config import IDLE_EVICT_MINUTES, IDLE_SWEEP_SECONDS, SPILL_DIR
+
+logger = logging.getLogger(__name__)
+
+# --- Idle Session Eviction ---
+# Streamlit keeps a session's state in server memory until its websocket
+# drops, so a tab left open overnight pins its whole story. Each rerun marks
+# its session's turn store as active. A background sweep spills stores that
+# have been idle longer than the limit to disk, as compressed JSON, and
+# empties them in place. The session state keeps the same (now small)
+# object. The next interaction rehydrates it before anything reads it.
+# A spilled store whose session ends deletes its file.
+
+
+class IdleSessionManager:
+    """Tracks turn-store activity per session and spills idle ones to disk."""
+
+    def __init__(self, spill_dir: str, idle_seconds: float, sweep_seconds: float):
+        self.spill_dir = spill_dir
+        self.idle_seconds = idle_seconds
+        self.sweep_seconds = sweep_seconds
+        os.makedirs(spill_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        # store -> (session id, last active); entries vanish when a session's store is garbage collected
+        self._stores = weakref.WeakKeyDictionary()
+        self.stats = {"evictions": 0, "rehydrations": 0, "bytes_freed": 0, "bytes_spilled": 0, "spill_errors": 0}
+        self._sweeper = threading.Thread(target=self._sweep_forever, name="idle-session-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def touch(self, session_id: str, turn_store):
+        """Marks a session active, loading its story back first if it was spilled."""
+        with self._lock:
+            self._stores[turn_store] = (session_id, time.monotonic())
+            if turn_store.spilled:
+                turn_store.rehydrate()
+                self.stats["rehydrations"] += 1
+        return turn_store
+
+    def _sweep_forever(self):
+        while True:
+            time.sleep(self.sweep_seconds)
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Idle session sweep failed")
+
+    def sweep(self) -> int:
+        """Spills every store idle for longer than the limit; returns how many were spilled."""
+        now = time.monotonic()
+        spilled = 0
+        with self._lock:
+            for store, (session_id, last_active) in list(self._stores.items()):
+                if store.spilled or now - last_active < self.idle_seconds:
+                    continue
+                path = os.path.join(self.spill_dir, f"{session_id}-{id(store):x}.json.z")
+                freed = store.memory_bytes()
+                try:
+                    written = store.spill(path)
+                except OSError:
+                    self.stats["spill_errors"] += 1
+                    logger.exception("Could not spill idle session %s", session_id)
+                    continue
+                self.stats["evictions"] += 1
+                self.stats["bytes_freed"] += max(0, freed - store.memory_bytes())
+                self.stats["bytes_spilled"] += written
+                spilled += 1
+        if spilled:
+            logger.info("Spilled %d idle sessions to %s", spilled, self.spill_dir)
+        return spilled
+
+    def snapshot(self) -> dict:
+        """Sessions in memory vs. spilled, memory per in-memory session, and eviction counters."""
+        with self._lock:
+            stores = list(self._stores.keys())
+            stats = dict(self.stats)
+        in_memory = [store.memory_bytes() for store in stores if not store.spilled]
+        spilled = [store.spill_path for store in stores if store.spilled]
+        return {
+            "sessions": len(stores),
+            "in_memory": len(in_memory),
+            "spilled": len(spilled),
+            "memory_bytes_per_session": {
+                "mean": sum(in_memory) // len(in_memory) if in_memory else 0,
+                "max": max(in_memory, default=0),
+                "total": sum(in_memory),
+            },
+            "spill_bytes_on_disk": sum(os.path.getsize(path) for path in spilled if os.path.exists(path)),
+            **stats,
+        }
+
+
+@st.cache_resource
+def get_idle_session_manager():
+    """The process-wide idle session manager, or None when eviction is off."""
+    if IDLE_EVICT_MINUTES <= 0:
+        return None
+    return IdleSessionManager(SPILL_DIR, IDLE_EVICT_MINUTES * 60, IDLE_SWEEP_SECONDS)
@@ -0,0 +1,161 @@
+import hashlib
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+from config import JOB_WORKERS
+
+# --- Background Generation Jobs ---
+# Model calls run on a shared executor instead of inside the Streamlit script
+# thread. The session only keeps a job id; the page polls for the result, so
+# the UI stays responsive and a session that dies mid-call can't leave a
+# `processing` flag stuck. Python can't interrupt a running thread, so
+# cancellation and timeouts discard the job's result rather than stopping it.
+#
+# A job can be submitted with an idempotency key (see `turn_request_key`).
+# Submitting the same key again while the first job is running, or finished
+# but not yet collected, returns the existing job id instead of starting a
+# second model call, and both callers are served from its result.
+
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+JOB_TIMED_OUT = "timed_out"
+JOB_MISSING = "missing"  # Unknown id, e.g. after a server restart
+
+# Finished jobs nobody collected (closed tabs) are forgotten after this long
+_ABANDONED_AFTER_SECONDS = 15 * 60
+
+
+class _Job:
+    __slots__ = ("future", "submitted_at", "timeout", "state", "finished_at", "key", "waiters")
+
+    def __init__(self, future, timeout: float, key: str = None):
+        self.future = future
+        self.submitted_at = time.monotonic()
+        self.timeout = timeout
+        self.state = JOB_RUNNING
+        self.finished_at = None
+        self.key = key
+        self.waiters = 1 # Callers holding this job id; it's forgotten once all have discarded it
+
+
+def turn_request_key(session_id: str, message_id: str, option_index: int = None, text: str = None) -> str:
+    """Idempotency key for a turn request: the message being answered plus the option or typed text."""
+    if option_index is not None:
+        return f"{session_id}:{message_id}:option:{option_index}"
+    digest = hashlib.sha1((text or "").strip().encode("utf-8")).hexdigest()[:16]
+    return f"{session_id}:{message_id}:text:{digest}"
+
+
+class JobManager:
+    """Runs callables on a shared thread pool and tracks them by job id."""
+
+    def __init__(self, max_workers: int):
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="story-job")
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._keys = {} # idempotency key -> job id
+        self.stats = {"submitted": 0, "done": 0, "failed": 0, "cancelled": 0, "timed_out": 0,
+                      "duplicates_suppressed": 0}
+
+    def submit(self, fn, *args, timeout: float = 120.0, key: str = None, **kwargs) -> str:
+        """Starts `fn(*args, **kwargs)` in the background and returns its job id.
+
+        With a `key`, a job already running (or finished and uncollected) for that key is reused.
+        """
+        with self._lock:
+            self._prune()
+            job_id = self._keys.get(key) if key is not None else None
+            job = self._jobs.get(job_id)
+            if job is not None and job.state in (JOB_RUNNING, JOB_DONE):
+                job.waiters += 1
+                self.stats["duplicates_suppressed"] += 1
+                return job_id
+            # Submitted under the lock, so two callers with the same key can't both start a job
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = _Job(self._executor.submit(fn, *args, **kwargs), timeout, key)
+            if key is not None:
+                self._keys[key] = job_id
+            self.stats["submitted"] += 1
+        return job_id
+
+    def record_duplicate(self):
+        """Counts a duplicate request that was dropped before reaching `submit`."""
+        with self._lock:
+            self.stats["duplicates_suppressed"] += 1
+
+    def _finish(self, job: _Job, state: str):
+        job.state = state
+        job.finished_at = time.monotonic()
+        self.stats[state] += 1
+
+    def poll(self, job_id: str):
+        """Returns (state, result or exception) without blocking."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return JOB_MISSING, None
+            if job.state == JOB_RUNNING:
+                if job.future.done():
+                    error = job.future.exception()
+                    self._finish(job, JOB_FAILED if error else JOB_DONE)
+                elif time.monotonic() - job.submitted_at > job.timeout:
+                    job.future.cancel() # Only helps if it hasn't started yet
+                    self._finish(job, JOB_TIMED_OUT)
+            if job.state == JOB_DONE:
+                return JOB_DONE, job.future.result()
+            if job.state == JOB_FAILED:
+                return JOB_FAILED, job.future.exception()
+            return job.state, None
+
+    def cancel(self, job_id: str):
+        """Marks a job cancelled; its result will be discarded."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.state == JOB_RUNNING:
+                job.future.cancel()
+                self._finish(job, JOB_CANCELLED)
+
+    def discard(self, job_id: str):
+        """Forgets a job once every caller holding it has collected its result."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.waiters -= 1
+            if job.waiters <= 0:
+                self._forget(job_id)
+
+    def _forget(self, job_id: str):
+        """Removes a job and its idempotency key (call with the lock held)."""
+        job = self._jobs.pop(job_id)
+        if job.key is not None and self._keys.get(job.key) == job_id:
+            del self._keys[job.key]
+
+    def _prune(self):
+        """Drops jobs finished long ago that no session came back for (call with the lock held)."""
+        now = time.monotonic()
+        stale = [job_id for job_id, job in self._jobs.items()
+                 if (job.finished_at or job.submitted_at + job.timeout) + _ABANDONED_AFTER_SECONDS < now]
+        for job_id in stale:
+            self._forget(job_id)
+
+    def snapshot(self) -> dict:
+        """Job counters and how many jobs are currently tracked/running."""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["tracked"] = len(self._jobs)
+            stats["running"] = sum(1 for job in self._jobs.values()
+                                   if job.state == JOB_RUNNING and not job.future.done())
+            return stats
+
+
+@st.cache_resource
+def get_job_manager():
+    """The process-wide job manager shared by all sessions."""
+    return JobManager(JOB_WORKERS)
@@ -0,0 +1,86 @@
+import heapq
+import math
+import re
+from collections import Counter
+
+# --- Story Memory (BM25 over past turns) ---
+# Long stories only send the most recent turns to the model. To keep older
+# events (characters met, items found, promises made) available, every turn
+# is added to a small in-process inverted index as it is recorded. When a new
+# turn starts, the turns that fell out of the prompt window are ranked with
+# BM25 against the user's choice and the best few are sent as a compact
+# memory block. No external service is involved. Only term counts are kept,
+# and passage text is read back from the turn store when needed.
+
+_TOKEN = re.compile(r"[a-z0-9']+")
+_STOPWORDS = frozenset("""
+a an and are as at be but by for from has have he her his i in is it its of on or she that the their them
+then there they this to was were will with you your we our me my not so do does did into out up what who
+""".split())
+
+MEMORY_HEADER = "Earlier in the story (for reference, keep these details consistent):"
+
+
+def tokenize(text: str) -> list:
+    """Lower-cased word tokens without very common words."""
+    return [token for token in _TOKEN.findall((text or "").lower())
+            if token not in _STOPWORDS and len(token) > 1]
+
+
+class BM25Index:
+    """Incremental BM25 index over short passages, keyed by an integer id."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = {} # term -> {doc_id: term frequency}
+        self._doc_lengths = {} # doc_id -> token count
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._doc_lengths)
+
+    def add(self, doc_id: int, text: str):
+        """Indexes (or re-indexes) one passage."""
+        if doc_id in self._doc_lengths:
+            self.remove(doc_id)
+        tokens = tokenize(text)
+        for term, count in Counter(tokens).items():
+            self._postings.setdefault(term, {})[doc_id] = count
+        self._doc_lengths[doc_id] = len(tokens)
+        self._total_length += len(tokens)
+
+    def remove(self, doc_id: int):
+        """Drops a passage from the index."""
+        length = self._doc_lengths.pop(doc_id, None)
+        if length is None:
+            return
+        self._total_length -= length
+        for term in list(self._postings):
+            postings = self._postings[term]
+            if postings.pop(doc_id, None) is not None and not postings:
+                del self._postings[term]
+
+    def search(self, query: str, k: int, allowed: set = None) -> list:
+        """Top `k` (score, doc_id) pairs for the query, optionally limited to `allowed` ids."""
+        doc_count = len(self._doc_lengths)
+        if not doc_count or k <= 0:
+            return []
+        average_length = self._total_length / doc_count or 1.0
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                if allowed is not None and doc_id not in allowed:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[doc_id] / average_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(k, ((score, doc_id) for doc_id, score in scores.items()))
+
+
+def format_memory_block(passages: list) -> str:
+    """The memory message content for recalled passages (oldest first)."""
+    return MEMORY_HEADER + "\n" + "\n".join(f"- {passage}" for passage in passages)
@@ -0,0 +1,153 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from config import (OVERLOAD_CONTROL, OVERLOAD_TARGET_LATENCY_SECONDS, OVERLOAD_MAX_LOAD, OVERLOAD_WINDOW_SECONDS,
+                    OVERLOAD_COOLDOWN_SECONDS, OVERLOAD_MAX_TOKENS_FACTOR, OVERLOAD_HISTORY_TURNS)
+from .scheduler import get_scheduler
+from .generation_policy import GenerationPolicy
+
+logger = logging.getLogger(__name__)
+
+# --- Overload Controller ---
+# When the model gets slow or requests pile up, every user's turn gets slow at
+# once. The controller turns recent model latency and the scheduler's queued
+# plus in-flight requests into one pressure value (1.0 = at the configured
+# limit). It then steps through degradation levels; each level keeps the ones
+# below it:
+#   1. no speculative work (opening-scene pool refills)
+#   2. shorter responses (max_tokens scaled down)
+#   3. shorter prompt history
+#   4. no tools, so a turn never needs the second (post-tool) model call
+# Levels go up as soon as pressure crosses their threshold. They come down
+# one at a time, after pressure has stayed clearly below the threshold for a
+# cooldown period, so the app doesn't flap between levels.
+
+LEVEL_NORMAL = 0
+LEVEL_NO_SPECULATIVE = 1
+LEVEL_SHORT_RESPONSES = 2
+LEVEL_SHORT_HISTORY = 3
+LEVEL_NO_TOOLS = 4
+
+LEVEL_NAMES = {
+    LEVEL_NORMAL: "normal",
+    LEVEL_NO_SPECULATIVE: "no speculative work",
+    LEVEL_SHORT_RESPONSES: "shorter responses",
+    LEVEL_SHORT_HISTORY: "shorter history",
+    LEVEL_NO_TOOLS: "no tool round trip",
+}
+
+# Pressure at which each level is entered
+_THRESHOLDS = {LEVEL_NO_SPECULATIVE: 1.0, LEVEL_SHORT_RESPONSES: 1.5, LEVEL_SHORT_HISTORY: 2.0, LEVEL_NO_TOOLS: 3.0}
+_RECOVERY_MARGIN = 0.8  # A level is left once pressure is below 80% of its threshold
+
+
+class OverloadController:
+    """Process-wide degradation level derived from model latency and scheduler load."""
+
+    def __init__(self, target_latency: float, max_load: int, window_seconds: float, cooldown_seconds: float,
+                 enabled: bool = True):
+        self.enabled = enabled
+        self.target_latency = target_latency
+        self.max_load = max(1, max_load)
+        self.window_seconds = window_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self._lock = threading.Lock()
+        self._latencies = deque() # (monotonic time, seconds) within the window
+        self.level = LEVEL_NORMAL
+        self._changed_at = time.monotonic()
+        self._calm_since = None # When pressure first dropped below the current level's recovery point
+        self.pressure = 0.0
+        self.stats = {"level_changes": 0, "max_level": LEVEL_NORMAL}
+
+    def observe_latency(self, seconds: float):
+        """Records how long a model call took."""
+        with self._lock:
+            self._latencies.append((time.monotonic(), seconds))
+
+    def _recent_latency(self, now: float) -> float:
+        while self._latencies and now - self._latencies[0][0] > self.window_seconds:
+            self._latencies.popleft()
+        if not self._latencies:
+            return 0.0 # No recent calls: nothing suggests the model is slow
+        return sum(seconds for _, seconds in self._latencies) / len(self._latencies)
+
+    def update(self) -> int:
+        """Re-evaluates pressure and returns the (possibly changed) degradation level."""
+        if not self.enabled:
+            return LEVEL_NORMAL
+        queued, in_flight = get_scheduler().load()
+        with self._lock:
+            now = time.monotonic()
+            latency = self._recent_latency(now)
+            self.pressure = max(latency / self.target_latency, (queued + in_flight) / self.max_load)
+            target = max((level for level, threshold in _THRESHOLDS.items() if self.pressure >= threshold),
+                         default=LEVEL_NORMAL)
+
+            if target > self.level:
+                self._set_level(target, now, latency, queued, in_flight)
+            elif self.level > LEVEL_NORMAL and self.pressure < _THRESHOLDS[self.level] * _RECOVERY_MARGIN:
+                if self._calm_since is None:
+                    self._calm_since = now
+                elif now - self._calm_since >= self.cooldown_seconds:
+                    self._set_level(self.level - 1, now, latency, queued, in_flight)
+            else:
+                self._calm_since = None
+            return self.level
+
+    def _set_level(self, level: int, now: float, latency: float, queued: int, in_flight: int):
+        # Degrading is a warning; stepping back down is informational
+        logger.log(logging.WARNING if level > self.level else logging.INFO,
+                   "Overload level %d (%s) entered from %d: pressure=%.2f latency=%.1fs queued=%d in_flight=%d",
+                   level, LEVEL_NAMES[level], self.level, self.pressure, latency, queued, in_flight)
+        self.level = level
+        self._changed_at = now
+        self._calm_since = None
+        self.stats["level_changes"] += 1
+        self.stats["max_level"] = max(self.stats["max_level"], level)
+
+    # --- What the current level allows ---
+    def speculative_allowed(self) -> bool:
+        return self.update() < LEVEL_NO_SPECULATIVE
+
+    def adjust_policy(self, policy: GenerationPolicy) -> GenerationPolicy:
+        """The policy to use at the current level (a shortened copy when degraded)."""
+        if self.update() < LEVEL_SHORT_RESPONSES:
+            return policy
+        return GenerationPolicy(policy.turn_kind, max(1, int(policy.max_tokens * OVERLOAD_MAX_TOKENS_FACTOR)),
+                                policy.temperature, policy.stop, policy.stream, policy.response_format,
+                                policy.thinking)
+
+    def history_turns(self, max_turns: int) -> int:
+        """How many recent turns to send to the model (0 = all)."""
+        if self.update() < LEVEL_SHORT_HISTORY:
+            return max_turns
+        return min(max_turns, OVERLOAD_HISTORY_TURNS) if max_turns > 0 else OVERLOAD_HISTORY_TURNS
+
+    def tools_allowed(self) -> bool:
+        return self.update() < LEVEL_NO_TOOLS
+
+    def snapshot(self) -> dict:
+        """Current level, pressure and level-change counters."""
+        level = self.update()
+        with self._lock:
+            return {"level": level, "level_name": LEVEL_NAMES[level], "pressure": round(self.pressure, 2),
+                    "seconds_at_level": round(time.monotonic() - self._changed_at, 1), **self.stats}
+
+
+# --- Shared instance ---
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_overload_controller() -> OverloadController:
+    """Returns the process-wide overload controller, creating it from config on first use."""
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = OverloadController(OVERLOAD_TARGET_LATENCY_SECONDS, OVERLOAD_MAX_LOAD,
+                                                 OVERLOAD_WINDOW_SECONDS, OVERLOAD_COOLDOWN_SECONDS,
+                                                 enabled=OVERLOAD_CONTROL)
+    return _controller
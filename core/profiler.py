@@ -0,0 +1,147 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import time
+from collections import deque
+
+import streamlit as st
+
+from config import PROFILE_RERUNS, PROFILE_CPROFILE, PROFILE_DIR
+
+# --- Rerun Profiler ---
+# Every interaction re-executes app.py from the top. When profiling is on
+# (STORYLAB_PROFILE=1, or ?profile=1 / ?profile=cprofile in the URL), the
+# script marks its sections with checkpoints and each rerun's time is split
+# across them. Stats are kept per session. A rerun that ends early through
+# st.stop() or st.rerun() never reaches finish_rerun(), so it is closed at its
+# last checkpoint when the next rerun starts.
+
+_RECENT_RERUNS = 200  # Rerun durations kept for percentiles
+_CPROFILE_LINES = 30  # Functions shown from the latest cProfile run
+
+
+class RerunProfiler:
+    """Per-session rerun timing, split into named script sections."""
+    enabled = True
+
+    def __init__(self, use_cprofile: bool = False):
+        self.use_cprofile = use_cprofile
+        self.reruns = 0
+        self.interrupted = 0 # Reruns ended by st.stop()/st.rerun() before the end of the script
+        self.durations = deque(maxlen=_RECENT_RERUNS)
+        self.sections = {} # name -> {"count", "total", "max"}
+        self.last_rerun = {} # name -> seconds in the latest finished rerun
+        self.last_cprofile = None # Top functions of the latest finished rerun
+        self._started = None
+        self._section = None
+        self._section_started = None
+        self._current = {}
+        self._cprofile = None
+
+    def start_rerun(self):
+        """Marks the start of a script run (closing a previous one that ended early)."""
+        if self._started is not None:
+            self.interrupted += 1
+            self._close(self._section_started)
+        now = time.perf_counter()
+        self._started = now
+        self._section = "startup"
+        self._section_started = now
+        self._current = {}
+        if self.use_cprofile:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def checkpoint(self, name: str):
+        """Ends the current section and starts the next one."""
+        if self._started is None:
+            return
+        now = time.perf_counter()
+        self._current[self._section] = self._current.get(self._section, 0.0) + now - self._section_started
+        self._section = name
+        self._section_started = now
+
+    def finish_rerun(self):
+        """Marks the end of the script run."""
+        if self._started is not None:
+            self._close(time.perf_counter())
+
+    def _close(self, end: float):
+        self._current[self._section] = self._current.get(self._section, 0.0) + end - self._section_started
+        for name, seconds in self._current.items():
+            entry = self.sections.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+            entry["count"] += 1
+            entry["total"] += seconds
+            entry["max"] = max(entry["max"], seconds)
+        self.last_rerun = self._current
+        self.durations.append(end - self._started)
+        self.reruns += 1
+        self._started = None
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            output = io.StringIO()
+            pstats.Stats(self._cprofile, stream=output).sort_stats("cumulative").print_stats(_CPROFILE_LINES)
+            self.last_cprofile = output.getvalue()
+            self._cprofile = None
+
+    def snapshot(self) -> dict:
+        """Rerun counts, duration percentiles (ms) and time per section."""
+        durations = sorted(self.durations)
+
+        def ms(seconds):
+            return round(seconds * 1000, 2)
+
+        return {
+            "reruns": self.reruns,
+            "interrupted": self.interrupted,
+            "rerun_ms": {
+                "avg": ms(sum(durations) / len(durations)),
+                "p50": ms(durations[len(durations) // 2]),
+                "p95": ms(durations[min(len(durations) - 1, int(len(durations) * 0.95))]),
+                "max": ms(durations[-1]),
+            } if durations else None,
+            "sections_ms": {
+                name: {"avg": ms(entry["total"] / entry["count"]), "max": ms(entry["max"]),
+                       "total": ms(entry["total"]), "last": ms(self.last_rerun.get(name, 0.0))}
+                for name, entry in sorted(self.sections.items(), key=lambda item: -item[1]["total"])
+            },
+        }
+
+    def dump(self, session_id: str) -> str:
+        """Writes the snapshot (and latest cProfile output) to a JSON file; returns its path."""
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"rerun-profile-{session_id}-{int(time.time())}.json")
+        data = self.snapshot()
+        data["cprofile"] = self.last_cprofile
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        return path
+
+
+class _NullProfiler:
+    """Stand-in used when profiling is off; every hook is a no-op."""
+    enabled = False
+
+    def start_rerun(self):
+        pass
+
+    def checkpoint(self, name: str):
+        pass
+
+    def finish_rerun(self):
+        pass
+
+
+_NULL_PROFILER = _NullProfiler()
+
+
+def get_rerun_profiler():
+    """This session's profiler, or a no-op one when profiling isn't enabled."""
+    mode = st.query_params.get("profile")
+    if not (PROFILE_RERUNS or mode in ("1", "cprofile")):
+        return _NULL_PROFILER
+    if "rerun_profiler" not in st.session_state:
+        st.session_state.rerun_profiler = RerunProfiler(use_cprofile=PROFILE_CPROFILE or mode == "cprofile")
+    return st.session_state.rerun_profiler
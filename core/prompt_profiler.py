@@ -0,0 +1,183 @@
+import argparse
+import gzip
+import json
+import re
+import sys
+
+from .memory import MEMORY_HEADER
+from .scene import SCENE_HEADER
+from .prompts import (build_option_prompt, build_free_text_prompt, build_initial_scene_prompt,
+                      build_option_regeneration_prompt)
+
+# --- Prompt Token Attribution ---
+# Usage: python -m core.prompt_profiler cassettes/session.jsonl.gz [logs/turns.jsonl.gz ...] [--per-turn]
+#
+# Splits each model request into the parts that make up its prompt and
+# estimates their tokens locally (no tokenizer download, no API call):
+#   system       the narrator system prompt
+#   tools        the tool schemas sent with the request
+#   instructions prompt-builder boilerplate around the user's input
+#   input        the user's own choice or typed action
+#   narrative    story text (assistant turns, and the narrative quoted for option regeneration)
+#   tool_calls   the model's tool calls (names and arguments)
+#   tool_results tool messages sent back to the model
+#   memory       recalled earlier passages (core/memory.py)
+#   scene        the large-cast scene note (core/scene.py)
+# The live app adds the breakdown to each turn's metrics when
+# STORYLAB_PROMPT_ATTRIBUTION=1. Offline, this tool reads recorded cassettes
+# (the full requests) and turn logs (the breakdowns) alike.
+
+PARTS = ("system", "tools", "instructions", "input", "narrative", "tool_calls", "tool_results", "memory", "scene")
+
+_MESSAGE_OVERHEAD = 4  # Role and separator tokens per chat message
+_TOKEN = re.compile(r"[A-Za-z]+|\d+|[^\sA-Za-z\d]")
+_SENTINEL = "\x00"
+
+# (prefix, suffix, part) for every user prompt the app builds; the text between is the variable part
+_TEMPLATES = [
+    tuple(template.split(_SENTINEL)) + (part,) for template, part in (
+        (build_option_prompt(_SENTINEL), "input"),
+        (build_free_text_prompt(_SENTINEL), "input"),
+        (build_initial_scene_prompt([_SENTINEL]), "input"),
+        (build_option_regeneration_prompt(_SENTINEL), "narrative"),
+    )
+]
+
+
+def approx_tokens(text: str) -> int:
+    """Approximate BPE token count: short words are one token, long words one per ~6 letters."""
+    count = 0
+    for token in _TOKEN.findall(text or ""):
+        if token[0].isalpha():
+            count += 1 + (len(token) - 1) // 6
+        elif token[0].isdigit():
+            count += (len(token) + 2) // 3
+        else:
+            count += 1 if token.isascii() else 2 # Emoji and other symbols take several bytes
+    return count
+
+
+def _split_user_message(content: str):
+    """(boilerplate tokens, variable part, variable tokens) for a user message."""
+    for prefix, suffix, part in _TEMPLATES:
+        if content.startswith(prefix):
+            end = content.rfind(suffix, len(prefix))
+            if end != -1:
+                variable = content[len(prefix):end]
+                variable_tokens = approx_tokens(variable)
+                return approx_tokens(content) - variable_tokens, part, variable_tokens
+    return 0, "input", approx_tokens(content) # Not built by a known template: all the user's own
+
+
+def attribute_request(request: dict) -> dict:
+    """Estimated prompt tokens per part (see PARTS) for one chat completion request."""
+    parts = dict.fromkeys(PARTS, 0)
+    if request.get("tools"):
+        parts["tools"] += approx_tokens(json.dumps(request["tools"]))
+    for index, message in enumerate(request.get("messages") or []):
+        role = message.get("role")
+        content = message.get("content") or ""
+        if role == "system":
+            if content.startswith(MEMORY_HEADER):
+                part = "memory"
+            elif content.startswith(SCENE_HEADER):
+                part = "scene"
+            else:
+                part = "system" if index == 0 else "instructions"
+            parts[part] += approx_tokens(content) + _MESSAGE_OVERHEAD
+        elif role == "user":
+            boilerplate, part, variable = _split_user_message(content)
+            parts["instructions"] += boilerplate + _MESSAGE_OVERHEAD
+            parts[part] += variable
+        elif role == "tool":
+            parts["tool_results"] += approx_tokens(content) + _MESSAGE_OVERHEAD
+        else:
+            parts["narrative"] += approx_tokens(content) + _MESSAGE_OVERHEAD
+            for call in message.get("tool_calls") or []:
+                function = call.get("function") or {}
+                parts["tool_calls"] += approx_tokens(function.get("name")) + approx_tokens(function.get("arguments"))
+    return parts
+
+
+def add_prompt_parts(totals: dict, parts: dict) -> dict:
+    """Adds one breakdown into a running one (in place) and returns it."""
+    for part, tokens in parts.items():
+        totals[part] = totals.get(part, 0) + tokens
+    return totals
+
+
+# --- Offline reports ---
+def iter_turns(path: str):
+    """Yields (session, per-turn breakdown) from a cassette or a turn log."""
+    opener = gzip.open if path.endswith(".gz") else open
+    turn = None
+    with opener(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if "request" in entry:
+                    # Cassette: one entry per model call. A call answering tool results belongs
+                    # to the same turn as the call before it.
+                    messages = entry["request"].get("messages") or []
+                    continues = turn is not None and messages and messages[-1].get("role") == "tool"
+                    if turn is not None and not continues:
+                        yield path, turn
+                        turn = None
+                    turn = add_prompt_parts(turn or {}, attribute_request(entry["request"]))
+                elif entry.get("prompt_parts"):
+                    yield entry.get("session_id") or path, entry["prompt_parts"]
+        except EOFError:
+            pass # Truncated gzip tail from a process still writing (or killed mid-write)
+    if turn is not None:
+        yield path, turn
+
+
+def format_table(rows: list) -> str:
+    """Renders (label, breakdown) rows as a fixed-width table with totals and shares."""
+    columns = [part for part in PARTS if any(parts.get(part) for _, parts in rows)]
+    width = max([len("row")] + [len(str(label)) for label, _ in rows])
+    lines = ["  ".join([f"{'row':<{width}}"] + [f"{part:>12}" for part in columns] + [f"{'total':>8}"])]
+    for label, parts in rows:
+        lines.append("  ".join([f"{label:<{width}}"] + [f"{parts.get(part, 0):>12,}" for part in columns]
+                               + [f"{sum(parts.values()):>8,}"]))
+    grand = {}
+    for _, parts in rows:
+        add_prompt_parts(grand, parts)
+    total = sum(grand.values()) or 1
+    lines.append("  ".join([f"{'share':<{width}}"] + [f"{grand.get(part, 0) / total:>12.1%}" for part in columns]
+                           + [f"{'':>8}"]))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Break StoryLab prompts down into their parts (approximate tokens).")
+    parser.add_argument("logs", nargs="+", help="Cassettes (.jsonl.gz) or turn logs with prompt_parts")
+    parser.add_argument("--per-turn", action="store_true", help="Also print one row per turn")
+    args = parser.parse_args(argv)
+
+    sessions = {}
+    turn_rows = []
+    for path in args.logs:
+        for session, parts in iter_turns(path):
+            totals = sessions.setdefault(session, {})
+            add_prompt_parts(totals, parts)
+            totals["_turns"] = totals.get("_turns", 0) + 1
+            turn_rows.append((f"{session}#{totals['_turns']}", parts))
+    if not sessions:
+        print("No requests or prompt breakdowns found.", file=sys.stderr)
+        return
+
+    if args.per_turn:
+        print(format_table(turn_rows))
+        print()
+    turns = {session: totals.pop("_turns") for session, totals in sessions.items()}
+    print(format_table([(f"{session} ({turns[session]} turns)", totals) for session, totals in sessions.items()]))
+
+
+if __name__ == "__main__":
+    main()
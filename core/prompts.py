@@ -0,0 +1,69 @@
+from config import OPTIONS_SEPARATOR, STRUCTURED_OUTPUT, SCENE_FULL_CAST_MAX
+from .structured_output import STRUCTURED_PROMPT
+
+# --- Prompt Builders ---
+# Shared by the live app and by background work (e.g. the opening-scene pool),
+# so a pre-generated scene is produced from exactly the same prompts.
+
+def _describe_character(name: str, info: dict) -> str:
+    """One cast entry for the system prompt: name, role and, when known, description and starting place."""
+    details = info['role']
+    if info.get("description"):
+        details += f": {info['description']}"
+    if info.get("location") and info["location"] != "Starting Location": # The setup screen's placeholder
+        details += f", starting at {info['location']}"
+    return f"'{name}' (a {details})"
+
+
+def build_system_prompt(theme: str, character_status: dict) -> str:
+    """Builds the narrator system prompt for a theme and cast."""
+    if len(character_status) > SCENE_FULL_CAST_MAX:
+        # Large casts aren't listed here; each turn comes with a note on who is in the scene
+        cast_sentence = f"The story has a large cast of {len(character_status)} characters; the ones in the current scene are listed in a scene note."
+    else:
+        character_descriptions = [_describe_character(name, info) for name, info in character_status.items()]
+        cast_sentence = f"The main characters are {', '.join(character_descriptions)}."
+
+    prompt = f"""You are the narrator and controller of the characters in this {theme.lower()} world. {cast_sentence} Your primary role is to tell an engaging story based on user choices and actively manage the characters.
+
+In this world, characters are dynamic! They frequently move between locations and talk to each other. **It is essential that you represent these actions using the provided tools.**
+
+- **Whenever a character changes location**, use the `move_character` tool (e.g., if Elara goes to the market, call `move_character` with character_name='Elara', location='the Market').
+- **Whenever one character speaks directly to another character**, use the `speak_to_character` tool (e.g., if Kael asks Elara a question, call `speak_to_character` with speaking_character='Kael', target_character='Elara', message='Are you ready?').
+- **Whenever a character picks something up**, use the `pick_up_item` tool, and **whenever a character's feelings change**, use the `change_mood` tool.
+
+After describing the scene or events resulting from a tool call or user input, *always* provide at least one paragraph of narrative. Then, *always* provide exactly 3 distinct potential options for the user to choose from to continue the story, formatted after the '{OPTIONS_SEPARATOR}' separator. Each option should start with a relevant emoji that represents that choice.
+
+Remember to use simple, everyday language suitable for readers ages 8 and up. Keep sentences short and words common.
+"""
+    if STRUCTURED_OUTPUT:
+        prompt += STRUCTURED_PROMPT
+    return prompt
+
+
+def build_initial_scene_prompt(character_names: list) -> str:
+    """Builds the prompt that asks for the opening scene."""
+    # Create a comma-separated list of character names
+    character_names_list = ", ".join(character_names)
+    # Also slightly rephrased to encourage immediate action/interaction
+    return f"Describe the starting scene with {character_names_list}. Have them begin interacting or moving right away. Ensure at least one paragraph of detail, and then provide the first 3 options following the '{OPTIONS_SEPARATOR}' separator. Each option should start with a relevant emoji that represents that choice. Use simple, everyday language that both kids and adults can understand easily."
+
+
+def build_option_prompt(option_text: str) -> str:
+    """Builds the model prompt for a chosen option."""
+    return f"The user chooses this option: '{option_text}'. Describe the events that unfold as a result in the narrative. Actively use `move_character` and `speak_to_character` tools where appropriate to drive the action. Ensure at least one paragraph of detail, and then provide 3 new options following the '{OPTIONS_SEPARATOR}' separator. Each option should start with a relevant emoji that represents that choice. Remember to use simple, everyday language that both kids and adults can understand easily."
+
+
+def build_free_text_prompt(input_text: str) -> str:
+    """Builds the model prompt for a typed action."""
+    return f"{input_text}\n\nDescribe the events that unfold. Actively use `move_character` and `speak_to_character` tools where appropriate to drive the action. Remember to provide 3 options after your response, each option should start with a relevant emoji that represents that choice. Use simple, everyday language that both kids and adults can understand easily."
+
+
+def build_option_regeneration_prompt(narrative: str) -> str:
+    """Builds the prompt that asks only for the 3 options after a narrative that came without them."""
+    return f"Here is the latest part of an interactive story:\n\n{narrative}\n\nWrite exactly 3 short, distinct options for what the reader could do next. Write '{OPTIONS_SEPARATOR}' on its own line, then the options as a numbered list. Each option should start with a relevant emoji that represents that choice. Use simple, everyday language that both kids and adults can understand easily. Do not write anything else."
+
+
+def build_character_enrichment_prompt(genre: str, name: str, role: str) -> str:
+    """Builds the prompt that asks for a custom character's description and starting location."""
+    return f"In a {genre.lower()} story for readers ages 8 and up, there is a character named '{name}' who is a {role}. Write one short sentence describing them, and name the place where they are when the story begins. Answer in exactly two lines and nothing else:\nDescription: <one sentence>\nLocation: <a short place name>"
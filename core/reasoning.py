@@ -0,0 +1,42 @@
+import re
+
+# --- Reasoning Traces (Qwen3 thinking) ---
+# Qwen3 models may write a <think>...</think> block before the answer. It is
+# never part of the story: it is stripped before a response is stored,
+# displayed or parsed for locations and options. Thinking is switched off per
+# turn type with Qwen3's "/no_think" soft switch at the end of the user message.
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+NO_THINK_SWITCH = "/no_think"
+
+_THINK_BLOCK = re.compile(r"<think>(.*?)</think>", re.DOTALL)
+
+
+def with_thinking_switch(user_content: str, thinking: bool) -> str:
+    """Appends the no-think soft switch to a user message when thinking is off."""
+    if thinking or not user_content:
+        return user_content
+    return f"{user_content} {NO_THINK_SWITCH}"
+
+
+def strip_reasoning(text: str):
+    """Removes reasoning from a response. Returns (answer, reasoning); reasoning is "" if there was none."""
+    if not text or (THINK_OPEN not in text and THINK_CLOSE not in text):
+        return text, ""
+    reasoning = [match.strip() for match in _THINK_BLOCK.findall(text)]
+    answer = _THINK_BLOCK.sub("", text)
+    if THINK_OPEN in answer:
+        # Unclosed block (e.g. cut off by max_tokens): everything after it is reasoning
+        answer, _, tail = answer.partition(THINK_OPEN)
+        reasoning.append(tail.strip())
+    elif THINK_CLOSE in answer:
+        # The opening tag was part of the prompt template: everything before it is reasoning
+        head, _, answer = answer.rpartition(THINK_CLOSE)
+        reasoning.insert(0, head.strip())
+    return answer.strip(), "\n\n".join(part for part in reasoning if part)
+
+
+def is_thinking(text: str) -> bool:
+    """True while a streamed response is still inside an unclosed reasoning block."""
+    return text.rfind(THINK_OPEN) > text.rfind(THINK_CLOSE)
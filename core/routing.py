@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import deque
+
+from config import MODEL_ROUTES
+
+# --- Model Routing ---
+# Each kind of model call goes through a named route. A route is an ordered
+# list of models: the first is used normally, and the rest are tried in order
+# if a call fails (unknown model, provider error, ...). Story turns stay on the
+# main model, while cheap auxiliary calls (regenerating a missing option
+# block, custom character details) default to a fast tier. Routing decisions
+# and latency are recorded per route and model for the debug panel.
+
+ROUTE_OPENING_SCENE = "opening_scene"
+ROUTE_NARRATIVE_TURN = "narrative_turn"
+ROUTE_POST_TOOL_NARRATION = "post_tool_narration"  # Second call, after the tool results
+ROUTE_OPTION_REGENERATION = "option_regeneration"  # A turn came back without options
+ROUTE_CHARACTER_ENRICHMENT = "character_enrichment"  # Details for custom characters at story start
+
+_LATENCY_WINDOW = 200  # Recent calls kept per route for the latency percentiles
+
+
+def route_models(route: str) -> list:
+    """Models to try for a route, in order (falls back to the narrative-turn route)."""
+    return MODEL_ROUTES.get(route) or MODEL_ROUTES[ROUTE_NARRATIVE_TURN]
+
+
+class RouteStats:
+    """Process-wide routing decisions and latency per route."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def record(self, route: str, model: str, seconds: float, ok: bool, fallback: bool = False):
+        with self._lock:
+            entry = self._routes.setdefault(route, {
+                "calls": 0, "errors": 0, "fallbacks": 0, "models": {}, "latencies": deque(maxlen=_LATENCY_WINDOW)})
+            entry["calls"] += 1
+            entry["models"][model] = entry["models"].get(model, 0) + 1
+            if not ok:
+                entry["errors"] += 1
+                return
+            if fallback:
+                entry["fallbacks"] += 1 # Served by a fallback model after the primary failed
+            entry["latencies"].append(seconds)
+
+    def snapshot(self) -> dict:
+        """Per route: calls, errors, fallbacks, calls per model and latency (avg/p50/p95 seconds)."""
+        with self._lock:
+            snapshot = {}
+            for route, entry in self._routes.items():
+                latencies = sorted(entry["latencies"])
+                snapshot[route] = {
+                    "calls": entry["calls"], "errors": entry["errors"], "fallbacks": entry["fallbacks"],
+                    "models": dict(entry["models"]),
+                    "avg_s": round(sum(latencies) / len(latencies), 3) if latencies else None,
+                    "p50_s": round(latencies[len(latencies) // 2], 3) if latencies else None,
+                    "p95_s": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3) if latencies else None,
+                }
+            return snapshot
+
+
+ROUTE_STATS = RouteStats()
+
+
+def call_with_fallback(route: str, call, no_fallback: tuple = ()):
+    """
+    Runs `call(model)` for each of the route's models until one succeeds, recording every
+    attempt. Exceptions of the `no_fallback` types are re-raised without trying other models.
+    """
+    models = route_models(route)
+    for attempt, model in enumerate(models):
+        started = time.perf_counter()
+        try:
+            result = call(model)
+        except no_fallback:
+            raise
+        except Exception:
+            ROUTE_STATS.record(route, model, time.perf_counter() - started, ok=False)
+            if attempt == len(models) - 1:
+                raise
+            continue
+        ROUTE_STATS.record(route, model, time.perf_counter() - started, ok=True, fallback=attempt > 0)
+        return result
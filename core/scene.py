@@ -0,0 +1,73 @@
+import re
+
+# --- Scene Tracking ---
+# With a large cast, listing every character in every prompt and rendering a
+# card for each one on every rerun grows with the cast, not with the story.
+# The scene is the part of the cast that matters right now: characters
+# mentioned or changed (moved, mood, items) in the last few turns, plus
+# anyone standing where they are. Only the scene goes into the per-turn
+# prompt context, and the status panel shows it first.
+
+SCENE_HEADER = "Characters in the current scene (use these names with the tools):"
+
+
+def _name_pattern(names: list):
+    """One regex matching any cast name, or its first word when that's distinctive enough."""
+    aliases = {}
+    for name in names:
+        aliases[name] = name
+        first = name.split()[0]
+        if len(first) >= 3 and first != name:
+            aliases.setdefault(first, name)
+    if not aliases:
+        return None, aliases
+    # Longest first, so "Captain Rhea" wins over "Captain"
+    alternatives = "|".join(re.escape(alias) for alias in sorted(aliases, key=len, reverse=True))
+    return re.compile(rf"\b({alternatives})\b"), aliases
+
+
+def scene_characters(turn_store, character_status: dict, window: int, max_active: int) -> list:
+    """Names of the characters in the current scene, most recently involved first."""
+    pattern, aliases = _name_pattern(list(character_status))
+    recency = {} # name -> how many turns ago it was last involved
+    for age, turn in enumerate(reversed(turn_store.path()[-window:])):
+        involved = set(turn.status_delta or ())
+        if pattern is not None:
+            user_text, _, response_text, _ = turn.payload()
+            text = f"{user_text or ''}\n{response_text or ''}"
+            involved.update(aliases[match] for match in pattern.findall(text))
+        for name in involved:
+            if name in character_status:
+                recency.setdefault(name, age)
+    cast_order = {name: i for i, name in enumerate(character_status)}
+    active = sorted(recency, key=lambda name: (recency[name], cast_order[name]))
+
+    # Anyone who moved to where an active character is, is in the scene too. Locations nobody
+    # has left since the story began (like the shared starting location) don't count.
+    base = turn_store.base_status
+    shared = {character_status[name].get("location") for name in active
+              if character_status[name].get("location") != base.get(name, {}).get("location")}
+    shared.discard(None)
+    active += [name for name, info in character_status.items()
+               if name not in recency and info.get("location") in shared
+               and info.get("location") != base.get(name, {}).get("location")]
+
+    if not active:
+        active = list(character_status) # Nobody involved yet (e.g. before the opening scene)
+    return active[:max_active]
+
+
+def format_scene_block(active: list, character_status: dict) -> str:
+    """The scene message content: the active characters and what the story knows about them."""
+    lines = [SCENE_HEADER]
+    for name in active:
+        info = character_status[name]
+        details = [info.get("role"), info.get("description"),
+                   f"at {info['location']}" if info.get("location") else None,
+                   f"feeling {info['mood']}" if info.get("mood") else None,
+                   f"carrying {', '.join(info['items'])}" if info.get("items") else None]
+        lines.append(f"- {name}: " + "; ".join(detail for detail in details if detail))
+    others = len(character_status) - len(active)
+    if others > 0:
+        lines.append(f"({others} other characters are elsewhere; bring one in by name when the story needs them.)")
+    return "\n".join(lines)
@@ -0,0 +1,165 @@
+import copy
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+from config import GENRE_OPTIONS, SCENE_POOL_DEPTH, SCENE_POOL_WORKERS, SCENE_POOL_MAX_AGE_SECONDS
+from data import get_character_recommendations
+from .ai_interactions import run_narrative_step
+from .prompts import build_system_prompt, build_initial_scene_prompt
+from .scheduler import PRIORITY_SPECULATIVE
+from .generation_policy import TURN_OPENING
+from .overload import get_overload_controller
+
+# --- Pre-generated Opening Scenes ---
+# Most stories start with a genre's two preset characters, so their opening
+# scenes are generated ahead of time by background workers and kept in a
+# small pool per (genre, cast). Starting such a story takes a ready scene
+# instead of blocking on the model; custom casts are still generated on demand.
+
+POOL_SESSION_ID = "scene-pool"  # Scheduler identity shared by all pool work
+
+
+def make_pool_key(theme: str, character_status: dict) -> tuple:
+    """Pool key for a genre and cast (order-independent)."""
+    cast = tuple(sorted((name, info["role"]) for name, info in character_status.items()))
+    return (theme, cast)
+
+
+def preset_character_status(theme: str) -> dict:
+    """Character status for a genre's default cast (first two recommendations)."""
+    genre_key = theme.lower().replace("-", "_") # Same lookup as the setup view
+    recommendations = get_character_recommendations().get(genre_key, [])
+    return {
+        char["name"]: {"role": char["role"], "location": "Starting Location", "description": char["description"]}
+        for char in recommendations[:2]
+    }
+
+
+class OpeningScene:
+    """A ready-to-use opening scene: model response, history and resulting character status."""
+    __slots__ = ("created_at", "response_text", "narrative_history", "character_status")
+
+    def __init__(self, response_text: str, narrative_history: list, character_status: dict):
+        self.created_at = time.time()
+        self.response_text = response_text
+        self.narrative_history = narrative_history
+        self.character_status = character_status
+
+
+class OpeningScenePool:
+    """Keeps up to `depth` fresh opening scenes per registered (genre, cast) key."""
+
+    def __init__(self, client, depth: int, workers: int, max_age_seconds: float):
+        self.client = client
+        self.depth = depth
+        self.max_age_seconds = max_age_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="scene-pool")
+        self._lock = threading.Lock()
+        self._scenes = {}    # key -> deque of OpeningScene (oldest first)
+        self._pending = {}   # key -> number of generations in flight
+        self._casts = {}     # key -> (theme, character_status) used to generate it
+        self.stats = {"hits": 0, "misses": 0, "generated": 0, "failed": 0, "expired": 0}
+
+    def _is_stale(self, scene: OpeningScene, now: float) -> bool:
+        return now - scene.created_at > self.max_age_seconds
+
+    def _drop_stale(self, key, now: float):
+        scenes = self._scenes.get(key)
+        while scenes and self._is_stale(scenes[0], now):
+            scenes.popleft()
+            self.stats["expired"] += 1
+
+    def warm(self, theme: str, character_status: dict):
+        """Registers a cast with the pool and starts filling it up to the configured depth."""
+        key = make_pool_key(theme, character_status)
+        with self._lock:
+            self._casts[key] = (theme, copy.deepcopy(character_status))
+            self._scenes.setdefault(key, deque())
+        self._refill(key)
+
+    def warm_presets(self):
+        """Warms the default two-character cast of every genre."""
+        for theme in GENRE_OPTIONS:
+            character_status = preset_character_status(theme)
+            if len(character_status) >= 2:
+                self.warm(theme, character_status)
+
+    def take(self, theme: str, character_status: dict):
+        """Returns a fresh pooled scene for this cast, or None if the cast isn't pooled or none is ready."""
+        key = make_pool_key(theme, character_status)
+        with self._lock:
+            if key not in self._casts:
+                return None # Custom cast: generate on demand
+            self._drop_stale(key, time.time())
+            scenes = self._scenes[key]
+            scene = scenes.pop() if scenes else None # Newest first
+            self.stats["hits" if scene else "misses"] += 1
+        self._refill(key)
+        return scene
+
+    def _refill(self, key):
+        """Schedules generations until ready + in-flight scenes reach the pool depth."""
+        if not get_overload_controller().speculative_allowed():
+            return # Speculative work is the first thing dropped under overload
+        with self._lock:
+            self._drop_stale(key, time.time())
+            missing = self.depth - len(self._scenes[key]) - self._pending.get(key, 0)
+            if missing <= 0:
+                return
+            self._pending[key] = self._pending.get(key, 0) + missing
+        for _ in range(missing):
+            self._executor.submit(self._generate, key)
+
+    def _generate(self, key):
+        """Worker: generates one opening scene for a pooled cast."""
+        theme, base_status = self._casts[key]
+        character_status = copy.deepcopy(base_status)
+        history = [{"role": "system", "content": build_system_prompt(theme, character_status)}]
+        step_info = {}
+        try:
+            response_text, updated_history = run_narrative_step(
+                client=self.client,
+                user_input_to_model=build_initial_scene_prompt(list(character_status.keys())),
+                narrative_history=history,
+                session_id=POOL_SESSION_ID,
+                priority=PRIORITY_SPECULATIVE,
+                character_status=character_status,
+                turn_kind=TURN_OPENING,
+                step_info=step_info,
+            )
+            # A failed step reports its error there (the history may already hold tool messages)
+            succeeded = "error" not in step_info
+        except Exception:
+            succeeded = False
+
+        with self._lock:
+            self._pending[key] -= 1
+            if succeeded:
+                self._scenes[key].append(OpeningScene(response_text, updated_history, character_status))
+                self.stats["generated"] += 1
+            else:
+                # No immediate retry; the next take() or warm() refills the slot
+                self.stats["failed"] += 1
+
+    def snapshot(self) -> dict:
+        """Pool sizes and hit/miss counters."""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["ready"] = {f"{theme}: {', '.join(n for n, _ in cast)}": len(scenes)
+                              for (theme, cast), scenes in self._scenes.items()}
+            stats["pending"] = sum(self._pending.values())
+            return stats
+
+
+@st.cache_resource
+def get_opening_scene_pool(_client):
+    """Creates the process-wide opening-scene pool and starts warming the preset casts."""
+    if SCENE_POOL_DEPTH <= 0:
+        return None
+    pool = OpeningScenePool(_client, SCENE_POOL_DEPTH, SCENE_POOL_WORKERS, SCENE_POOL_MAX_AGE_SECONDS)
+    pool.warm_presets()
+    return pool
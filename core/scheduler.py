@@ -0,0 +1,259 @@
+import heapq
+import itertools
+import json
+import threading
+import time
+from config import (RATE_LIMIT_REQUESTS_PER_MIN, RATE_LIMIT_TOKENS_PER_MIN,
+                    SCHEDULER_MAX_QUEUE, SCHEDULER_MAX_WAIT_SECONDS)
+
+# --- Process-wide Rate-Limit Scheduler ---
+# Every Streamlit session shares one Python process, so all model calls go
+# through a single scheduler that keeps us under the provider's
+# requests-per-minute and tokens-per-minute limits. Requests wait in a short
+# priority queue instead of failing: interactive turns are served before
+# speculative or background work, and within a priority level sessions are
+# served fairly (start-time fair queueing on estimated tokens), so one busy
+# session cannot starve the others.
+
+PRIORITY_INTERACTIVE = 0  # A user is waiting on this turn
+PRIORITY_SPECULATIVE = 1  # Work that might be used soon (e.g. pre-generated scenes)
+PRIORITY_BACKGROUND = 2   # Anything else that can wait
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_SPECULATIVE: "speculative",
+    PRIORITY_BACKGROUND: "background",
+}
+
+
+class SchedulerBusyError(RuntimeError):
+    """Raised when a request cannot be admitted (queue full or waited too long)."""
+
+
+def estimate_tokens(messages: list, tools=None) -> int:
+    """Roughly estimates prompt tokens from message and tool sizes (~4 characters per token).
+
+    `tools` may be the tools list or its already-serialized JSON string.
+    """
+    chars = 0
+    for message in messages:
+        chars += len(message.get("content") or "") + 8  # Small per-message overhead
+        if message.get("tool_calls"):
+            chars += len(json.dumps(message["tool_calls"]))
+    if tools:
+        chars += len(tools) if isinstance(tools, str) else len(json.dumps(tools))
+    return chars // 4 + 1
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at `per_minute` units per minute."""
+
+    def __init__(self, per_minute: float, capacity: float = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` units are available (0 if available now)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)  # Oversized requests only need a full bucket
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float, now: float):
+        """Takes `amount` units; the balance may go negative when correcting an estimate."""
+        self._refill(now)
+        self.tokens = min(self.capacity, self.tokens - min(amount, self.capacity))
+
+
+class _Ticket:
+    """One queued request."""
+    __slots__ = ("session_id", "priority", "cost", "enqueued_at", "cancelled")
+
+    def __init__(self, session_id, priority, cost, enqueued_at):
+        self.session_id = session_id
+        self.priority = priority
+        self.cost = cost
+        self.enqueued_at = enqueued_at
+        self.cancelled = False
+
+
+class Admission:
+    """Handle for an admitted request; use `settle` to report the real token usage."""
+
+    def __init__(self, scheduler, estimated_tokens: int):
+        self._scheduler = scheduler
+        self.estimated_tokens = estimated_tokens
+        self.wait_seconds = 0.0
+
+    def settle(self, actual_tokens: int):
+        """Charges (or refunds) the difference between actual and estimated token usage."""
+        if actual_tokens:
+            self._scheduler._adjust_tokens(actual_tokens - self.estimated_tokens)
+
+
+class RateLimitScheduler:
+    """Token-bucket admission control with a fair priority queue in front of model calls."""
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int,
+                 max_queue: int = 64, max_wait_seconds: float = 30.0):
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self._cond = threading.Condition()
+        self._heap = []  # (priority, fair start tag, sequence, ticket)
+        self._sequence = itertools.count()
+        self._virtual_time = 0.0
+        self._session_finish = {}  # session -> virtual finish tag of its last queued request
+        self._queued = 0
+        self._metrics = {
+            "admitted": 0,
+            "rejected_queue_full": 0,
+            "timed_out": 0,
+            "in_flight": 0,
+            "max_queue_depth": 0,
+            "total_wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+        }
+        self._admitted_by_priority = {p: 0 for p in PRIORITY_NAMES}
+
+    # --- Queue management (call with the condition held) ---
+    def _enqueue(self, ticket: _Ticket):
+        start = max(self._virtual_time, self._session_finish.get(ticket.session_id, 0.0))
+        self._session_finish[ticket.session_id] = start + ticket.cost
+        heapq.heappush(self._heap, (ticket.priority, start, next(self._sequence), ticket))
+        self._queued += 1
+        self._metrics["max_queue_depth"] = max(self._metrics["max_queue_depth"], self._queued)
+
+    def _head(self):
+        # Drop tickets abandoned by callers that timed out
+        while self._heap and self._heap[0][3].cancelled:
+            heapq.heappop(self._heap)
+        return self._heap[0] if self._heap else None
+
+    def _dispatch(self, now: float):
+        _, start, _, ticket = heapq.heappop(self._heap)
+        self._queued -= 1
+        self._virtual_time = max(self._virtual_time, start)
+        # Forget sessions whose last request has already been overtaken by virtual time
+        if len(self._session_finish) > 4 * (self._queued + 1) + 64:
+            self._session_finish = {s: f for s, f in self._session_finish.items() if f > self._virtual_time}
+        self.request_bucket.consume(1, now)
+        self.token_bucket.consume(ticket.cost, now)
+
+    def _adjust_tokens(self, delta: int):
+        with self._cond:
+            self.token_bucket.consume(delta, time.monotonic())
+            self._cond.notify_all()
+
+    # --- Public API ---
+    def admit(self, session_id: str, estimated_tokens: int, priority: int = PRIORITY_INTERACTIVE,
+              timeout: float = None):
+        """Context manager that blocks until the request may be sent to the provider."""
+        return _AdmissionContext(self, session_id, estimated_tokens, priority, timeout)
+
+    def _acquire(self, session_id, estimated_tokens, priority, timeout) -> Admission:
+        timeout = self.max_wait_seconds if timeout is None else timeout
+        now = time.monotonic()
+        deadline = now + timeout
+        ticket = _Ticket(session_id or "anonymous", priority, max(1, int(estimated_tokens)), now)
+        with self._cond:
+            if self._queued >= self.max_queue:
+                self._metrics["rejected_queue_full"] += 1
+                raise SchedulerBusyError("Too many requests are waiting for the model right now.")
+            self._enqueue(ticket)
+            while True:
+                now = time.monotonic()
+                head = self._head()
+                wait = None
+                if head is not None and head[3] is ticket:
+                    wait = max(self.request_bucket.wait_time(1, now),
+                               self.token_bucket.wait_time(ticket.cost, now))
+                    if wait == 0:
+                        self._dispatch(now)
+                        waited = now - ticket.enqueued_at
+                        self._metrics["admitted"] += 1
+                        self._metrics["in_flight"] += 1
+                        self._metrics["total_wait_seconds"] += waited
+                        self._metrics["max_wait_seconds"] = max(self._metrics["max_wait_seconds"], waited)
+                        self._admitted_by_priority[priority] += 1
+                        # The next ticket may be admissible too
+                        self._cond.notify_all()
+                        admission = Admission(self, ticket.cost)
+                        admission.wait_seconds = waited
+                        return admission
+                remaining = deadline - now
+                if remaining <= 0:
+                    ticket.cancelled = True
+                    self._queued -= 1
+                    self._metrics["timed_out"] += 1
+                    self._cond.notify_all()
+                    raise SchedulerBusyError("Timed out waiting for model capacity.")
+                self._cond.wait(remaining if wait is None else min(wait, remaining))
+
+    def _release(self):
+        with self._cond:
+            self._metrics["in_flight"] -= 1
+            self._cond.notify_all()
+
+    def load(self):
+        """Returns (queued requests, requests in flight) without building a full snapshot."""
+        with self._cond:
+            return self._queued, self._metrics["in_flight"]
+
+    def snapshot(self) -> dict:
+        """Returns current queue-depth and admission metrics."""
+        with self._cond:
+            now = time.monotonic()
+            depth_by_priority = {name: 0 for name in PRIORITY_NAMES.values()}
+            for _, _, _, ticket in self._heap:
+                if not ticket.cancelled:
+                    depth_by_priority[PRIORITY_NAMES.get(ticket.priority, str(ticket.priority))] += 1
+            metrics = dict(self._metrics)
+            admitted = metrics["admitted"]
+            metrics["avg_wait_seconds"] = metrics["total_wait_seconds"] / admitted if admitted else 0.0
+            metrics["queue_depth"] = self._queued
+            metrics["queue_depth_by_priority"] = depth_by_priority
+            metrics["admitted_by_priority"] = {PRIORITY_NAMES[p]: n for p, n in self._admitted_by_priority.items()}
+            self.request_bucket._refill(now)
+            self.token_bucket._refill(now)
+            metrics["requests_available"] = self.request_bucket.tokens
+            metrics["tokens_available"] = self.token_bucket.tokens
+            return metrics
+
+
+class _AdmissionContext:
+    def __init__(self, scheduler, session_id, estimated_tokens, priority, timeout):
+        self._scheduler = scheduler
+        self._args = (session_id, estimated_tokens, priority, timeout)
+
+    def __enter__(self) -> Admission:
+        return self._scheduler._acquire(*self._args)
+
+    def __exit__(self, exc_type, exc, tb):
+        self._scheduler._release()
+        return False
+
+
+# --- Shared instance ---
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> RateLimitScheduler:
+    """Returns the process-wide scheduler, creating it from config on first use."""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = RateLimitScheduler(
+                    RATE_LIMIT_REQUESTS_PER_MIN, RATE_LIMIT_TOKENS_PER_MIN,
+                    max_queue=SCHEDULER_MAX_QUEUE, max_wait_seconds=SCHEDULER_MAX_WAIT_SECONDS)
+    return _scheduler
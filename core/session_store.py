@@ -0,0 +1,215 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+
+import streamlit as st
+
+from config import SESSION_STORE_URL
+from .turn_store import TurnStore
+
+# --- Shared Session Store ---
+# Story state normally lives only in this process's st.session_state, so a
+# replica restart loses it and a load balancer has to keep each user on the
+# same replica. With a session store configured, the story (turn tree,
+# character status, theme) is saved under the session id from the URL (?sid=)
+# and any replica can load it. Saves use optimistic concurrency: every write
+# states the version it was based on and fails if another replica wrote in
+# between.
+#
+# Storage goes through a small key-value interface (get / compare_and_set /
+# delete on versioned blobs). SQLiteKeyValueBackend implements it for a single
+# host or a shared volume. A networked KV (Redis, etcd, ...) only needs the
+# same three methods and can be registered for its URL scheme.
+
+class SessionConflictError(RuntimeError):
+    """Raised when a session was saved by someone else since it was loaded."""
+
+
+class KeyValueBackend(ABC):
+    """Versioned blob storage. Version 0 means "doesn't exist yet"."""
+
+    @abstractmethod
+    def get(self, key: str):
+        """Returns (version, value bytes), or None if the key doesn't exist."""
+
+    def version(self, key: str) -> int:
+        """Current version of a key (0 if missing). Backends may override with a cheaper lookup."""
+        entry = self.get(key)
+        return entry[0] if entry else 0
+
+    @abstractmethod
+    def compare_and_set(self, key: str, expected_version: int, value: bytes) -> bool:
+        """Writes `value` as version expected_version + 1 if the key is still at `expected_version`."""
+
+    @abstractmethod
+    def delete(self, key: str):
+        """Removes a key (no-op if it doesn't exist)."""
+
+
+class SQLiteKeyValueBackend(KeyValueBackend):
+    """KeyValueBackend on a SQLite file (WAL mode, one connection per thread)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        with self._connection() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""CREATE TABLE IF NOT EXISTS sessions (
+                              key TEXT PRIMARY KEY, version INTEGER NOT NULL,
+                              value BLOB NOT NULL, updated_at REAL NOT NULL)""")
+
+    def _connection(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            # Writers wait for each other's locks instead of failing right away
+            db = sqlite3.connect(self.path, timeout=10.0)
+            db.execute("PRAGMA busy_timeout=10000")
+            self._local.db = db
+        return db
+
+    def get(self, key: str):
+        row = self._connection().execute("SELECT version, value FROM sessions WHERE key = ?", (key,)).fetchone()
+        return (row[0], bytes(row[1])) if row else None
+
+    def version(self, key: str) -> int:
+        row = self._connection().execute("SELECT version FROM sessions WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def compare_and_set(self, key: str, expected_version: int, value: bytes) -> bool:
+        with self._connection() as db: # One transaction; commits on success
+            if expected_version == 0:
+                cursor = db.execute(
+                    "INSERT OR IGNORE INTO sessions (key, version, value, updated_at) VALUES (?, 1, ?, ?)",
+                    (key, value, time.time()))
+            else:
+                cursor = db.execute(
+                    "UPDATE sessions SET version = version + 1, value = ?, updated_at = ? WHERE key = ? AND version = ?",
+                    (value, time.time(), key, expected_version))
+            return cursor.rowcount == 1
+
+    def delete(self, key: str):
+        with self._connection() as db:
+            db.execute("DELETE FROM sessions WHERE key = ?", (key,))
+
+
+class SessionStore:
+    """Saves and loads story state dicts (JSON, zlib-compressed) on a KeyValueBackend."""
+
+    def __init__(self, backend: KeyValueBackend, prefix: str = "session:"):
+        self.backend = backend
+        self.prefix = prefix
+
+    def load(self, session_id: str):
+        """Returns (version, state dict), or None for an unknown session."""
+        entry = self.backend.get(self.prefix + session_id)
+        if entry is None:
+            return None
+        version, value = entry
+        return version, json.loads(zlib.decompress(value))
+
+    def version(self, session_id: str) -> int:
+        return self.backend.version(self.prefix + session_id)
+
+    def save(self, session_id: str, state: dict, expected_version: int) -> int:
+        """Saves a new version of the session; raises SessionConflictError if it changed meanwhile."""
+        value = zlib.compress(json.dumps(state, separators=(",", ":")).encode("utf-8"))
+        if not self.backend.compare_and_set(self.prefix + session_id, expected_version, value):
+            raise SessionConflictError(f"Session {session_id} changed since version {expected_version}")
+        return expected_version + 1
+
+    def delete(self, session_id: str):
+        self.backend.delete(self.prefix + session_id)
+
+
+# URL scheme -> factory(rest of the URL) for session store backends
+BACKENDS = {
+    "sqlite": SQLiteKeyValueBackend,
+}
+
+
+def register_backend(scheme: str, factory):
+    """Makes a KeyValueBackend available as `<scheme>://...` in STORYLAB_SESSION_STORE."""
+    BACKENDS[scheme] = factory
+
+
+@st.cache_resource
+def get_session_store():
+    """The process-wide session store, or None when sessions are kept in memory only."""
+    if not SESSION_STORE_URL:
+        return None
+    scheme, _, location = SESSION_STORE_URL.partition("://")
+    if scheme not in BACKENDS:
+        st.error(f"Unknown session store '{scheme}'. Available: {', '.join(BACKENDS)}.")
+        return None
+    return SessionStore(BACKENDS[scheme](location))
+
+
+# --- Streamlit session sync ---
+# Only the story itself is shared; setup screen choices, pending job ids and
+# debug data stay local to the process.
+
+def session_state_snapshot() -> dict:
+    """The shareable part of this session's state."""
+    state = st.session_state
+    return {
+        "story_started": state.get("story_started", False),
+        "theme": state.get("theme"),
+        "character_status": state.get("character_status"),
+        "turn_store": state["turn_store"].to_state() if "turn_store" in state else None,
+    }
+
+
+def restore_session_state(version: int, shared: dict):
+    """Replaces this session's story with a stored one."""
+    state = st.session_state
+    state.story_started = shared["story_started"]
+    for key in ("theme", "character_status"):
+        if shared[key] is not None:
+            state[key] = shared[key]
+    if shared["turn_store"] is not None:
+        state.turn_store = TurnStore.from_state(shared["turn_store"])
+    state.session_store_version = version
+    state.session_store_fingerprint = _fingerprint()
+
+
+def _fingerprint() -> int:
+    """Cheap change detector for the shared state (turn count, head and character status)."""
+    state = st.session_state
+    turn_store = state.get("turn_store")
+    return hash((state.get("story_started", False), state.get("theme"),
+                 json.dumps(state.get("character_status"), sort_keys=True),
+                 (len(turn_store.nodes), turn_store.head.node_id if turn_store.head else None) if turn_store else None))
+
+
+def sync_from_store(store: SessionStore, session_id: str):
+    """Loads the stored story if it is newer than ours (new replica, restart, other tab)."""
+    ours = st.session_state.get("session_store_version", 0)
+    if store.version(session_id) <= ours:
+        return
+    loaded = store.load(session_id)
+    if loaded is not None:
+        restore_session_state(*loaded)
+
+
+def sync_to_store(store: SessionStore, session_id: str):
+    """Saves the story if it changed during this rerun. On a conflict, the stored version wins."""
+    fingerprint = _fingerprint()
+    if fingerprint == st.session_state.get("session_store_fingerprint"):
+        return
+    try:
+        st.session_state.session_store_version = store.save(
+            session_id, session_state_snapshot(), st.session_state.get("session_store_version", 0))
+        st.session_state.session_store_fingerprint = fingerprint
+    except SessionConflictError:
+        loaded = store.load(session_id)
+        if loaded is not None:
+            restore_session_state(*loaded)
+        st.session_state.turn_notice = "This story was continued in another window, so it now shows the latest version."
+        st.rerun()
@@ -0,0 +1,115 @@
+import json
+import threading
+
+from config import OPTIONS_SEPARATOR
+
+# --- Structured (JSON) Turn Output ---
+# In structured mode the model is constrained by a JSON schema to return
+# {"narrative", "options": [{"emoji", "text"}], "world_events"} instead of
+# free text with an options block. The parsed turn is rendered back into the
+# canonical "narrative / separator / numbered options" text before it is
+# stored, so the history, display and export code stay unchanged. If a
+# response isn't valid JSON of that shape, the regular text parsing path
+# (parse_options) is used as a fallback.
+
+STORY_TURN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "narrative": {"type": "string"},
+        "options": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "emoji": {"type": "string"},
+                    "text": {"type": "string"},
+                },
+                "required": ["emoji", "text"],
+                "additionalProperties": False,
+            },
+        },
+        "world_events": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "character_name": {"type": "string"},
+                    "event": {"type": "string"},
+                    "location": {"type": "string"},
+                },
+                "required": ["character_name", "event", "location"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["narrative", "options", "world_events"],
+    "additionalProperties": False,
+}
+
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "story_turn", "strict": True, "schema": STORY_TURN_SCHEMA},
+}
+
+STRUCTURED_PROMPT = """
+Reply with a single JSON object: put the story text in "narrative", the 3 options in "options" (each with a single "emoji" and its "text"), and list any character that ended up somewhere new in "world_events" (character_name, a short event, and the new location, or an empty location if they didn't move)."""
+
+_stats_lock = threading.Lock()
+STRUCTURED_STATS = {"parsed": 0, "fallback": 0}
+
+
+def _record(outcome: str):
+    with _stats_lock:
+        STRUCTURED_STATS[outcome] += 1
+
+
+def parse_structured_turn(text: str):
+    """Validates a JSON turn. Returns (narrative, options, world_events) or None if it isn't one."""
+    if not text:
+        return None
+    start = text.find("{")
+    end = text.rfind("}")
+    if start == -1 or end < start:
+        return None
+    try:
+        data = json.loads(text[start:end + 1])
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    narrative = data.get("narrative")
+    raw_options = data.get("options")
+    if not isinstance(narrative, str) or not narrative.strip() or not isinstance(raw_options, list):
+        return None
+    options = []
+    for option in raw_options:
+        if not isinstance(option, dict) or not isinstance(option.get("text"), str) or not option["text"].strip():
+            return None
+        emoji = option.get("emoji") if isinstance(option.get("emoji"), str) else ""
+        options.append(f"{emoji.strip()} {option['text'].strip()}".strip())
+    if not options:
+        return None
+
+    world_events = [
+        event for event in data.get("world_events") or []
+        if isinstance(event, dict) and isinstance(event.get("character_name"), str)
+    ]
+    return narrative.strip(), options, world_events
+
+
+def render_turn_text(narrative: str, options: list) -> str:
+    """Canonical text form of a turn, as the text path expects it."""
+    option_lines = "\n".join(f"{i}. {option}" for i, option in enumerate(options, start=1))
+    return f"{narrative}\n\n{OPTIONS_SEPARATOR}\n{option_lines}"
+
+
+def normalize_response(text: str):
+    """Converts a JSON turn to canonical text. Returns (text, world_events); non-JSON text passes through."""
+    parsed = parse_structured_turn(text)
+    if parsed is None:
+        _record("fallback")
+        return text, []
+    _record("parsed")
+    narrative, options, world_events = parsed
+    return render_turn_text(narrative, options), world_events
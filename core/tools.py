@@ -0,0 +1,185 @@
+import inspect
+import json
+from collections import namedtuple
+
+# --- Tool Registry ---
+# World tools are plain functions registered with a decorator. The registry
+# builds each tool's JSON schema once, keeps the tools payload (and its
+# serialized form) cached for every request, and validates model-supplied
+# arguments with a validator compiled at registration time. A bad call
+# becomes a tool error message the model can react to, instead of an
+# exception that aborts the turn.
+
+ToolResult = namedtuple("ToolResult", ["name", "arguments", "content", "ok"])
+
+_JSON_TYPES = {str: "string", int: "integer", float: "number", bool: "boolean"}
+_PYTHON_TYPES = {"string": (str,), "integer": (int,), "number": (int, float), "boolean": (bool,)}
+
+
+class ToolArgumentError(ValueError):
+    """Raised when a tool call's arguments don't match the tool's schema."""
+
+
+def _compile_validator(name: str, parameters: dict):
+    """Builds a fast argument checker for a tool's parameter schema."""
+    properties = parameters.get("properties", {})
+    required = tuple(parameters.get("required", ()))
+    checks = tuple(
+        (prop, _PYTHON_TYPES[spec.get("type", "string")], spec.get("type", "string"))
+        for prop, spec in properties.items()
+    )
+    allowed = frozenset(properties)
+
+    def validate(arguments):
+        if not isinstance(arguments, dict):
+            raise ToolArgumentError(f"{name} expects a JSON object of arguments.")
+        missing = [prop for prop in required if arguments.get(prop) in (None, "")]
+        if missing:
+            raise ToolArgumentError(f"{name} is missing required argument(s): {', '.join(missing)}.")
+        unknown = [prop for prop in arguments if prop not in allowed]
+        if unknown:
+            raise ToolArgumentError(f"{name} got unexpected argument(s): {', '.join(unknown)}.")
+        for prop, python_types, json_type in checks:
+            value = arguments.get(prop)
+            # bool is an int subclass; don't let True pass as a number
+            if value is not None and (not isinstance(value, python_types) or
+                                      (isinstance(value, bool) and json_type != "boolean")):
+                raise ToolArgumentError(f"{name}.{prop} must be a {json_type}.")
+        return arguments
+
+    return validate
+
+
+class ToolRegistry:
+    """Registered world tools with cached schemas and compiled argument validators."""
+
+    def __init__(self):
+        self._handlers = {}
+        self._validators = {}
+        self._definitions = []
+        self._schema_json = None
+
+    def tool(self, description: str, parameters: dict, name: str = None):
+        """Decorator registering a tool; `parameters` maps each argument name to its description.
+
+        JSON types come from the function's annotations (str by default) and
+        arguments without a default value are required.
+        """
+        def decorator(func):
+            self.register(func, description, parameters, name=name)
+            return func
+        return decorator
+
+    def register(self, func, description: str, parameters: dict, name: str = None):
+        """Registers a function as a tool (see `tool`)."""
+        name = name or func.__name__
+        signature = inspect.signature(func)
+        properties = {}
+        required = []
+        for arg_name, arg_description in parameters.items():
+            param = signature.parameters[arg_name]
+            annotation = param.annotation if param.annotation is not inspect.Parameter.empty else str
+            properties[arg_name] = {"type": _JSON_TYPES.get(annotation, "string"), "description": arg_description}
+            if param.default is inspect.Parameter.empty:
+                required.append(arg_name)
+        schema = {"type": "object", "properties": properties, "required": required}
+
+        self._handlers[name] = func
+        self._validators[name] = _compile_validator(name, schema)
+        self._definitions.append({
+            "type": "function",
+            "function": {"name": name, "description": description, "parameters": schema},
+        })
+        self._schema_json = None # Re-serialized lazily, once
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._handlers
+
+    @property
+    def names(self) -> list:
+        return list(self._handlers)
+
+    def definitions(self) -> list:
+        """The `tools` payload for the API (the same cached list on every call)."""
+        return self._definitions
+
+    def schema_json(self) -> str:
+        """Serialized tools payload, computed once (used for size/token estimates)."""
+        if self._schema_json is None:
+            self._schema_json = json.dumps(self._definitions)
+        return self._schema_json
+
+    def parse_arguments(self, name: str, raw_arguments) -> dict:
+        """Decodes and validates a tool call's arguments."""
+        if name not in self._handlers:
+            raise ToolArgumentError(f"Unknown tool: {name}. Available tools: {', '.join(self._handlers)}.")
+        if isinstance(raw_arguments, str):
+            try:
+                arguments = json.loads(raw_arguments or "{}")
+            except json.JSONDecodeError as e:
+                raise ToolArgumentError(f"{name} arguments are not valid JSON: {e.msg}.")
+        else:
+            arguments = raw_arguments
+        return self._validators[name](arguments)
+
+    def call(self, name: str, raw_arguments) -> ToolResult:
+        """Validates and runs a tool call; failures become an error result instead of raising."""
+        try:
+            arguments = self.parse_arguments(name, raw_arguments)
+        except ToolArgumentError as e:
+            return ToolResult(name, None, f"TOOL ERROR: {e} No action was taken.", False)
+        try:
+            return ToolResult(name, arguments, self._handlers[name](**arguments), True)
+        except Exception as e:
+            return ToolResult(name, arguments, f"TOOL ERROR: {name} failed: {e}. No action was taken.", False)
+
+
+# --- World Tools ---
+# These are simulation actions, not real-world actions. Their effect on the
+# character status cards is applied by helpers.update_character_status.
+TOOL_REGISTRY = ToolRegistry()
+
+
+@TOOL_REGISTRY.tool(
+    description="Move a character to a specified location in the narrative world.",
+    parameters={
+        "character_name": "The name of the character to move.",
+        "location": "The destination location.",
+    },
+)
+def move_character(character_name: str, location: str) -> str:
+    return f"SIMULATION ACTION: {character_name} is moving to {location}."
+
+
+@TOOL_REGISTRY.tool(
+    description="Have one character speak a message to another character.",
+    parameters={
+        "speaking_character": "The name of the character who is speaking.",
+        "target_character": "The name of the character being spoken to.",
+        "message": "The message to be delivered.",
+    },
+)
+def speak_to_character(speaking_character: str, target_character: str, message: str) -> str:
+    return f"SIMULATION ACTION: {speaking_character} says to {target_character}: '{message}'"
+
+
+@TOOL_REGISTRY.tool(
+    description="Have a character pick up an item and carry it with them.",
+    parameters={
+        "character_name": "The name of the character picking up the item.",
+        "item": "The item being picked up.",
+    },
+)
+def pick_up_item(character_name: str, item: str) -> str:
+    return f"SIMULATION ACTION: {character_name} picks up {item}."
+
+
+@TOOL_REGISTRY.tool(
+    description="Change how a character is feeling.",
+    parameters={
+        "character_name": "The name of the character whose mood changes.",
+        "mood": "The character's new mood (e.g. 'happy', 'worried').",
+    },
+)
+def change_mood(character_name: str, mood: str) -> str:
+    return f"SIMULATION ACTION: {character_name} now feels {mood}."
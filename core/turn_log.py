@@ -0,0 +1,33 @@
+import gzip
+import json
+import os
+import threading
+import time
+
+from config import TURN_LOG_PATH
+
+# --- Turn Log ---
+# One JSON line per completed turn: session, genre, turn type, tokens, model
+# calls, tool calls, how the options block parsed, and latency. The log is
+# appended by every session in the process and read back in bulk by
+# `python -m core.analytics`. A path ending in .gz is written gzip-compressed;
+# each turn is its own gzip member, so concurrent appends and a crash
+# mid-write never corrupt earlier lines.
+
+_lock = threading.Lock()
+
+
+def log_turn(session_id: str, genre: str, turn_number: int, metrics: dict):
+    """Appends one turn record to the turn log (no-op when logging is off)."""
+    if not TURN_LOG_PATH:
+        return
+    record = {"ts": round(time.time(), 3), "session_id": session_id, "genre": genre, "turn": turn_number, **metrics}
+    line = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+    if TURN_LOG_PATH.endswith(".gz"):
+        line = gzip.compress(line)
+    with _lock:
+        directory = os.path.dirname(TURN_LOG_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(TURN_LOG_PATH, "ab") as f:
+            f.write(line)
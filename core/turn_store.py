@@ -0,0 +1,430 @@
+import base64
+import copy
+import json
+import os
+import re
+import sys
+import weakref
+import zlib
+
+from config import OPTIONS_SEPARATOR
+from .memory import BM25Index, format_memory_block
+
+# --- Compact Turn Store ---
+# One record per turn instead of keeping every turn twice (the model-facing
+# `narrative_history` and the display-facing `chat_messages`). Both lists are
+# derived on demand as views. Short repeated strings (roles, tool names,
+# options that later become the user's choice) are interned, the final
+# assistant text is stored once, and turns older than `compress_after` are
+# packed with zlib. The transcript is cached per head, so a packed turn is
+# unpacked when the story moves (or when it's recalled), not on every rerun.
+# The packed records are what the session store and idle spills save.
+#
+# Turns form a tree: each turn points at its parent, and the current story is
+# the path from the opening turn to `head`. Rewinding just moves `head`, and
+# choosing a different option there adds a sibling branch, so branches share
+# their common prefix instead of copying it and the model is never called
+# again for it. Character status is stored as a per-turn delta on top of the
+# cast's starting status.
+#
+# Long stories send only the last `max_turns` turns to the model; older turns
+# on the current branch are recalled from a BM25 index (core/memory.py).
+
+_ROLE_ASSISTANT = sys.intern("assistant")
+_ROLE_USER = sys.intern("user")
+_ROLE_TOOL = sys.intern("tool")
+_ROLE_SYSTEM = sys.intern("system")
+
+# Compact message kinds stored per turn
+_KIND_TEXT = 0        # (kind, content); content None means "same as the turn's response text"
+_KIND_TOOL_CALLS = 1  # (kind, content, ((id, type, name, arguments), ...))
+_KIND_TOOL = 2        # (kind, tool_call_id, name, content)
+
+# All live stores, for the process-wide memory report
+_live_stores = weakref.WeakSet()
+
+
+def _intern(text):
+    return sys.intern(text) if isinstance(text, str) else text
+
+
+def _intern_packed(packed) -> tuple:
+    """A compact message (lists from JSON are fine) as a tuple, with its short repeated strings interned."""
+    kind = packed[0]
+    if kind == _KIND_TOOL:
+        return (kind, packed[1], _intern(packed[2]), packed[3])
+    if kind == _KIND_TOOL_CALLS:
+        calls = tuple((tc_id, _intern(tc_type), _intern(name), arguments)
+                      for tc_id, tc_type, name, arguments in packed[2])
+        return (kind, packed[1], calls)
+    return tuple(packed)
+
+
+def _pack_message(message: dict, response_text: str) -> tuple:
+    """Converts an API message dict into a compact tuple."""
+    if message.get("role") == "tool":
+        return (_KIND_TOOL, message["tool_call_id"], _intern(message.get("name")), message["content"])
+    if message.get("tool_calls"):
+        calls = tuple(
+            (tc["id"], _intern(tc["type"]), _intern(tc["function"]["name"]), tc["function"]["arguments"])
+            for tc in message["tool_calls"])
+        return (_KIND_TOOL_CALLS, message.get("content"), calls)
+    content = message.get("content")
+    return (_KIND_TEXT, None if content == response_text else content)
+
+
+def _unpack_message(packed: tuple, response_text: str) -> dict:
+    """Expands a compact tuple back into an API message dict."""
+    kind = packed[0]
+    if kind == _KIND_TOOL:
+        return {"tool_call_id": packed[1], "role": _ROLE_TOOL, "name": packed[2], "content": packed[3]}
+    if kind == _KIND_TOOL_CALLS:
+        return {
+            "role": _ROLE_ASSISTANT,
+            "content": packed[1],
+            "tool_calls": [
+                {"id": tc_id, "type": tc_type, "function": {"name": name, "arguments": arguments}}
+                for tc_id, tc_type, name, arguments in packed[2]
+            ],
+        }
+    return {"role": _ROLE_ASSISTANT, "content": response_text if packed[1] is None else packed[1]}
+
+
+def narrative_from_response(response_text: str) -> str:
+    """The narrative part of a response (everything before the options separator)."""
+    if OPTIONS_SEPARATOR in response_text:
+        return response_text.split(OPTIONS_SEPARATOR, 1)[0].strip()
+    return response_text
+
+
+def _status_delta(before: dict, after: dict) -> dict:
+    """Fields that changed per character between two status snapshots."""
+    delta = {}
+    for name, info in after.items():
+        old_info = before.get(name, {})
+        changed = {field: copy.deepcopy(value) for field, value in info.items() if old_info.get(field) != value}
+        if changed:
+            delta[name] = changed
+    return delta
+
+
+def user_display_text(user_text: str, is_option: bool) -> str:
+    """How a user's input appears in the transcript."""
+    if not is_option:
+        return user_text
+    # Remove any leading emoji and whitespace for cleaner history display
+    display_text = re.sub(r'^\s*[^\w\s]+\s*', '', user_text).strip()
+    return f"I choose: {display_text}"
+
+
+def _memory_passage(user_text, is_option: bool, response_text: str, max_chars: int = 0) -> str:
+    """What a turn contributes to the story memory: the user's input and the narrative."""
+    narrative = " ".join(narrative_from_response(response_text or "").split())
+    if user_text is not None:
+        narrative = f"{user_display_text(user_text, is_option)} - {narrative}"
+    if max_chars and len(narrative) > max_chars:
+        narrative = narrative[:max_chars].rsplit(" ", 1)[0] + "..."
+    return narrative
+
+
+class Turn:
+    """One story turn: the user's input (if any), the model messages it produced and the parsed options."""
+    __slots__ = ("node_id", "parent", "number", "is_option", "user_text", "messages",
+                 "response_text", "options", "status_delta", "packed")
+
+    def __init__(self, node_id: int, parent, user_text, is_option: bool, messages: tuple,
+                 response_text: str, options: tuple, status_delta: dict):
+        self.node_id = node_id
+        self.parent = parent # Previous turn on this branch (None for the opening scene)
+        self.number = 0 if parent is None else parent.number + 1
+        self.is_option = is_option
+        self.user_text = user_text
+        self.messages = messages
+        self.response_text = response_text
+        self.options = options
+        self.status_delta = status_delta or None
+        self.packed = None # zlib-compressed payload once the turn is old
+
+    def compress(self):
+        """Packs the turn's text payload; it's expanded again on read."""
+        if self.packed is not None:
+            return
+        payload = [self.user_text, self.messages, self.response_text, self.options]
+        self.packed = zlib.compress(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+        self.user_text = self.messages = self.response_text = self.options = None
+
+    def payload(self) -> tuple:
+        """(user_text, messages, response_text, options), decompressing if needed."""
+        if self.packed is None:
+            return self.user_text, self.messages, self.response_text, self.options
+        # Lists come back where tuples went in; the views only index and iterate them
+        return tuple(json.loads(zlib.decompress(self.packed)))
+
+
+class TurnStore:
+    """Per-session story tree with derived API and display views for the current branch."""
+
+    def __init__(self, system_prompt: str, character_status: dict, compress_after: int = 0):
+        self.system_prompt = system_prompt
+        self.compress_after = compress_after # Keep this many recent turns uncompressed (0 = never compress)
+        self.base_status = copy.deepcopy(character_status) # Cast status before the opening scene
+        self.nodes = [] # Every turn of every branch, indexed by node_id
+        self.head = None # Latest turn of the current branch
+        self._head_status = copy.deepcopy(character_status) # Materialized status at head
+        self.memory = BM25Index() # Every turn, for recall once it leaves the prompt window
+        self.spill_path = None # Set while the turns are spilled to disk (core/idle_sessions.py)
+        self._spill_cleanup = None
+        self._display_cache = None # (head node_id, transcript), so reruns don't unpack old turns
+        _live_stores.add(self)
+
+    # --- Writing ---
+    def add_turn(self, new_messages: list, response_text: str, options: list,
+                 user_text: str = None, is_option: bool = False, character_status: dict = None) -> Turn:
+        """Records a completed turn (as a child of head) from the messages run_narrative_step appended."""
+        options = tuple(_intern(option) for option in options)
+        if is_option and user_text is not None:
+            user_text = _intern(user_text) # Shares the object with the previous turn's option
+        messages = tuple(_pack_message(message, response_text) for message in new_messages)
+        delta = None
+        if character_status is not None:
+            delta = _status_delta(self._head_status, character_status)
+            self._head_status = copy.deepcopy(character_status)
+
+        turn = Turn(len(self.nodes), self.head, user_text, is_option, messages, response_text, options, delta)
+        self.nodes.append(turn)
+        self.head = turn
+        self.memory.add(turn.node_id, _memory_passage(user_text, is_option, response_text))
+
+        if self.compress_after > 0:
+            # Compress the ancestor that just fell out of the uncompressed window
+            ancestor = turn
+            for _ in range(self.compress_after):
+                ancestor = ancestor.parent if ancestor else None
+            if ancestor is not None:
+                ancestor.compress()
+        return turn
+
+    def rewind(self, node_id: int) -> dict:
+        """Makes an earlier turn (on any branch) the head; returns the character status at that turn."""
+        self.head = self.nodes[node_id]
+        self._head_status = self.status_at(self.head)
+        return copy.deepcopy(self._head_status)
+
+    # --- Views ---
+    def path(self, turn: Turn = None) -> list:
+        """Turns from the opening scene to `turn` (head by default)."""
+        turns = []
+        turn = self.head if turn is None else turn
+        while turn is not None:
+            turns.append(turn)
+            turn = turn.parent
+        turns.reverse()
+        return turns
+
+    def status_at(self, turn: Turn) -> dict:
+        """Character status after `turn`, rebuilt from the starting status and per-turn deltas."""
+        status = copy.deepcopy(self.base_status)
+        for node in self.path(turn):
+            for name, changed in (node.status_delta or {}).items():
+                status.setdefault(name, {}).update(copy.deepcopy(changed))
+        return status
+
+    def branch_tips(self) -> list:
+        """Latest turn of every branch other than the current one."""
+        has_children = {turn.parent.node_id for turn in self.nodes if turn.parent is not None}
+        on_path = {turn.node_id for turn in self.path()}
+        return [turn for turn in self.nodes if turn.node_id not in has_children and turn.node_id not in on_path]
+
+    @property
+    def turn_count(self) -> int:
+        """Number of completed model turns after the opening scene on the current branch."""
+        return self.head.number if self.head else 0
+
+    @property
+    def current_options(self) -> list:
+        """Options offered by the latest turn."""
+        if self.head is None:
+            return []
+        return list(self.head.payload()[3])
+
+    def api_messages(self, max_turns: int = 0, memory_query: str = None, memory_k: int = 3,
+                     memory_chars: int = 400, scene_note: str = None) -> list:
+        """
+        The message list sent to the model (same shape as the old narrative_history).
+        With `max_turns` only the latest turns are included; given a `memory_query`, the
+        best-matching older turns are added as a memory block after the system prompt.
+        A `scene_note` (core/scene.py) is added right after the system prompt.
+        """
+        messages = [{"role": _ROLE_SYSTEM, "content": self.system_prompt}]
+        if scene_note:
+            messages.append({"role": _ROLE_SYSTEM, "content": scene_note})
+        turns = self.path()
+        if max_turns > 0 and len(turns) > max_turns:
+            older, turns = turns[:-max_turns], turns[-max_turns:]
+            passages = self.recall(memory_query, older, memory_k, memory_chars) if memory_query else []
+            if passages:
+                messages.append({"role": _ROLE_SYSTEM, "content": format_memory_block(passages)})
+        for turn in turns:
+            _, packed_messages, response_text, _ = turn.payload()
+            messages.extend(_unpack_message(packed, response_text) for packed in packed_messages)
+        return messages
+
+    def recall(self, query: str, turns: list, k: int, max_chars: int = 0) -> list:
+        """Memory passages for the `k` turns (out of `turns`) most relevant to the query, in story order."""
+        allowed = {turn.node_id for turn in turns}
+        hits = sorted(doc_id for _, doc_id in self.memory.search(query, k, allowed))
+        passages = []
+        for node_id in hits:
+            turn = self.nodes[node_id]
+            user_text, _, response_text, _ = turn.payload()
+            passages.append(_memory_passage(user_text, turn.is_option, response_text, max_chars))
+        return passages
+
+    def display_messages(self) -> list:
+        """The chat transcript for rendering (same shape as the old chat_messages).
+
+        Turns never change once recorded, so the transcript is built once per head and reused
+        by every rerun until the story moves. The message dicts are shared; don't modify them.
+        """
+        key = self.head.node_id if self.head else None
+        if self._display_cache is not None and self._display_cache[0] == key:
+            return list(self._display_cache[1])
+        messages = []
+        for turn in self.path():
+            user_text, _, response_text, options = turn.payload()
+            if user_text is not None:
+                messages.append({"id": f"u{turn.node_id}", "role": _ROLE_USER,
+                                 "content": user_display_text(user_text, turn.is_option),
+                                 "turn": turn.number - 1})
+            messages.append({"id": f"a{turn.node_id}", "node": turn.node_id, "role": _ROLE_ASSISTANT,
+                             "content": narrative_from_response(response_text),
+                             "options": list(options), "turn": turn.number})
+        self._display_cache = (key, messages)
+        return list(messages)
+
+    # --- Serialization (shared session store) ---
+    def to_state(self) -> dict:
+        """A JSON-compatible snapshot of the whole tree (compressed turns stay compressed)."""
+        return {
+            "system_prompt": self.system_prompt,
+            "compress_after": self.compress_after,
+            "base_status": self.base_status,
+            "head": self.head.node_id if self.head else None,
+            "turns": [
+                [turn.node_id, turn.parent.node_id if turn.parent else None, turn.is_option, turn.status_delta,
+                 base64.b64encode(turn.packed).decode("ascii") if turn.packed is not None else None,
+                 None if turn.packed is not None else [turn.user_text, turn.messages, turn.response_text, turn.options]]
+                for turn in self.nodes
+            ],
+        }
+
+    @classmethod
+    def from_state(cls, state: dict) -> "TurnStore":
+        """Rebuilds a store from `to_state()` output, including its memory index."""
+        store = cls(state["system_prompt"], state["base_status"], compress_after=state["compress_after"])
+        for node_id, parent_id, is_option, status_delta, packed, payload in state["turns"]:
+            parent = store.nodes[parent_id] if parent_id is not None else None
+            if payload is not None:
+                # Same interning as add_turn: roles, tool names and option labels, not message contents
+                user_text, messages, response_text, options = payload
+                messages = tuple(_intern_packed(message) for message in messages)
+                options = tuple(_intern(option) for option in options)
+                if is_option and user_text is not None:
+                    user_text = _intern(user_text)
+            else:
+                user_text = messages = response_text = options = None
+            turn = Turn(node_id, parent, user_text, is_option, messages, response_text, options, status_delta)
+            if packed is not None:
+                turn.packed = base64.b64decode(packed)
+            store.nodes.append(turn)
+            user_text, _, response_text, _ = turn.payload()
+            store.memory.add(node_id, _memory_passage(user_text, is_option, response_text))
+        if state["head"] is not None:
+            store.rewind(state["head"])
+        return store
+
+    # --- Spilling to disk (idle sessions) ---
+    @property
+    def spilled(self) -> bool:
+        return self.spill_path is not None
+
+    def spill(self, path: str) -> int:
+        """Writes the tree to `path` (zlib-compressed JSON) and frees the turns; returns the bytes written."""
+        data = zlib.compress(json.dumps(self.to_state(), separators=(",", ":")).encode("utf-8"))
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path) # Never leave a half-written spill file behind
+        self.nodes = []
+        self.head = None
+        self._head_status = {}
+        self.memory = BM25Index()
+        self._display_cache = None
+        self.spill_path = path
+        # If the session ends while spilled, its file goes with it
+        self._spill_cleanup = weakref.finalize(self, _remove_file, path)
+        return len(data)
+
+    def rehydrate(self):
+        """Loads spilled turns back into memory and deletes the spill file."""
+        with open(self.spill_path, "rb") as f:
+            restored = TurnStore.from_state(json.loads(zlib.decompress(f.read())))
+        self.nodes, self.head, self._head_status, self.memory = (restored.nodes, restored.head,
+                                                                 restored._head_status, restored.memory)
+        self._spill_cleanup()
+        self._spill_cleanup = None
+        self.spill_path = None
+
+    # --- Memory accounting ---
+    def memory_bytes(self) -> int:
+        """Approximate bytes held by this store (shared interned strings counted once)."""
+        return deep_sizeof(self)
+
+    def memory_report(self) -> dict:
+        """Turn counts and approximate size of this store."""
+        return {
+            "turns": len(self.nodes),
+            "branch_length": self.turn_count,
+            "compressed_turns": sum(1 for turn in self.nodes if turn.packed is not None),
+            "bytes": self.memory_bytes(),
+        }
+
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def deep_sizeof(obj, seen: set = None) -> int:
+    """Recursive sys.getsizeof over containers, dicts and __slots__/__dict__ objects."""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, int, float, bool, type(None))):
+        return size
+    if isinstance(obj, dict):
+        return size + sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return size + sum(deep_sizeof(item, seen) for item in obj)
+    for slot in getattr(type(obj), "__slots__", ()):
+        if hasattr(obj, slot):
+            size += deep_sizeof(getattr(obj, slot), seen)
+    if hasattr(obj, "__dict__") and not isinstance(obj, weakref.WeakSet):
+        size += deep_sizeof(vars(obj), seen)
+    return size
+
+
+def session_memory_report() -> dict:
+    """Bytes per live session store across the whole process (for server sizing)."""
+    sizes = [store.memory_bytes() for store in list(_live_stores)]
+    return {
+        "sessions": len(sizes),
+        "total_bytes": sum(sizes),
+        "mean_bytes": sum(sizes) // len(sizes) if sizes else 0,
+        "max_bytes": max(sizes) if sizes else 0,
+    }
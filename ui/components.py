@@ -1,26 +1,72 @@
 import streamlit as st
 
+from config import CAST_PAGE_SIZE
+
 # --- Display Character Status ---
-def display_character_status():
-    """Displays character status cards in the main area."""
+def _character_card(char_name: str, char_info: dict):
+    """Renders one character status card."""
+    # Mood and items only appear once the story's tools have set them
+    extra_lines = ""
+    if char_info.get("mood"):
+        extra_lines += f'<div class="character-location">🙂 {char_info["mood"]}</div>'
+    if char_info.get("items"):
+        extra_lines += f'<div class="character-location">🎒 {", ".join(char_info["items"])}</div>'
+    st.markdown(f"""
+    <div class="character-card">
+        <div class="character-name">{char_name}</div>
+        <div class="character-role">{char_info["role"]}</div>
+        <div class="character-location">📍 {char_info["location"]}</div>
+        {extra_lines}
+    </div>
+    """, unsafe_allow_html=True)
+
+
+def _character_cards(names: list, character_status: dict):
+    """Renders cards for the given characters, up to 3 per row."""
+    # Use st.columns directly, it returns a list of column objects
+    cols = st.columns(min(len(names), 3)) # Max 3 columns per row
+    for i, char_name in enumerate(names):
+        with cols[i % len(cols)]: # Ensure index stays within the number of columns created
+            _character_card(char_name, character_status[char_name])
+
+
+def _set_cast_page(page: int):
+    st.session_state.cast_page = page
+
+
+def display_character_status(active: list = None):
+    """Displays character status cards in the main area.
+
+    With `active` (the current scene of a large cast), those characters come first and the
+    rest of the cast is collapsed and paginated, so the cards rendered per rerun stay bounded.
+    """
     if 'character_status' not in st.session_state or not st.session_state.character_status:
         return # Don't display if no characters are set up
+    character_status = st.session_state.character_status
 
     st.subheader("🧙‍♂️ Character Status")
 
-    # Calculate number of columns based on character count
-    num_characters = len(st.session_state.character_status)
-    # Use st.columns directly, it returns a list of column objects
-    cols = st.columns(min(num_characters, 3)) # Max 3 columns per row
-
-    # Display each character in a column
-    for i, (char_name, char_info) in enumerate(st.session_state.character_status.items()):
-        col_index = i % len(cols) # Ensure index stays within the number of columns created
-        with cols[col_index]:
-            st.markdown(f"""
-            <div class="character-card">
-                <div class="character-name">{char_name}</div>
-                <div class="character-role">{char_info["role"]}</div>
-                <div class="character-location">📍 {char_info["location"]}</div>
-            </div>
-            """, unsafe_allow_html=True)
+    if active is None:
+        # Display each character in a column
+        _character_cards(list(character_status), character_status)
+        return
+
+    _character_cards(active, character_status)
+    in_scene = set(active)
+    others = [name for name in character_status if name not in in_scene]
+    if not others:
+        return
+    with st.expander(f"Rest of the cast ({len(others)})"):
+        pages = (len(others) + CAST_PAGE_SIZE - 1) // CAST_PAGE_SIZE
+        # The page is clamped, since the scene (and so the rest of the cast) changes between turns
+        page = min(st.session_state.get("cast_page", 0), pages - 1)
+        _character_cards(others[page * CAST_PAGE_SIZE:(page + 1) * CAST_PAGE_SIZE], character_status)
+        if pages > 1:
+            col1, col2, col3 = st.columns([1, 2, 1])
+            with col1:
+                st.button("← Previous", key="cast_prev", disabled=page == 0, on_click=_set_cast_page, args=(page - 1,))
+            with col2:
+                st.caption(f"Page {page + 1} of {pages}")
+            with col3:
+                st.button("Next →", key="cast_next", disabled=page >= pages - 1, on_click=_set_cast_page,
+                          args=(page + 1,))
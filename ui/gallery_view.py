@@ -0,0 +1,87 @@
+import time
+
+import streamlit as st
+
+from core.helpers import export_story
+
+PAGE_SIZE = 20
+
+# --- Story Gallery ---
+def show_gallery(archive):
+    """Browse and read finished stories from the archive."""
+    st.markdown("<h2 class='setup-header'>📚 Story Gallery</h2>", unsafe_allow_html=True)
+    if st.button("← Back", key="gallery_back"):
+        st.session_state.show_gallery = False
+        st.session_state.pop("gallery_story_id", None)
+        st.rerun()
+
+    story_id = st.session_state.get("gallery_story_id")
+    if story_id:
+        _show_archived_story(archive, story_id)
+        return
+
+    col1, col2 = st.columns(2)
+    with col1:
+        genre = st.selectbox("Genre", ["All genres"] + archive.genres(), key="gallery_genre")
+    with col2:
+        character = st.text_input("Character name", key="gallery_character", placeholder="e.g. Elara")
+    filters = dict(genre=None if genre == "All genres" else genre, character=character)
+    page_number = st.session_state.get("gallery_page", 0)
+    entries, total = archive.browse(offset=page_number * PAGE_SIZE, limit=PAGE_SIZE, **filters)
+    if not entries and page_number:
+        # The filters changed and the page is past the end: back to the first page
+        page_number = st.session_state.gallery_page = 0
+        entries, total = archive.browse(offset=0, limit=PAGE_SIZE, **filters)
+
+    if not total:
+        st.info("No finished stories yet. Stories are saved here when you start a new one or press 'Save to Gallery'.")
+        return
+
+    st.caption(f"{total} stories")
+    for entry in entries:
+        archived = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["archived_at"]))
+        st.markdown(f"""
+        <div class="timeline-item">
+            <div class="timeline-turn">{entry["genre"]} · {entry["turns"]} turns · {archived}</div>
+            <div class="timeline-content">{entry["title"] or ", ".join(entry["characters"])}</div>
+        </div>
+        """, unsafe_allow_html=True)
+        if st.button("Read", key=f"gallery_read_{entry['story_id']}"):
+            st.session_state.gallery_story_id = entry["story_id"]
+            st.rerun()
+
+    pages = (total + PAGE_SIZE - 1) // PAGE_SIZE
+    if pages > 1:
+        col1, col2, col3 = st.columns([1, 2, 1])
+        with col1:
+            if st.button("← Newer", key="gallery_prev", disabled=page_number == 0):
+                st.session_state.gallery_page = page_number - 1
+                st.rerun()
+        with col2:
+            st.caption(f"Page {page_number + 1} of {pages}")
+        with col3:
+            if st.button("Older →", key="gallery_next", disabled=page_number >= pages - 1):
+                st.session_state.gallery_page = page_number + 1
+                st.rerun()
+
+
+def _show_archived_story(archive, story_id: str):
+    """Renders one archived story read from the archive."""
+    story = archive.read(story_id)
+    if story is None:
+        st.warning("This story is no longer in the archive.")
+        return
+    meta = story["meta"]
+    st.markdown(f"**{meta['genre']}** with {', '.join(meta['characters'])} · {meta['turns']} turns")
+    for message in story["messages"]:
+        css_class = "user-message" if message["role"] == "user" else "ai-message"
+        st.markdown(f"<div class='{css_class}'>{message['content']}</div>", unsafe_allow_html=True)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button("Download Story Text", data=export_story(story["messages"]),
+                           file_name="archived_adventure.txt", mime="text/plain", key="gallery_download")
+    with col2:
+        if st.button("Back to the gallery", key="gallery_close_story"):
+            del st.session_state.gallery_story_id
+            st.rerun()
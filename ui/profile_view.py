@@ -0,0 +1,23 @@
+import json
+
+import streamlit as st
+
+# --- Rerun Profile Panel ---
+def show_rerun_profile(profiler, session_id: str):
+    """Shows this session's rerun timings in the sidebar, with a download and save-to-file option."""
+    with st.expander("⏱️ Rerun Profile"):
+        snapshot = profiler.snapshot()
+        st.caption("Times from finished reruns; the current rerun is added next time.")
+        st.json(snapshot)
+        if profiler.last_cprofile:
+            st.markdown("**cProfile (latest rerun, by cumulative time)**")
+            st.code(profiler.last_cprofile, language="text")
+
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button("Download", data=json.dumps(snapshot, indent=2),
+                               file_name=f"rerun-profile-{session_id}.json", mime="application/json",
+                               key="download_rerun_profile")
+        with col2:
+            if st.button("Save to file", key="save_rerun_profile"):
+                st.caption(f"Saved to {profiler.dump(session_id)}")
@@ -5,8 +5,12 @@ from data import get_character_recommendations
 from config import GENRE_OPTIONS
 
 # --- Character Selection Interface ---
-def show_character_selection():
-    """Displays the interface for selecting and customizing characters before starting the story."""
+def show_character_selection(enricher=None):
+    """Displays the interface for selecting and customizing characters before starting the story.
+
+    With an `enricher` (core/enrichment.py), custom characters get a generated description and
+    starting location when the story starts.
+    """
     st.markdown("<div class='setup-container'>", unsafe_allow_html=True)
     st.markdown("<h2 class='setup-header'>Choose Your Characters</h2>", unsafe_allow_html=True)
 
@@ -171,13 +175,29 @@ def show_character_selection():
     # Button to start the adventure
     if len(st.session_state.selected_characters) >= 2:
         if st.button("Start Your Adventure", key="start_adventure_button", use_container_width=True): # Unique key
+            # Preset characters bring their descriptions; custom ones are enriched by the model (all at once)
+            preset_descriptions = {(c["name"], c["role"]): c["description"]
+                                   for presets in all_recommendations.values() for c in presets}
+            custom_characters = [c for c in st.session_state.selected_characters
+                                 if (c["name"], c["role"]) not in preset_descriptions]
+            enriched = {}
+            if enricher is not None and custom_characters:
+                with st.spinner("Bringing your characters to life..."):
+                    enriched = enricher.enrich(selected_genre, custom_characters, st.session_state.get("session_id"))
+
             # Convert selected characters to character status format
             st.session_state.character_status = {}
             for char in st.session_state.selected_characters:
-                st.session_state.character_status[char["name"]] = {
+                details = enriched.get(char["name"], {})
+                status = {
                     "role": char["role"],
-                    "location": char["location"] # Use the default starting location
+                    # Use the generated starting location, or the default one
+                    "location": details.get("location") or char["location"]
                 }
+                description = preset_descriptions.get((char["name"], char["role"])) or details.get("description")
+                if description:
+                    status["description"] = description
+                st.session_state.character_status[char["name"]] = status
 
             # Set story started flag
             st.session_state.story_started = True